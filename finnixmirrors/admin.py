@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import MirrorURL, Mirror
+from .models import MirrorURL, Mirror, RedirectCount
 
 
 class MirrorAdmin(admin.ModelAdmin):
@@ -16,15 +16,25 @@ class MirrorURLAdmin(admin.ModelAdmin):
         "mirror",
         "enabled",
         "weight",
+        "capacity",
         "check_success",
         "date_last_check",
         "date_last_success",
         "date_last_trace",
+        "next_check_at",
     )
     ordering = ("mirror", "protocol")
     search_fields = ("mirror__slug", "mirror__sponsor", "url")
     list_filter = ("enabled", "check_success")
 
 
+class RedirectCountAdmin(admin.ModelAdmin):
+    list_display = ("mirrorurl", "period", "count")
+    ordering = ("-period", "mirrorurl")
+    search_fields = ("mirrorurl__mirror__slug",)
+    list_select_related = ("mirrorurl__mirror",)
+
+
 admin.site.register(Mirror, MirrorAdmin)
 admin.site.register(MirrorURL, MirrorURLAdmin)
+admin.site.register(RedirectCount, RedirectCountAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FinnixMirrorsAppConfig(AppConfig):
     name = "finnixmirrors"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -2,6 +2,9 @@
 ASGI config for finnixmirrors project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is the production entry point (see gunicorn.conf.py): the
+/releases/, mirrors.json and mirrors/events views are async, and
+long-lived mirrors/events streams would each hold a thread under WSGI.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -0,0 +1,106 @@
+"""Streaming multipart/byteranges parsing"""
+
+import hashlib
+import re
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+MAX_LINE = 4096
+
+
+def boundary_from_content_type(content_type):
+    """Return the boundary of a multipart/byteranges Content-Type, or None"""
+    mime_type, _, params = content_type.partition(";")
+    if mime_type.strip().lower() != "multipart/byteranges":
+        return
+    for param in params.split(";"):
+        k, _, v = param.strip().partition("=")
+        if k.lower() == "boundary" and v:
+            return v.strip('"')
+
+
+def parse_content_range(value):
+    """Return (begin, end, complete length or None) from a Content-Range"""
+    m = CONTENT_RANGE_RE.match((value or "").strip())
+    if not m:
+        raise ValueError("Invalid Content-Range: {}".format(value))
+    return (
+        int(m.group(1)),
+        int(m.group(2)),
+        None if m.group(3) == "*" else int(m.group(3)),
+    )
+
+
+class _ChunkReader:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b""
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            raise ValueError("Unexpected end of multipart body")
+        self._buf += chunk
+
+    def readline(self):
+        while b"\r\n" not in self._buf:
+            if len(self._buf) > MAX_LINE:
+                raise ValueError("Multipart line too long")
+            try:
+                self._fill()
+            except ValueError:
+                # The close delimiter may not be followed by a CRLF
+                if not self._buf:
+                    raise
+                line, self._buf = self._buf, b""
+                return line
+        line, _, self._buf = self._buf.partition(b"\r\n")
+        return line
+
+    def read_into(self, h, length):
+        while length:
+            if not self._buf:
+                self._fill()
+            data = self._buf[:length]
+            self._buf = self._buf[len(data) :]
+            h.update(data)
+            length -= len(data)
+
+
+def hash_byteranges(chunks, boundary, hash_types):
+    """Hash each part of a multipart/byteranges body as it streams
+
+    chunks is an iterable of bytes, and hash_types maps the (begin, end)
+    of each requested range to a hashlib algorithm name.  Returns a dict
+    mapping (begin, end) to (hexdigest, complete length).  Raises
+    ValueError if the body is malformed or its parts do not match the
+    requested ranges exactly (e.g. the server merged them).
+    """
+    reader = _ChunkReader(chunks)
+    delimiter = b"--" + boundary.encode("ascii")
+    out = {}
+    while True:
+        line = reader.readline()
+        if line == delimiter + b"--":
+            break
+        if line != delimiter:
+            if out or line.strip():
+                raise ValueError("Unexpected multipart line: {!r}".format(line[:80]))
+            continue
+        headers = {}
+        while True:
+            line = reader.readline()
+            if not line:
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        begin, end, length = parse_content_range(headers.get("content-range"))
+        if (begin, end) not in hash_types or (begin, end) in out:
+            raise ValueError("Unexpected part: bytes {}-{}".format(begin, end))
+        h = hashlib.new(hash_types[(begin, end)])
+        reader.read_into(h, end - begin + 1)
+        if reader.readline():
+            raise ValueError("Missing CRLF after part body")
+        out[(begin, end)] = (h.hexdigest(), length)
+    if set(out) != set(hash_types):
+        raise ValueError("Missing parts in multipart body")
+    return out
@@ -0,0 +1,107 @@
+"""MirrorURL status change log
+
+Every status transition of a MirrorURL (a check starting or stopping to
+succeed, the URL being enabled, disabled, added, removed or edited) is
+recorded as a MirrorURLChange with a monotonic sequence number, which
+mirrors.json?since=<seq> and the mirrors/events stream serve to clients.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ChangeLogState, MirrorURLChange
+
+# Fields whose changes are status transitions, of MirrorURLs and of the
+# Mirrors they belong to
+STATUS_FIELDS = ("enabled", "check_success", "url", "protocol", "ipv4", "ipv6")
+MIRROR_STATUS_FIELDS = ("slug", "enabled")
+
+
+def url_state(mirrorurl):
+    """Return the public state of a MirrorURL, as in mirrors.json"""
+    return {
+        "url": mirrorurl.url,
+        "protocol": mirrorurl.protocol,
+        "ipv4": mirrorurl.ipv4,
+        "ipv6": mirrorurl.ipv6,
+        "check_success": mirrorurl.check_success,
+        "date_last_check": mirrorurl.date_last_check,
+        "date_last_success": mirrorurl.date_last_success,
+        "date_last_trace": mirrorurl.date_last_trace,
+        "head_allowed": mirrorurl.head_allowed,
+        "range_allowed": mirrorurl.range_allowed,
+    }
+
+
+def record_changes(mirrorurls, event="changed"):
+    """Record a change for each of a list of MirrorURLs"""
+    MirrorURLChange.objects.bulk_create(
+        [
+            MirrorURLChange(
+                url_id=mirrorurl.id,
+                mirror_slug=mirrorurl.mirror.slug,
+                event=event,
+                enabled=(
+                    event != "deleted"
+                    and mirrorurl.enabled
+                    and mirrorurl.mirror.enabled
+                ),
+                state=url_state(mirrorurl),
+            )
+            for mirrorurl in mirrorurls
+        ]
+    )
+
+
+def change_info(change):
+    return {
+        "seq": change.seq,
+        "date": change.date,
+        "event": change.event,
+        "id": str(change.url_id),
+        "mirror": change.mirror_slug,
+        "enabled": change.enabled,
+        "state": change.state,
+    }
+
+
+def pruned_seq():
+    """Return the highest seq deleted from the change log, or 0"""
+    return ChangeLogState.objects.values_list("pruned_seq", flat=True).first() or 0
+
+
+def latest_seq():
+    """Return the highest seq recorded, including pruned changes"""
+    return max(
+        MirrorURLChange.objects.aggregate(seq=Max("seq"))["seq"] or 0, pruned_seq()
+    )
+
+
+def changes_since(seq, limit):
+    """Return changes after seq, or None if some were already pruned"""
+    if seq < pruned_seq():
+        return
+    return list(MirrorURLChange.objects.filter(seq__gt=seq).order_by("seq")[:limit])
+
+
+def prune_changes():
+    """Delete changes older than CHANGE_LOG_RETENTION seconds
+
+    The highest deleted seq is kept, so clients behind it can be told to
+    start over even once every change has been pruned.
+    """
+    with transaction.atomic():
+        old = MirrorURLChange.objects.filter(
+            date__lt=timezone.now()
+            - timezone.timedelta(seconds=settings.CHANGE_LOG_RETENTION)
+        )
+        seq = old.aggregate(seq=Max("seq"))["seq"]
+        if seq is None:
+            return
+        state, _ = ChangeLogState.objects.get_or_create(pk=1)
+        if seq > state.pruned_seq:
+            state.pruned_seq = seq
+            state.save()
+        MirrorURLChange.objects.filter(seq__lte=seq).delete()
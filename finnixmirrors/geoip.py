@@ -0,0 +1,139 @@
+import collections
+import ipaddress
+import os
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import geoip2.database as geoip_db
+    import geoip2.errors as geoip_errors
+except ImportError as e:
+    geoip_db = e
+    geoip_errors = e
+
+
+# IPv4 clients are cached per /24, IPv6 clients per /48
+CACHE_PREFIXLEN = {4: 24, 6: 48}
+
+
+def client_network(ip):
+    """Return the network an IP address is grouped into for caching and routing"""
+    ip = ipaddress.ip_address(ip)
+    return ipaddress.ip_network(
+        "{}/{}".format(ip, CACHE_PREFIXLEN[ip.version]), strict=False
+    )
+
+
+class GeoIPReader:
+    """Process-wide GeoIP2 City reader
+
+    The database is opened once (memory-mapped where possible) and
+    transparently reopened when the file's mtime or inode changes, so
+    database updates are picked up without restarting the worker.
+    City lookups are kept in a bounded LRU cache keyed by client network.
+    """
+
+    def __init__(self, path, cache_size=4096, check_interval=10):
+        self.path = path
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._reader = None
+        self._stat_key = None
+        self._next_check = 0
+
+    def _open(self):
+        try:
+            return geoip_db.Reader(self.path, mode=geoip_db.MODE_MMAP_EXT)
+        except ValueError:
+            # C extension not available
+            return geoip_db.Reader(self.path, mode=geoip_db.MODE_MMAP)
+
+    def _file_stat_key(self):
+        st = os.stat(self.path)
+        return (st.st_ino, st.st_mtime_ns)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self._reader is not None and now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        stat_key = self._file_stat_key()
+        if self._reader is not None and stat_key == self._stat_key:
+            return
+        if self._reader is not None:
+            self.reloads += 1
+        # In-flight lookups may still hold the old reader; let it be
+        # closed when the last reference goes away.
+        self._reader = self._open()
+        self._stat_key = stat_key
+        self._cache.clear()
+
+    @property
+    def reader(self):
+        with self._lock:
+            self._maybe_reload()
+            return self._reader
+
+    def city(self, ip):
+        """Return a City response, or None if the IP is not in the database"""
+        key = client_network(ip)
+        with self._lock:
+            self._maybe_reload()
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            reader = self._reader
+
+        try:
+            response = reader.city(ip)
+        except geoip_errors.AddressNotFoundError:
+            response = None
+
+        with self._lock:
+            self._cache[key] = response
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return response
+
+    def cache_info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "maxsize": self.cache_size,
+                "reloads": self.reloads,
+            }
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader():
+    """Return the process-wide GeoIPReader, or None if GeoIP is unavailable"""
+    global _reader
+
+    path = getattr(settings, "GEOIP2_DB", None)
+    if not path:
+        return
+    if isinstance(geoip_db, ImportError):
+        return
+
+    with _reader_lock:
+        if _reader is None or _reader.path != path:
+            _reader = GeoIPReader(
+                path,
+                cache_size=getattr(settings, "GEOIP2_CACHE_SIZE", 4096),
+                check_interval=getattr(settings, "GEOIP2_RELOAD_CHECK_INTERVAL", 10),
+            )
+        return _reader
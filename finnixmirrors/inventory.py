@@ -0,0 +1,143 @@
+"""Compact per-mirror file inventories
+
+An inventory is the sorted set of 64-bit hashes of every path (files
+and directories, relative to the mirror URL) a mirror carries, packed
+as big-endian integers.  Membership tests are a binary search.
+"""
+
+import array
+import bisect
+import hashlib
+import html.parser
+import struct
+import sys
+import urllib.parse
+
+
+def normalize_path(path):
+    return "/".join(x for x in path.split("/") if x and x != ".")
+
+
+def path_hash(path):
+    return int.from_bytes(
+        hashlib.blake2b(normalize_path(path).encode("UTF-8"), digest_size=8).digest(),
+        "big",
+    )
+
+
+def pack_inventory(paths):
+    """Return the packed inventory of an iterable of paths"""
+    hashes = sorted({path_hash(x) for x in paths})
+    return struct.pack(">{}Q".format(len(hashes)), *hashes)
+
+
+class Inventory:
+    """Read-only inventory for membership tests"""
+
+    __slots__ = ("_hashes",)
+
+    def __init__(self, packed):
+        self._hashes = array.array("Q")
+        self._hashes.frombytes(bytes(packed))
+        if sys.byteorder == "little":
+            self._hashes.byteswap()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, path):
+        if not normalize_path(path):
+            return True
+        h = path_hash(path)
+        i = bisect.bisect_left(self._hashes, h)
+        return i < len(self._hashes) and self._hashes[i] == h
+
+    def __bytes__(self):
+        hashes = array.array("Q", self._hashes)
+        if sys.byteorder == "little":
+            hashes.byteswap()
+        return hashes.tobytes()
+
+
+class MappedInventory:
+    """Read-only inventory searched in place in a packed buffer
+
+    Big-endian hashes sort as their bytes do, so membership tests
+    compare 8-byte slices without decoding the inventory, which can
+    stay in a shared memory-mapped file.
+    """
+
+    __slots__ = ("_buffer", "_offset", "_count")
+
+    def __init__(self, buffer, offset, count):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, path):
+        if not normalize_path(path):
+            return True
+        key = path_hash(path).to_bytes(8, "big")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._offset + 8 * mid
+            if self._buffer[pos : pos + 8] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        pos = self._offset + 8 * lo
+        return lo < self._count and self._buffer[pos : pos + 8] == key
+
+    def __bytes__(self):
+        return bytes(self._buffer[self._offset : self._offset + 8 * self._count])
+
+
+def parse_rsync_list(output):
+    """Yield (path, is_directory) from "rsync --list-only -r" output"""
+    for line in output.splitlines():
+        fields = line.split(None, 4)
+        if len(fields) != 5 or fields[0][0] not in "-dl":
+            continue
+        path = fields[4]
+        if fields[0][0] == "l":
+            path = path.split(" -> ", 1)[0]
+        if path != ".":
+            yield (path, fields[0][0] == "d")
+
+
+class _LinkParser(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+
+def parse_index_links(text):
+    """Yield (name, is_directory) for the entries of an HTML directory index
+
+    Only relative links to immediate children are considered, which
+    skips sorting links, parent directory links and absolute links.
+    """
+    parser = _LinkParser()
+    parser.feed(text)
+    seen = set()
+    for href in parser.links:
+        url = urllib.parse.urlsplit(href)
+        if url.scheme or url.netloc or url.query or url.path.startswith(("/", ".")):
+            continue
+        name = urllib.parse.unquote(url.path)
+        is_directory = name.endswith("/")
+        name = name.rstrip("/")
+        if not name or "/" in name or name in seen:
+            continue
+        seen.add(name)
+        yield (name, is_directory)
@@ -0,0 +1,101 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+try:
+    import maxminddb
+except ImportError as e:
+    maxminddb = e
+
+from finnixmirrors.prefixtable import geoip_db_key, write_table
+from finnixmirrors.routing import RoutingSnapshot
+from finnixmirrors.state import get_generation
+
+
+class Command(BaseCommand):
+    help = "Compile the IP prefix to mirror routing table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--candidates",
+            type=int,
+            default=settings.ROUTING_TABLE_CANDIDATES,
+            help="Number of ranked mirrors to store per network",
+        )
+        parser.add_argument(
+            "--output", help="Output file (default: settings.ROUTING_TABLE_FILE)"
+        )
+
+    def append_range(self, ranges, start, end, candidates):
+        if ranges and ranges[-1][1] + 1 == start and ranges[-1][2] == candidates:
+            ranges[-1] = (ranges[-1][0], end, candidates)
+        else:
+            ranges.append((start, end, candidates))
+
+    def handle(self, *args, **options):
+        logging.getLogger("").setLevel(
+            logging.DEBUG if int(options["verbosity"]) >= 2 else logging.INFO
+        )
+
+        geoip_path = getattr(settings, "GEOIP2_DB", None)
+        if not geoip_path:
+            raise CommandError("settings.GEOIP2_DB is not set")
+        if isinstance(maxminddb, ImportError):
+            raise CommandError("maxminddb is not available: {}".format(maxminddb))
+        output = options["output"] or settings.ROUTING_TABLE_FILE
+        if not output:
+            raise CommandError("settings.ROUTING_TABLE_FILE is not set")
+        if not 1 <= options["candidates"] < 0xFFFF:
+            raise CommandError("Invalid --candidates")
+
+        snapshot = RoutingSnapshot.build(get_generation())
+        mirrorurls = snapshot.ranker.mirrorurls
+        indexes = {x.id: i for i, x in enumerate(mirrorurls)}
+        geoip_key = geoip_db_key(geoip_path)
+
+        # Many networks share the same coordinates; rank each location once
+        ranked = {}
+        networks = 0
+        ranges = {4: [], 6: []}
+        with maxminddb.open_database(geoip_path, maxminddb.MODE_MMAP) as reader:
+            for network, record in reader:
+                networks += 1
+                location = (record or {}).get("location", {})
+                latitude = location.get("latitude")
+                longitude = location.get("longitude")
+                if latitude is None or longitude is None:
+                    continue
+                if (latitude, longitude) not in ranked:
+                    ranked[(latitude, longitude)] = tuple(
+                        (indexes[mirrorurl.id], round(mirror_distance))
+                        for mirrorurl, mirror_distance, _ in snapshot.ranker.rank(
+                            latitude, longitude, limit=options["candidates"]
+                        )
+                    )
+                candidates = ranked[(latitude, longitude)]
+                if not candidates:
+                    continue
+                self.append_range(
+                    ranges[network.version],
+                    int(network.network_address),
+                    int(network.broadcast_address),
+                    candidates,
+                )
+
+        for version in (4, 6):
+            ranges[version].sort()
+        header = {
+            "built": timezone.now().isoformat(),
+            "generation": snapshot.generation,
+            "routing_key": snapshot.routing_key,
+            "geoip_db": geoip_key,
+            "mirrorurls": [str(x.id) for x in mirrorurls],
+        }
+        write_table(output, header, ranges[4], ranges[6], options["candidates"])
+        logging.info(
+            "Wrote {}: {} networks, {} locations, {} IPv4 and {} IPv6 ranges".format(
+                output, networks, len(ranked), len(ranges[4]), len(ranges[6])
+            )
+        )
@@ -0,0 +1,141 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pathlib
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def hash_file(file, relpath, range_count, chunk_size, hash_type, sweep_chunk_size):
+    """Hash ranges spread evenly over a file
+
+    The file is divided into range_count equal strata, and one
+    chunk_size-aligned range is picked at random from each.  If
+    sweep_chunk_size is set, the whole file and each consecutive
+    sweep_chunk_size chunk of it are hashed as well, for full-file
+    sweeps.
+    """
+    length = file.stat().st_size
+    out = {"path": relpath, "length": length, "ranges": []}
+    if length < chunk_size:
+        return out
+
+    with file.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if sweep_chunk_size:
+            h = hashlib.new(hash_type)
+            chunk_hashes = []
+            for begin in range(0, length, sweep_chunk_size):
+                data = mm[begin : begin + sweep_chunk_size]
+                h.update(data)
+                chunk_hashes.append(hashlib.new(hash_type, data).hexdigest())
+            out["hashes"] = {hash_type: h.hexdigest()}
+            out["chunks"] = {
+                "size": sweep_chunk_size,
+                "hash_type": hash_type,
+                "hashes": chunk_hashes,
+            }
+
+        chunks = length // chunk_size
+        range_count = min(range_count, chunks)
+        for i in range(range_count):
+            chunk = random.randrange(
+                i * chunks // range_count, (i + 1) * chunks // range_count
+            )
+            begin = chunk * chunk_size
+            out["ranges"].append(
+                {
+                    "begin": begin,
+                    "end": begin + chunk_size - 1,
+                    "hash": hashlib.new(
+                        hash_type, mm[begin : begin + chunk_size]
+                    ).hexdigest(),
+                    "hash_type": hash_type,
+                }
+            )
+    return out
+
+
+class Command(BaseCommand):
+    help = "Generate a data file range hash manifest from a local release tree"
+
+    def add_arguments(self, parser):
+        parser.add_argument("root", type=pathlib.Path, help="Local release tree")
+        parser.add_argument(
+            "files",
+            nargs="*",
+            help="Files relative to the root (default: all matching --pattern)",
+        )
+        parser.add_argument("--pattern", default="*/*.iso")
+        parser.add_argument(
+            "--output", help="Output file (default: settings.CHECK_DATA_MANIFEST)"
+        )
+        parser.add_argument(
+            "--ranges", type=int, default=256, help="Number of ranges per file"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=1024, help="Size of each range"
+        )
+        parser.add_argument("--hash-type", default="sha256")
+        parser.add_argument(
+            "--sweep-chunk-size",
+            type=int,
+            default=4 * 1024 * 1024,
+            help="Size of each full-file sweep chunk (0 to skip full-file hashes)",
+        )
+        parser.add_argument(
+            "--jobs", type=int, default=os.cpu_count(), help="Worker processes"
+        )
+
+    def handle(self, *args, **options):
+        logging.getLogger("").setLevel(
+            logging.DEBUG if int(options["verbosity"]) >= 2 else logging.INFO
+        )
+
+        output = options["output"] or getattr(settings, "CHECK_DATA_MANIFEST", None)
+        if not output:
+            raise CommandError("No --output given and CHECK_DATA_MANIFEST is not set")
+        if options["hash_type"] not in hashlib.algorithms_available:
+            raise CommandError("Unknown hash type {}".format(options["hash_type"]))
+        root = options["root"]
+        if options["files"]:
+            files = [root / x for x in options["files"]]
+        else:
+            files = sorted(x for x in root.glob(options["pattern"]) if x.is_file())
+        if not files:
+            raise CommandError("No files found")
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=options["jobs"]
+        ) as executor:
+            futures = [
+                executor.submit(
+                    hash_file,
+                    file,
+                    file.relative_to(root).as_posix(),
+                    options["ranges"],
+                    options["chunk_size"],
+                    options["hash_type"],
+                    options["sweep_chunk_size"],
+                )
+                for file in files
+            ]
+            data_files = [future.result() for future in futures]
+
+        data_files.sort(key=lambda x: x["path"])
+        for data_file in data_files:
+            logging.debug(
+                "{}: {} bytes, {} ranges".format(
+                    data_file["path"], data_file["length"], len(data_file["ranges"])
+                )
+            )
+
+        tmp = "{}.{}.tmp".format(output, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "files": data_files}, f, indent=1)
+        os.replace(tmp, output)
+        logging.info("Wrote {} files to {}".format(len(data_files), output))
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from finnixmirrors.views import get_geoip_mirrors, get_mirrorurls
+from finnixmirrors.geoip import get_reader
+from finnixmirrors.routing import get_snapshot
+from finnixmirrors.views import get_geoip_mirrors
 
 
 def collapse_names(d, lang="en"):
@@ -19,16 +22,26 @@ def collapse_names(d, lang="en"):
             collapse_names(k)
 
 
+def format_measurement(value, scale, unit):
+    if value is None:
+        return "n/a"
+    return "{:.0f} {}".format(value * scale, unit)
+
+
 class Command(BaseCommand):
     help = "GeoIP mirror info"
 
     def add_arguments(self, parser):
         parser.add_argument("ip")
+        parser.add_argument(
+            "--exact",
+            action="store_true",
+            help="Use exact geodesic distances instead of haversine (requires geopy)",
+        )
 
     def handle(self, *args, **options):
         ip = options["ip"]
-        mirrorurls = get_mirrorurls()
-        ret = get_geoip_mirrors(mirrorurls, ip)
+        ret = get_geoip_mirrors(get_snapshot().ranker, ip, exact=options["exact"])
         if not ret:
             print("No GeoIP information for {}".format(ip))
             return
@@ -44,13 +57,28 @@ class Command(BaseCommand):
         collapse_names(geo)
         for k, v in geo.items():
             print("    {} = {}".format(k, v))
+        print("Effective weight: {}".format(settings.ROUTING_EFFECTIVE_WEIGHT))
         print("Mirrors:")
-        for mirrorurl_info in sorted(distances, key=lambda x: x[2]):
+        for mirrorurl_info in distances:
             mirrorurl = mirrorurl_info[0]
             distance = mirrorurl_info[1]
             weighted_distance = mirrorurl_info[2]
             print(
-                "    distance = {:6.0f}, weighted distance = {:6.0f} (weight {:5.02f}): {}".format(
-                    distance, weighted_distance, mirrorurl.weight, mirrorurl
+                "    distance = {:6.0f}, weighted distance = {:6.0f} (weight {:5.02f}, effective {:5.02f}): {}".format(
+                    distance,
+                    weighted_distance,
+                    mirrorurl.weight,
+                    mirrorurl.effective_weight,
+                    mirrorurl,
                 )
             )
+            print(
+                "        connect = {}, TTFB = {}, throughput = {}".format(
+                    format_measurement(mirrorurl.ewma_connect_time, 1000, "ms"),
+                    format_measurement(mirrorurl.ewma_ttfb, 1000, "ms"),
+                    format_measurement(mirrorurl.ewma_throughput, 1 / 1024, "KiB/s"),
+                )
+            )
+        print("GeoIP cache:")
+        for k, v in get_reader().cache_info().items():
+            print("    {} = {}".format(k, v))
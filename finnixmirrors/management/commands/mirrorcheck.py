@@ -1,18 +1,45 @@
+import concurrent.futures
 import ftplib
 import hashlib
+import itertools
 import logging
 import random
+import socket
 import subprocess
 import tempfile
+import threading
+import time
 import urllib.parse
 
 import dateutil.parser
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Min, Q
 from django.utils import timezone
 import requests
 
+from finnixmirrors import byteranges
+from finnixmirrors.changes import STATUS_FIELDS, prune_changes, record_changes
+from finnixmirrors.inventory import pack_inventory, parse_index_links, parse_rsync_list
+from finnixmirrors.manifest import get_data_files
 from finnixmirrors.models import MirrorURL
+from finnixmirrors.routing import publish_snapshot
+from finnixmirrors.state import batch_bumps, bump_generation
+
+NOT_MODIFIED = object()
+# Fields every check updates; a row with no other changes is only rescheduled
+SCHEDULE_FIELDS = (
+    "date_last_check",
+    "date_last_success",
+    "next_check_at",
+    "check_successes",
+    "check_failures",
+)
+
+
+class CheckError(Exception):
+    pass
 
 
 class Command(BaseCommand):
@@ -22,8 +49,23 @@ class Command(BaseCommand):
     )
 
     def __init__(self):
-        self.rs = requests.Session()
-        self.rs.headers.update({"user-agent": self.user_agent})
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._original = {}
+        self.rows_written = 0
+        self.rows_rescheduled = 0
+        self.rows_skipped = 0
+        self.columns_written = 0
+
+    @property
+    def rs(self):
+        # requests.Session is not guaranteed to be thread-safe, so each
+        # check thread gets its own
+        if not hasattr(self._local, "rs"):
+            self._local.rs = requests.Session()
+            self._local.rs.headers.update({"user-agent": self.user_agent})
+        return self._local.rs
 
     def safe_sample(self, population, k):
         if k > len(population):
@@ -37,11 +79,149 @@ class Command(BaseCommand):
         r.raise_for_status()
         return r
 
+    def field_values(self, mirrorurl):
+        return {
+            f.name: getattr(mirrorurl, f.attname)
+            for f in MirrorURL._meta.concrete_fields
+            if not f.primary_key
+        }
+
+    def track_mirrorurls(self, mirrorurls):
+        """Remember the stored state of MirrorURLs about to be checked"""
+        for mirrorurl in mirrorurls:
+            self._original[mirrorurl.pk] = self.field_values(mirrorurl)
+
+    def schedule_mirrorurl(self, mirrorurl):
+        """Set when a checked MirrorURL should next be checked
+
+        Consecutive successes stretch the interval from CHECK_INTERVAL by
+        CHECK_INTERVAL_GROWTH up to CHECK_INTERVAL_MAX, but never past the
+        point where the mirror would become outdated, and an outdated
+        mirror is checked every CHECK_INTERVAL.  Consecutive failures
+        back off exponentially from CHECK_INTERVAL_FAILURE, and the first
+        success after a failure is confirmed after CHECK_INTERVAL_RECOVERING.
+        """
+        now = timezone.now()
+        original = self._original.get(mirrorurl.pk, {})
+        if not mirrorurl.check_success:
+            mirrorurl.check_failures += 1
+            mirrorurl.check_successes = 0
+            interval = settings.CHECK_INTERVAL_FAILURE * 2 ** min(
+                mirrorurl.check_failures - 1, 32
+            )
+        elif mirrorurl.check_failures or not original.get("check_success", True):
+            mirrorurl.check_failures = 0
+            mirrorurl.check_successes = 1
+            interval = settings.CHECK_INTERVAL_RECOVERING
+        else:
+            original_trace = original.get("date_last_trace")
+            if (
+                original_trace
+                and mirrorurl.date_last_trace
+                and mirrorurl.date_last_trace < original_trace
+            ):
+                # Trace went backwards; the mirror is not stable
+                mirrorurl.check_successes = 1
+            else:
+                mirrorurl.check_successes += 1
+            interval = settings.CHECK_INTERVAL * settings.CHECK_INTERVAL_GROWTH ** min(
+                mirrorurl.check_successes - 1, 32
+            )
+            if mirrorurl.date_last_trace:
+                outdated_at = mirrorurl.date_last_trace + timezone.timedelta(
+                    hours=settings.OUTDATED_HOURS
+                )
+                if outdated_at > now:
+                    interval = min(interval, (outdated_at - now).total_seconds())
+                else:
+                    # Already outdated; don't stretch the interval until
+                    # the mirror catches up
+                    mirrorurl.check_successes = 1
+                    interval = settings.CHECK_INTERVAL
+
+        interval = min(interval, settings.CHECK_INTERVAL_MAX)
+        interval *= random.uniform(1 - settings.CHECK_JITTER, 1 + settings.CHECK_JITTER)
+        mirrorurl.next_check_at = now + timezone.timedelta(
+            seconds=max(interval, settings.CHECK_INTERVAL_RECOVERING)
+        )
+
+    def save_mirrorurl(self, mirrorurl, schedule=True):
+        """Queue a checked MirrorURL to be written in the next batch"""
+        if schedule:
+            self.schedule_mirrorurl(mirrorurl)
+        with self._write_lock:
+            self._pending.append(mirrorurl)
+
+    def flush_mirrorurls(self, full_batch=False):
+        """Write the queued MirrorURLs
+
+        With full_batch, nothing is written until CHECK_WRITE_BATCH_SIZE
+        are queued.  If the write fails (e.g. the database is locked), the
+        error is logged and the batch is queued again for the next flush,
+        rather than failing the check which happened to fill it.
+        """
+        with self._write_lock:
+            if full_batch and len(self._pending) < settings.CHECK_WRITE_BATCH_SIZE:
+                return
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            self.write_batch(batch)
+        except DatabaseError as e:
+            logging.error("Writing {} checked URLs failed: {}".format(len(batch), e))
+            with self._write_lock:
+                self._pending[:0] = batch
+
+    def write_batch(self, batch):
+        """Write changed fields of a batch of MirrorURLs in one transaction"""
+        by_fields = {}
+        transitions = []
+        written = {}
+        rescheduled = 0
+        columns = 0
+        skipped = 0
+        with self._write_lock:
+            for mirrorurl in batch:
+                original = self._original.get(mirrorurl.pk, {})
+                current = self.field_values(mirrorurl)
+                fields = tuple(
+                    k
+                    for k, v in current.items()
+                    if k not in original or original[k] != v
+                )
+                if not fields:
+                    skipped += 1
+                    continue
+                by_fields.setdefault(fields, []).append(mirrorurl)
+                columns += len(fields)
+                if all(k in SCHEDULE_FIELDS for k in fields):
+                    rescheduled += 1
+                if original and any(k in STATUS_FIELDS for k in fields):
+                    transitions.append(mirrorurl)
+                written[mirrorurl.pk] = current
+
+        if by_fields:
+            with transaction.atomic():
+                for fields, mirrorurls in by_fields.items():
+                    MirrorURL.objects.bulk_update(mirrorurls, fields)
+                record_changes(transitions)
+        # Only now is the stored state known to have changed
+        with self._write_lock:
+            self._original.update(written)
+            self.rows_written += len(written)
+            self.rows_rescheduled += rescheduled
+            self.rows_skipped += skipped
+            self.columns_written += columns
+        if by_fields:
+            # bulk_update() does not send post_save
+            bump_generation()
+
     def mirrorurl_failure(self, mirrorurl, error):
         logging.debug("{} error: {}".format(mirrorurl, error))
         mirrorurl.check_success = False
         mirrorurl.check_detail = error
-        mirrorurl.save()
+        self.save_mirrorurl(mirrorurl)
 
     def check_mirrorurl(self, mirrorurl):
         if mirrorurl.protocol in ("http", "https"):
@@ -51,62 +231,289 @@ class Command(BaseCommand):
         elif mirrorurl.protocol == "ftp":
             return self.check_mirrorurl_ftp(mirrorurl)
 
-    def check_mirrorurl_http(self, mirrorurl):
-        now = timezone.now()
-        mirrorurl.date_last_check = now
-        if settings.CHECK_TRACE_FILE:
+    def check_trace_http(self, mirrorurl):
+        headers = {}
+        if mirrorurl.date_last_trace:
+            if mirrorurl.trace_etag:
+                headers["If-None-Match"] = mirrorurl.trace_etag
+            if mirrorurl.trace_last_modified:
+                headers["If-Modified-Since"] = mirrorurl.trace_last_modified
+        r = self.request_url(
+            "{}/{}".format(mirrorurl.url, settings.CHECK_TRACE_FILE), headers=headers
+        )
+        if r.status_code == 304:
+            return
+        mirrorurl.date_last_trace = dateutil.parser.parse(r.text.strip())
+        mirrorurl.trace_etag = r.headers.get("etag")
+        mirrorurl.trace_last_modified = r.headers.get("last-modified")
+
+    def check_data_file_head(self, mirrorurl, data_file):
+        """Check a data file's length with HEAD, returning its validators"""
+        r = self.request_url(
+            "{}/{}".format(mirrorurl.url, data_file["path"]), method="HEAD"
+        )
+
+        head_got_length = int(r.headers["content-length"])
+        if head_got_length != data_file["length"]:
+            raise CheckError(
+                "{} HEAD: Expected {}, got {}".format(
+                    data_file["path"], data_file["length"], head_got_length
+                )
+            )
+
+        return {
+            "etag": r.headers.get("etag"),
+            "last_modified": r.headers.get("last-modified"),
+        }
+
+    def check_data_file_ranges(self, mirrorurl, data_file, ranges):
+        """Verify each range of a data file with its own request"""
+        for range in ranges:
             r = self.request_url(
-                "{}/{}".format(mirrorurl.url, settings.CHECK_TRACE_FILE)
+                "{}/{}".format(mirrorurl.url, data_file["path"]),
+                headers={"Range": "bytes={}-{}".format(range["begin"], range["end"])},
             )
-            mirrorurl.date_last_trace = dateutil.parser.parse(r.text.strip())
 
-        for data_file in self.safe_sample(
-            settings.CHECK_DATA_FILES, settings.CHECK_DATA_FILE_COUNT
-        ):
-            if mirrorurl.head_allowed:
-                r = self.request_url(
-                    "{}/{}".format(mirrorurl.url, data_file["path"]), method="HEAD"
+            hash_got = hashlib.new(
+                range.get("hash_type", "sha256"), r.content
+            ).hexdigest()
+            if hash_got != range["hash"]:
+                raise CheckError(
+                    "{} range {}-{}: Expected {}, got {}".format(
+                        data_file["path"],
+                        range["begin"],
+                        range["end"],
+                        range["hash"],
+                        hash_got,
+                    )
                 )
 
-                head_got_length = int(r.headers["content-length"])
-                if head_got_length != data_file["length"]:
-                    return self.mirrorurl_failure(
-                        mirrorurl,
-                        "{} HEAD: Expected {}, got {}".format(
-                            data_file["path"], data_file["length"], head_got_length
-                        ),
-                    )
+    def check_data_file_multirange(self, mirrorurl, data_file, ranges, stored=None):
+        """Verify all ranges of a data file with one multi-range request
 
-            if mirrorurl.range_allowed:
-                for range in self.safe_sample(
-                    data_file.get("ranges", []), settings.CHECK_DATA_FILE_RANGE_COUNT
-                ):
-                    r = self.request_url(
-                        "{}/{}".format(mirrorurl.url, data_file["path"]),
-                        headers={
-                            "Range": "bytes={}-{}".format(range["begin"], range["end"])
-                        },
+        The complete length reported for each part replaces the HEAD
+        length check.  If stored validators are given, the request is
+        conditional, and NOT_MODIFIED is returned on a 304.  If the server
+        ignores or merges the ranges, multirange_allowed is cleared and
+        None is returned so the caller can fall back to single ranges.
+        Otherwise the response's validators are returned.
+        """
+        headers = {
+            "Range": "bytes={}".format(
+                ",".join("{}-{}".format(x["begin"], x["end"]) for x in ranges)
+            )
+        }
+        if stored and stored.get("etag"):
+            headers["If-None-Match"] = stored["etag"]
+        if stored and stored.get("last_modified"):
+            headers["If-Modified-Since"] = stored["last_modified"]
+
+        with self.rs.get(
+            "{}/{}".format(mirrorurl.url, data_file["path"]),
+            headers=headers,
+            stream=True,
+            timeout=5,
+        ) as r:
+            r.raise_for_status()
+            if r.status_code == 304:
+                return NOT_MODIFIED
+            boundary = byteranges.boundary_from_content_type(
+                r.headers.get("content-type", "")
+            )
+            try:
+                if r.status_code != 206 or not boundary:
+                    raise ValueError("Not a multipart/byteranges response")
+                hashes = byteranges.hash_byteranges(
+                    r.iter_content(chunk_size=65536),
+                    boundary,
+                    {
+                        (x["begin"], x["end"]): x.get("hash_type", "sha256")
+                        for x in ranges
+                    },
+                )
+            except ValueError as e:
+                # Closing the response without reading the body avoids
+                # downloading a whole ISO from servers ignoring Range
+                logging.debug("{} multi-range unsupported: {}".format(mirrorurl, e))
+                mirrorurl.multirange_allowed = False
+                return
+            file_validators = {
+                "etag": r.headers.get("etag"),
+                "last_modified": r.headers.get("last-modified"),
+            }
+
+        mirrorurl.multirange_allowed = True
+        for range in ranges:
+            hash_got, length_got = hashes[(range["begin"], range["end"])]
+            if length_got is not None and length_got != data_file["length"]:
+                raise CheckError(
+                    "{} length: Expected {}, got {}".format(
+                        data_file["path"], data_file["length"], length_got
                     )
+                )
+            if hash_got != range["hash"]:
+                raise CheckError(
+                    "{} range {}-{}: Expected {}, got {}".format(
+                        data_file["path"],
+                        range["begin"],
+                        range["end"],
+                        range["hash"],
+                        hash_got,
+                    )
+                )
+        return file_validators
 
-                    hash_got = hashlib.new(
-                        range.get("hash_type", "sha256"), r.content
-                    ).hexdigest()
-                    if hash_got != range["hash"]:
-                        return self.mirrorurl_failure(
-                            mirrorurl,
-                            "{} range {}-{}: Expected {}, got {}".format(
-                                data_file["path"],
-                                range["begin"],
-                                range["end"],
-                                range["hash"],
-                                hash_got,
-                            ),
-                        )
+    def check_data_file_http(self, mirrorurl, data_file, stored):
+        """Check one data file, returning the validators to store for it"""
+        ranges = []
+        if mirrorurl.range_allowed:
+            ranges = self.safe_sample(
+                data_file.get("ranges", []), settings.CHECK_DATA_FILE_RANGE_COUNT
+            )
+        # Validators are ignored (forcing verification) every Nth run
+        runs = stored.get("runs", 0) + 1
+        if runs >= settings.CHECK_DATA_FILE_REVERIFY_RUNS:
+            stored = {}
+        multirange = len(ranges) > 1 and mirrorurl.multirange_allowed is not False
+
+        if multirange and mirrorurl.multirange_allowed:
+            # One request covers both the length check and all ranges
+            file_validators = self.check_data_file_multirange(
+                mirrorurl, data_file, ranges, stored
+            )
+            if file_validators is NOT_MODIFIED:
+                return dict(stored, runs=runs)
+            elif file_validators is not None:
+                return dict(file_validators, runs=0)
+
+        file_validators = None
+        if mirrorurl.head_allowed:
+            file_validators = self.check_data_file_head(mirrorurl, data_file)
+            if (
+                (file_validators["etag"] or file_validators["last_modified"])
+                and stored.get("etag") == file_validators["etag"]
+                and stored.get("last_modified") == file_validators["last_modified"]
+            ):
+                # File unchanged since its ranges were last verified
+                return dict(stored, runs=runs)
 
+        if not mirrorurl.range_allowed:
+            return
+        if multirange and mirrorurl.multirange_allowed is None:
+            # Capability not known yet; try it
+            multirange_validators = self.check_data_file_multirange(
+                mirrorurl, data_file, ranges
+            )
+            if multirange_validators is not None:
+                return dict(file_validators or multirange_validators, runs=0)
+        self.check_data_file_ranges(mirrorurl, data_file, ranges)
+        if file_validators:
+            return dict(file_validators, runs=0)
+
+    def check_mirrorurl_http(self, mirrorurl):
+        now = timezone.now()
+        mirrorurl.date_last_check = now
+        if settings.CHECK_TRACE_FILE:
+            self.check_trace_http(mirrorurl)
+
+        validators = dict(mirrorurl.data_file_validators or {})
+        for data_file in self.safe_sample(
+            get_data_files(), settings.CHECK_DATA_FILE_COUNT
+        ):
+            try:
+                file_validators = self.check_data_file_http(
+                    mirrorurl, data_file, validators.get(data_file["path"], {})
+                )
+            except CheckError as e:
+                validators.pop(data_file["path"], None)
+                mirrorurl.data_file_validators = validators
+                return self.mirrorurl_failure(mirrorurl, str(e))
+            if file_validators:
+                validators[data_file["path"]] = file_validators
+
+        mirrorurl.data_file_validators = validators
+        # Only HTTPS URLs are used for redirects
+        if (
+            settings.CHECK_MEASURE_BYTES
+            and mirrorurl.protocol == "https"
+            and mirrorurl.range_allowed
+        ):
+            self.measure_mirrorurl_http(mirrorurl)
         mirrorurl.check_success = True
         mirrorurl.date_last_success = now
         mirrorurl.check_detail = "Check OK"
-        mirrorurl.save()
+        self.save_mirrorurl(mirrorurl)
+
+    def ewma(self, average, value):
+        if average is None:
+            return value
+        alpha = settings.CHECK_MEASURE_EWMA_ALPHA
+        return alpha * value + (1 - alpha) * average
+
+    def measure_mirrorurl_http(self, mirrorurl):
+        """Measure connect time, TTFB and throughput of a MirrorURL
+
+        A fresh TCP connection is timed, then CHECK_MEASURE_BYTES are
+        fetched from a random offset of a random data file.  Each result
+        is folded into the URL's moving averages; a failed measurement
+        is logged and otherwise ignored.
+        """
+        data_files = [
+            x for x in get_data_files() if x["length"] > settings.CHECK_MEASURE_BYTES
+        ]
+        if not data_files:
+            return
+        data_file = random.choice(data_files)
+        begin = random.randrange(data_file["length"] - settings.CHECK_MEASURE_BYTES)
+        url = urllib.parse.urlsplit(mirrorurl.url)
+
+        try:
+            started = time.monotonic()
+            socket.create_connection(
+                (url.hostname, url.port or 443),
+                timeout=5,
+            ).close()
+            connect_time = time.monotonic() - started
+
+            with self.rs.get(
+                "{}/{}".format(mirrorurl.url, data_file["path"]),
+                headers={
+                    "Range": "bytes={}-{}".format(
+                        begin, begin + settings.CHECK_MEASURE_BYTES - 1
+                    )
+                },
+                stream=True,
+                timeout=5,
+            ) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise CheckError(
+                        "Range not honored (HTTP {})".format(r.status_code)
+                    )
+                # requests' elapsed covers up to the response headers
+                ttfb = r.elapsed.total_seconds()
+                received = 0
+                started = time.monotonic()
+                for data in r.iter_content(chunk_size=65536):
+                    received += len(data)
+                elapsed = time.monotonic() - started
+        except (OSError, requests.RequestException, CheckError) as e:
+            logging.warning("{} measurement failed: {}".format(mirrorurl, e))
+            return
+
+        mirrorurl.ewma_connect_time = self.ewma(
+            mirrorurl.ewma_connect_time, connect_time
+        )
+        mirrorurl.ewma_ttfb = self.ewma(mirrorurl.ewma_ttfb, ttfb)
+        if elapsed > 0:
+            mirrorurl.ewma_throughput = self.ewma(
+                mirrorurl.ewma_throughput, received / elapsed
+            )
+        logging.debug(
+            "{}: connect {:.3f}s, TTFB {:.3f}s, {} bytes in {:.3f}s".format(
+                mirrorurl, connect_time, ttfb, received, elapsed
+            )
+        )
 
     def check_mirrorurl_rsync(self, mirrorurl):
         now = timezone.now()
@@ -137,7 +544,7 @@ class Command(BaseCommand):
         mirrorurl.check_success = True
         mirrorurl.date_last_success = now
         mirrorurl.check_detail = res
-        mirrorurl.save()
+        self.save_mirrorurl(mirrorurl)
 
     def check_mirrorurl_ftp(self, mirrorurl):
         now = timezone.now()
@@ -145,49 +552,469 @@ class Command(BaseCommand):
         if not settings.CHECK_TRACE_FILE:
             return
 
-        self._line = ""
-
-        def _cb(self, line):
-            if not self._line:
-                self._line = line
+        lines = []
 
         url = urllib.parse.urlsplit(
             "{}/{}".format(mirrorurl.url, settings.CHECK_TRACE_FILE)
         )
         ftp = ftplib.FTP(url.netloc, timeout=5)
         ftp.login()
-        ftp.retrlines(
-            "RETR {}".format(url.path), callback=(lambda line: _cb(self, line))
-        )
+        ftp.retrlines("RETR {}".format(url.path), callback=lines.append)
         ftp.quit()
-        mirrorurl.date_last_trace = dateutil.parser.parse(self._line.strip())
+        mirrorurl.date_last_trace = dateutil.parser.parse(lines[0].strip())
 
         mirrorurl.check_success = True
         mirrorurl.date_last_success = now
         mirrorurl.check_detail = "Check OK"
-        mirrorurl.save()
+        self.save_mirrorurl(mirrorurl)
+
+    def sweep_range(self, mirrorurl, data_file, offset, end):
+        """Stream and verify sweep chunks of a data file from offset to end
+
+        Returns the offset up to which chunks were verified, which is
+        short of end if the transfer was interrupted.  The transfer is
+        throttled to CHECK_SWEEP_RATE bytes per second.
+        """
+        chunks = data_file["chunks"]
+        chunk_size = chunks["size"]
+        chunk_index = offset // chunk_size
+        chunk_length = min(chunk_size, data_file["length"] - offset)
+        h = hashlib.new(chunks["hash_type"])
+        in_chunk = 0
+        received = 0
+        started = time.monotonic()
+        try:
+            with self.rs.get(
+                "{}/{}".format(mirrorurl.url, data_file["path"]),
+                headers={"Range": "bytes={}-{}".format(offset, end - 1)},
+                stream=True,
+                timeout=5,
+            ) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    logging.warning(
+                        "{} sweep: Range not honored (HTTP {})".format(
+                            mirrorurl, r.status_code
+                        )
+                    )
+                    return offset
+                for data in r.iter_content(chunk_size=65536):
+                    pos = 0
+                    while pos < len(data) and offset < end:
+                        take = min(chunk_length - in_chunk, len(data) - pos)
+                        h.update(data[pos : pos + take])
+                        in_chunk += take
+                        pos += take
+                        if in_chunk < chunk_length:
+                            continue
+                        hash_got = h.hexdigest()
+                        if hash_got != chunks["hashes"][chunk_index]:
+                            raise CheckError(
+                                "{} sweep bytes {}-{}: Expected {}, got {}".format(
+                                    data_file["path"],
+                                    offset,
+                                    offset + chunk_length - 1,
+                                    chunks["hashes"][chunk_index],
+                                    hash_got,
+                                )
+                            )
+                        offset += chunk_length
+                        chunk_index += 1
+                        chunk_length = min(chunk_size, data_file["length"] - offset)
+                        h = hashlib.new(chunks["hash_type"])
+                        in_chunk = 0
+                    received += len(data)
+                    if settings.CHECK_SWEEP_RATE:
+                        ahead = received / settings.CHECK_SWEEP_RATE - (
+                            time.monotonic() - started
+                        )
+                        if ahead > 0:
+                            time.sleep(ahead)
+        except requests.RequestException as e:
+            logging.warning(
+                "{} sweep interrupted at {} {}: {}".format(
+                    mirrorurl, data_file["path"], offset, e
+                )
+            )
+        return offset
+
+    def sweep_mirrorurl(self, mirrorurl):
+        """Continue the full-file sweep of a MirrorURL
+
+        Each run verifies up to CHECK_SWEEP_BYTES_PER_RUN bytes of one
+        manifest data file against its chunk hashes, and saves the offset
+        reached so the next run resumes there.  When a file is complete,
+        the next run starts on the following file in the manifest.
+        """
+        data_files = [x for x in get_data_files() if x.get("chunks")]
+        if not data_files:
+            logging.warning("No data files with sweep chunks in the manifest")
+            return
+
+        state = dict(mirrorurl.sweep_state or {})
+        for data_file in data_files:
+            if (data_file["path"], data_file.get("hashes")) == (
+                state.get("path"),
+                state.get("hashes"),
+            ):
+                break
+        else:
+            # Not in progress, or the manifest changed; start the next file
+            paths = [x["path"] for x in data_files]
+            last_path = state.get("last_path")
+            data_file = data_files[
+                (paths.index(last_path) + 1) % len(paths) if last_path in paths else 0
+            ]
+            state = {
+                "path": data_file["path"],
+                "hashes": data_file.get("hashes"),
+                "offset": 0,
+                "last_path": last_path,
+            }
+
+        chunk_size = data_file["chunks"]["size"]
+        end = min(
+            state["offset"]
+            + max(settings.CHECK_SWEEP_BYTES_PER_RUN // chunk_size, 1) * chunk_size,
+            data_file["length"],
+        )
+        try:
+            state["offset"] = self.sweep_range(
+                mirrorurl, data_file, state["offset"], end
+            )
+        except CheckError as e:
+            # Re-verify this file from the start next time
+            state["offset"] = 0
+            mirrorurl.sweep_state = state
+            return self.mirrorurl_failure(mirrorurl, str(e))
+
+        if state["offset"] >= data_file["length"]:
+            logging.info("{} sweep of {} complete".format(mirrorurl, data_file["path"]))
+            state = {"last_path": data_file["path"]}
+            mirrorurl.date_last_sweep = timezone.now()
+        mirrorurl.sweep_state = state
+        self.save_mirrorurl(mirrorurl, schedule=False)
+
+    def run_sweep(self, mirrorurl):
+        logging.debug("Sweeping {}".format(mirrorurl))
+        try:
+            self.sweep_mirrorurl(mirrorurl)
+        except Exception as e:
+            logging.warning("{} sweep error: {}".format(mirrorurl, e))
+
+    def inventory_http(self, mirrorurl):
+        """List a mirror by crawling its HTML directory indexes
+
+        Returns the paths and whether the listing is complete, i.e. no
+        directory was left out for being deeper than CHECK_INVENTORY_DEPTH.
+        """
+        paths = []
+        complete = True
+        pending = [("", 0)]
+        listed = 0
+        while pending:
+            directory, depth = pending.pop()
+            listed += 1
+            if listed > settings.CHECK_INVENTORY_MAX_DIRECTORIES:
+                raise CheckError("Too many directories")
+            r = self.request_url("{}/{}".format(mirrorurl.url, directory))
+            for name, is_directory in parse_index_links(r.text):
+                path = directory + name
+                paths.append(path)
+                if not is_directory:
+                    continue
+                if depth < settings.CHECK_INVENTORY_DEPTH:
+                    pending.append((path + "/", depth + 1))
+                else:
+                    complete = False
+        return (paths, complete)
+
+    def inventory_rsync(self, mirrorurl):
+        """List a mirror with a recursive rsync file list"""
+        res = subprocess.check_output(
+            [
+                "rsync",
+                "--list-only",
+                "--recursive",
+                "--copy-dirlinks",
+                "--timeout=10",
+                "--contimeout=10",
+                "{}/".format(mirrorurl.url),
+            ],
+            encoding="UTF-8",
+        )
+        return ([path for path, _ in parse_rsync_list(res)], True)
+
+    def inventory_ftp(self, mirrorurl):
+        """List a mirror over FTP, with MLSD or a top-level NLST
+
+        As inventory_http(); a top-level NLST listing is incomplete.
+        """
+        url = urllib.parse.urlsplit(mirrorurl.url)
+        ftp = ftplib.FTP(url.netloc, timeout=5)
+        ftp.login()
+        paths = []
+        complete = True
+        try:
+            pending = [("", 0)]
+            while pending:
+                directory, depth = pending.pop()
+                if len(paths) > settings.CHECK_INVENTORY_MAX_DIRECTORIES * 1000:
+                    raise CheckError("Too many files")
+                for name, facts in ftp.mlsd(
+                    "{}/{}".format(url.path, directory), facts=["type"]
+                ):
+                    if facts.get("type") in ("cdir", "pdir"):
+                        continue
+                    path = directory + name
+                    paths.append(path)
+                    if facts.get("type") != "dir":
+                        continue
+                    if depth < settings.CHECK_INVENTORY_DEPTH:
+                        pending.append((path + "/", depth + 1))
+                    else:
+                        complete = False
+        except ftplib.error_perm:
+            # MLSD not supported
+            paths = [x.rsplit("/", 1)[-1] for x in ftp.nlst(url.path)]
+            complete = False
+        ftp.quit()
+        return (paths, complete)
+
+    def inventory_mirrorurl(self, mirrorurl):
+        """Store the inventory of the paths a MirrorURL carries
+
+        An incomplete listing is stored as no inventory, which routing
+        treats as carrying every path, since paths missing from it may
+        still exist on the mirror.
+        """
+        if mirrorurl.protocol in ("http", "https"):
+            paths, complete = self.inventory_http(mirrorurl)
+        elif mirrorurl.protocol == "rsync":
+            paths, complete = self.inventory_rsync(mirrorurl)
+        elif mirrorurl.protocol == "ftp":
+            paths, complete = self.inventory_ftp(mirrorurl)
+        if not paths:
+            raise CheckError("Empty listing")
+        mirrorurl.inventory = pack_inventory(paths) if complete else None
+        mirrorurl.date_last_inventory = timezone.now()
+        logging.debug(
+            "{}: {} paths{}".format(
+                mirrorurl, len(paths), "" if complete else " (incomplete, not stored)"
+            )
+        )
+        self.save_mirrorurl(mirrorurl, schedule=False)
+
+    def run_inventory(self, mirrorurl):
+        logging.debug("Listing {}".format(mirrorurl))
+        try:
+            self.inventory_mirrorurl(mirrorurl)
+        except Exception as e:
+            logging.warning("{} inventory error: {}".format(mirrorurl, e))
+
+    def hostname(self, mirrorurl):
+        return urllib.parse.urlsplit(mirrorurl.url or "").hostname
+
+    def run_check(self, mirrorurl):
+        logging.debug("Checking {}".format(mirrorurl))
+        next_check_at = mirrorurl.next_check_at
+        try:
+            self.check_mirrorurl(mirrorurl)
+        except Exception as e:
+            self.mirrorurl_failure(mirrorurl, str(e))
+        if mirrorurl.next_check_at == next_check_at:
+            # Nothing to check (e.g. no trace file), but still reschedule
+            self.save_mirrorurl(mirrorurl)
+
+    def run_checks(self, mirrorurls, jobs=1, per_host=1, deadline=None, check=None):
+        """Check MirrorURLs, optionally concurrently
+
+        At most per_host checks run against the same hostname at a time.
+        Checks not yet started when the deadline (a time.monotonic()
+        value) passes are skipped; returns the skipped MirrorURLs.
+        """
+        if check is None:
+            check = self.run_check
+        skipped = []
+        if jobs <= 1:
+            for mirrorurl in mirrorurls:
+                if deadline is not None and time.monotonic() >= deadline:
+                    skipped.append(mirrorurl)
+                    continue
+                check(mirrorurl)
+                self.flush_mirrorurls(full_batch=True)
+            return skipped
+
+        # Interleave hosts so pool threads don't queue up behind one
+        # host's semaphore
+        by_host = {}
+        for mirrorurl in mirrorurls:
+            by_host.setdefault(self.hostname(mirrorurl), []).append(mirrorurl)
+        mirrorurls = [
+            x
+            for group in itertools.zip_longest(*by_host.values())
+            for x in group
+            if x is not None
+        ]
+        host_semaphores = {
+            hostname: threading.BoundedSemaphore(per_host) for hostname in by_host
+        }
+
+        def _worker(mirrorurl):
+            try:
+                with host_semaphores[self.hostname(mirrorurl)]:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return False
+                    check(mirrorurl)
+                self.flush_mirrorurls(full_batch=True)
+                return True
+            finally:
+                connections.close_all()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(_worker, x): x for x in mirrorurls}
+            for future in concurrent.futures.as_completed(futures):
+                if not future.result():
+                    skipped.append(futures[future])
+        return skipped
 
     def add_arguments(self, parser):
         parser.add_argument("--mirror", nargs="*")
+        parser.add_argument(
+            "--jobs", type=int, default=1, help="Number of URLs to check concurrently"
+        )
+        parser.add_argument(
+            "--per-host",
+            type=int,
+            default=1,
+            help="Maximum concurrent checks against the same hostname",
+        )
+        parser.add_argument(
+            "--deadline",
+            type=float,
+            help="Seconds after which no further checks are started",
+        )
+        parser.add_argument(
+            "--daemon",
+            action="store_true",
+            help="Run continuously, checking each URL when it is due",
+        )
+        parser.add_argument(
+            "--sweep",
+            action="store_true",
+            help="Continue full-file integrity sweeps instead of regular checks",
+        )
+        parser.add_argument(
+            "--inventory",
+            action="store_true",
+            help="Update mirror file inventories instead of regular checks",
+        )
 
     def handle(self, *args, **options):
         logging.getLogger("").setLevel(
             logging.DEBUG if int(options["verbosity"]) >= 2 else logging.INFO
         )
 
+        if options["daemon"] and (options["sweep"] or options["inventory"]):
+            raise CommandError("--daemon only runs regular checks")
+
         opt_filter = {}
         if options["mirror"]:
             opt_filter["mirror__slug__in"] = options["mirror"]
         else:
             opt_filter["mirror__enabled"] = True
 
-        for mirrorurl in MirrorURL.objects.filter(
+        queryset = MirrorURL.objects.filter(
             enabled=True,
             protocol__in=["http", "https", "rsync", "ftp"],
             **opt_filter,
-        ):
-            logging.debug("Checking {}".format(mirrorurl))
+        ).select_related("mirror")
+
+        if options["sweep"]:
+            # One URL per mirror, preferring HTTPS
+            mirrorurls = {}
+            for mirrorurl in queryset.filter(
+                protocol__in=["http", "https"], range_allowed=True
+            ).order_by("protocol"):
+                mirrorurls[mirrorurl.mirror_id] = mirrorurl
+            return self.check_pass(
+                list(mirrorurls.values()), options, check=self.run_sweep
+            )
+
+        if options["inventory"]:
+            # One URL per mirror, preferring the cheapest full listing
+            preference = ["http", "https", "ftp", "rsync"]
+            mirrorurls = {}
+            for mirrorurl in sorted(
+                queryset, key=lambda x: preference.index(x.protocol)
+            ):
+                mirrorurls[mirrorurl.mirror_id] = mirrorurl
+            return self.check_pass(
+                list(mirrorurls.values()), options, check=self.run_inventory
+            )
+
+        if not options["daemon"]:
+            return self.check_pass(list(queryset), options)
+
+        while True:
+            # Wake up at least every CHECK_DAEMON_POLL seconds to notice
+            # URLs added or changed in the admin
+            sleep = settings.CHECK_DAEMON_POLL
             try:
-                self.check_mirrorurl(mirrorurl)
-            except Exception as e:
-                self.mirrorurl_failure(mirrorurl, str(e))
+                due = queryset.filter(
+                    Q(next_check_at__isnull=True) | Q(next_check_at__lte=timezone.now())
+                )
+                self.check_pass(list(due), options)
+                next_check_at = queryset.aggregate(Min("next_check_at"))[
+                    "next_check_at__min"
+                ]
+                if next_check_at:
+                    sleep = min(
+                        sleep,
+                        max((next_check_at - timezone.now()).total_seconds(), 1),
+                    )
+            except Exception:
+                # e.g. the database is locked or unavailable; retry later
+                logging.exception("Check pass failed")
+            finally:
+                connections.close_all()
+            time.sleep(sleep)
+
+    def check_pass(self, mirrorurls, options, check=None):
+        # URLs left unwritten by a failed write are retried in the next pass
+        if not mirrorurls and not self._pending:
+            return
+        self.rows_written = 0
+        self.rows_rescheduled = 0
+        self.rows_skipped = 0
+        self.columns_written = 0
+        deadline = None
+        if options["deadline"]:
+            deadline = time.monotonic() + options["deadline"]
+
+        # The routing snapshot is published once at the end of the pass,
+        # not after every saved MirrorURL
+        self.track_mirrorurls(mirrorurls)
+        with batch_bumps():
+            skipped = self.run_checks(
+                mirrorurls,
+                jobs=options["jobs"],
+                per_host=max(options["per_host"], 1),
+                deadline=deadline,
+                check=check,
+            )
+            self.flush_mirrorurls()
+        if self._pending:
+            logging.error("{} checked URLs not written".format(len(self._pending)))
+        publish_snapshot()
+        prune_changes()
+        for mirrorurl in skipped:
+            logging.warning("Deadline reached, not checked: {}".format(mirrorurl))
+        logging.info(
+            "{} rows written ({} only rescheduled), {} columns, {} rows unchanged".format(
+                self.rows_written,
+                self.rows_rescheduled,
+                self.columns_written,
+                self.rows_skipped,
+            )
+        )
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_cached = (None, None)
+_failed = None
+
+
+def load_manifest(path):
+    """Load a data file manifest written by the generate_manifest command
+
+    The parsed manifest is kept until the file changes.
+    """
+    global _cached
+
+    st = os.stat(path)
+    key = (path, st.st_ino, st.st_mtime_ns)
+    with _lock:
+        if _cached[0] == key:
+            return _cached[1]
+    with open(path) as f:
+        manifest = json.load(f)
+    with _lock:
+        _cached = (key, manifest)
+    return manifest
+
+
+def get_data_files():
+    """Return the data files to check on each mirror
+
+    These come from the CHECK_DATA_MANIFEST file if one is configured,
+    otherwise from CHECK_DATA_FILES.  If the manifest cannot be loaded,
+    the error is logged once and CHECK_DATA_FILES is used until it can.
+    """
+    global _failed
+
+    path = getattr(settings, "CHECK_DATA_MANIFEST", None)
+    if not path:
+        return settings.CHECK_DATA_FILES
+    try:
+        files = load_manifest(path)["files"]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        failure = (path, str(e))
+        if failure != _failed:
+            _failed = failure
+            logging.error(
+                "Cannot load data file manifest {}, using CHECK_DATA_FILES: {}".format(
+                    path, e
+                )
+            )
+        return settings.CHECK_DATA_FILES
+    _failed = None
+    return files
+
+
+def get_data_file(path):
+    """Return the data file entry for a path, or None"""
+    for data_file in get_data_files():
+        if data_file["path"] == path:
+            return data_file
@@ -0,0 +1,65 @@
+"""Metalink 4 (RFC 5854) and plain mirror list documents"""
+
+import posixpath
+import xml.etree.ElementTree as ET
+
+from django.utils import timezone
+
+NAMESPACE = "urn:ietf:params:xml:ns:metalink"
+# hashlib names to the IANA hash function names Metalink uses
+HASH_NAMES = {
+    "md5": "md5",
+    "sha1": "sha-1",
+    "sha224": "sha-224",
+    "sha256": "sha-256",
+    "sha384": "sha-384",
+    "sha512": "sha-512",
+}
+
+
+def build_metalink(path, entries, data_file=None):
+    """Return a Metalink 4 document for a path as bytes
+
+    entries are RoutingEntry objects in order of preference.  Size,
+    hashes and piece hashes are included if data_file (a manifest entry
+    for the path) has them.
+    """
+    ET.register_namespace("", NAMESPACE)
+
+    def sub(parent, tag, text=None, **attrib):
+        element = ET.SubElement(parent, "{{{}}}{}".format(NAMESPACE, tag), attrib)
+        element.text = text
+        return element
+
+    metalink = ET.Element("{{{}}}metalink".format(NAMESPACE))
+    sub(metalink, "generator", "finnixmirrors")
+    sub(metalink, "published", timezone.now().strftime("%Y-%m-%dT%H:%M:%SZ"))
+    file = sub(metalink, "file", name=posixpath.basename(path))
+    if data_file:
+        sub(file, "size", str(data_file["length"]))
+        for hash_type, digest in sorted(data_file.get("hashes", {}).items()):
+            if hash_type in HASH_NAMES:
+                sub(file, "hash", digest, type=HASH_NAMES[hash_type])
+        chunks = data_file.get("chunks")
+        if chunks and chunks["hash_type"] in HASH_NAMES:
+            pieces = sub(
+                file,
+                "pieces",
+                length=str(chunks["size"]),
+                type=HASH_NAMES[chunks["hash_type"]],
+            )
+            for digest in chunks["hashes"]:
+                sub(pieces, "hash", digest)
+    for priority, entry in enumerate(entries, 1):
+        attrib = {"priority": str(priority)}
+        if entry.country:
+            attrib["location"] = entry.country.lower()
+        sub(file, "url", "{}/{}".format(entry.url, path), **attrib)
+    return ET.tostring(metalink, encoding="UTF-8", xml_declaration=True)
+
+
+def build_mirrorlist(path, entries):
+    """Return the URLs of a path, one per line in order of preference"""
+    return "".join("{}/{}\n".format(entry.url, path) for entry in entries).encode(
+        "UTF-8"
+    )
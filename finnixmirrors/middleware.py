@@ -0,0 +1,50 @@
+"""Async-capable versions of third-party middleware
+
+Under ASGI, Django runs sync-only middleware, and the async views below
+them, in a thread per request.  The middleware here only inspects or
+rewrites the request and then returns either their own response or the
+result of get_response() unchanged, so they can run inline, awaiting
+that result when it is a coroutine.
+"""
+
+import inspect
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from xff.middleware import XForwardedForMiddleware as _XForwardedForMiddleware
+
+try:
+    from whitenoise.middleware import WhiteNoiseMiddleware as _WhiteNoiseMiddleware
+except ImportError as e:
+    _WhiteNoiseMiddleware = e
+
+
+class AsyncPassthroughMixin:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = super().__call__(request)
+        if inspect.isawaitable(response):
+            response = await response
+        return response
+
+
+class XForwardedForMiddleware(AsyncPassthroughMixin, _XForwardedForMiddleware):
+    pass
+
+
+if not isinstance(_WhiteNoiseMiddleware, ImportError):
+
+    class WhiteNoiseMiddleware(AsyncPassthroughMixin, _WhiteNoiseMiddleware):
+        pass
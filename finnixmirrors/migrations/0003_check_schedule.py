@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finnixmirrors", "0002_auto"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="check_failures",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="check_successes",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="next_check_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finnixmirrors", "0003_check_schedule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="data_file_validators",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="trace_etag",
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="trace_last_modified",
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finnixmirrors", "0004_conditional_checks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="multirange_allowed",
+            field=models.BooleanField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finnixmirrors", "0005_multirange_allowed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="date_last_sweep",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="sweep_state",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finnixmirrors", "0006_sweep_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="ewma_connect_time",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="ewma_throughput",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="mirrorurl",
+            name="ewma_ttfb",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
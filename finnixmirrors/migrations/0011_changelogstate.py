@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finnixmirrors", "0010_mirrorurl_changes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeLogState",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("pruned_seq", models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,6 +1,7 @@
 import uuid
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.urls import reverse_lazy
 from django.utils import timezone
@@ -49,6 +50,8 @@ class MirrorURL(models.Model):
     ipv6 = models.BooleanField(default=False)
     enabled = models.BooleanField(default=True)
     weight = models.FloatField(default=1.0, blank=False, null=False)
+    # Soft cap on redirects per settings.ROUTING_SHARE_WINDOW
+    capacity = models.PositiveIntegerField(blank=True, null=True)
     check_success = models.BooleanField(default=True)
     check_detail = models.TextField(blank=True, null=True)
     date_last_check = models.DateTimeField(blank=True, null=True)
@@ -56,6 +59,24 @@ class MirrorURL(models.Model):
     date_last_trace = models.DateTimeField(blank=True, null=True)
     head_allowed = models.BooleanField(default=False)
     range_allowed = models.BooleanField(default=False)
+    # None until the checker has found out
+    multirange_allowed = models.BooleanField(blank=True, null=True)
+    next_check_at = models.DateTimeField(blank=True, null=True)
+    trace_etag = models.CharField(max_length=200, blank=True, null=True)
+    trace_last_modified = models.CharField(max_length=200, blank=True, null=True)
+    data_file_validators = models.JSONField(default=dict, blank=True)
+    sweep_state = models.JSONField(default=dict, blank=True)
+    # Exponentially weighted moving averages of measurements; seconds,
+    # seconds and bytes per second
+    ewma_connect_time = models.FloatField(blank=True, null=True)
+    ewma_ttfb = models.FloatField(blank=True, null=True)
+    ewma_throughput = models.FloatField(blank=True, null=True)
+    date_last_sweep = models.DateTimeField(blank=True, null=True)
+    # Packed path hashes; see finnixmirrors.inventory
+    inventory = models.BinaryField(blank=True, null=True)
+    date_last_inventory = models.DateTimeField(blank=True, null=True)
+    check_failures = models.PositiveIntegerField(default=0)
+    check_successes = models.PositiveIntegerField(default=0)
 
     @property
     def outdated(self):
@@ -67,3 +88,49 @@ class MirrorURL(models.Model):
 
     def __str__(self):
         return "{} {}".format(self.mirror.slug, self.protocol)
+
+
+class RedirectCount(models.Model):
+    id = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False, blank=False, null=False
+    )
+    mirrorurl = models.ForeignKey(
+        MirrorURL, on_delete=models.CASCADE, blank=False, null=False
+    )
+    # Start of the hour counted
+    period = models.DateTimeField(blank=False, null=False)
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = (("mirrorurl", "period"),)
+
+    def __str__(self):
+        return "{} {}".format(self.mirrorurl, self.period)
+
+
+class MirrorURLChange(models.Model):
+    EVENTS = (
+        ("created", "Created"),
+        ("changed", "Changed"),
+        ("deleted", "Deleted"),
+    )
+
+    seq = models.BigAutoField(primary_key=True)
+    date = models.DateTimeField(default=timezone.now, db_index=True)
+    # Not a foreign key, so changes outlive deleted MirrorURLs
+    url_id = models.UUIDField(blank=False, null=False)
+    mirror_slug = models.SlugField(blank=False, null=False)
+    event = models.CharField(max_length=20, choices=EVENTS, blank=False, null=False)
+    # Whether the URL is listed in mirrors.json after the change
+    enabled = models.BooleanField(default=True)
+    state = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        return "{} {} {}".format(self.seq, self.mirror_slug, self.event)
+
+
+class ChangeLogState(models.Model):
+    id = models.AutoField(primary_key=True)
+    # Highest seq deleted from the change log; changes after an earlier seq
+    # are no longer complete
+    pruned_seq = models.BigIntegerField(default=0)
@@ -0,0 +1,265 @@
+"""Compiled IP prefix -> mirror routing table
+
+The table is produced by the build_routing_table command and consists
+of sorted, non-overlapping address ranges, each with the best
+candidate mirrors for clients in that range.  It is memory-mapped by
+the web workers and searched with a binary search, bypassing GeoIP
+lookups and distance ranking entirely.
+
+File layout (all integers big-endian):
+
+    magic "FMRT", u16 format version, u16 candidates per range,
+    u32 header length, JSON header, zero padding to 8 bytes,
+    u32 IPv4 range count, u32 IPv6 range count,
+    IPv4 ranges: u32 start, u32 end, candidates * (u16 index, u16 km),
+    IPv6 ranges: u64 start high, u64 start low, u64 end high,
+                 u64 end low, candidates * (u16 index, u16 km)
+
+Candidate indexes refer to the "mirrorurls" list in the header; unused
+candidate slots have an index of 0xffff.
+"""
+
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+
+MAGIC = b"FMRT"
+VERSION = 1
+NO_CANDIDATE = 0xFFFF
+_PREAMBLE = struct.Struct(">4sHHI")
+_COUNTS = struct.Struct(">II")
+
+
+def routing_key(mirrorurls):
+    """Return a digest of the routing inputs of a set of MirrorURLs
+
+    A table is only used while the eligible MirrorURLs, their
+    coordinates and effective weights are the same as when it was built.
+    """
+    h = hashlib.sha256()
+    for mirrorurl in sorted(mirrorurls, key=lambda x: str(x.id)):
+        h.update(
+            "{} {!r} {!r} {!r}\n".format(
+                mirrorurl.id,
+                mirrorurl.latitude,
+                mirrorurl.longitude,
+                mirrorurl.effective_weight,
+            ).encode("UTF-8")
+        )
+    return h.hexdigest()
+
+
+def geoip_db_key(path):
+    st = os.stat(path)
+    return [st.st_ino, st.st_mtime_ns]
+
+
+def _record_structs(candidates):
+    pairs = "HH" * candidates
+    return struct.Struct(">II" + pairs), struct.Struct(">QQQQ" + pairs)
+
+
+def write_table(path, header, ranges_v4, ranges_v6, candidates):
+    """Atomically write a routing table
+
+    ranges_v4 and ranges_v6 are sorted lists of (start, end, candidates)
+    where start and end are integer addresses and candidates is a list
+    of (index, distance_km) tuples.
+    """
+    header_bytes = json.dumps(header, sort_keys=True).encode("UTF-8")
+    rec_v4, rec_v6 = _record_structs(candidates)
+
+    def _pairs(cands):
+        out = []
+        for i in range(candidates):
+            if i < len(cands):
+                out += [cands[i][0], min(int(cands[i][1]), NO_CANDIDATE - 1)]
+            else:
+                out += [NO_CANDIDATE, 0]
+        return out
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, candidates, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (-f.tell() % 8))
+        f.write(_COUNTS.pack(len(ranges_v4), len(ranges_v6)))
+        for start, end, cands in ranges_v4:
+            f.write(rec_v4.pack(start, end, *_pairs(cands)))
+        for start, end, cands in ranges_v6:
+            f.write(
+                rec_v6.pack(
+                    start >> 64,
+                    start & 0xFFFFFFFFFFFFFFFF,
+                    end >> 64,
+                    end & 0xFFFFFFFFFFFFFFFF,
+                    *_pairs(cands),
+                )
+            )
+    os.replace(tmp, path)
+
+
+class PrefixTable:
+    """Memory-mapped routing table"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.candidates, header_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{}: not a version {} routing table".format(path, VERSION))
+        pos = _PREAMBLE.size
+        self.header = json.loads(self._mm[pos : pos + header_len].decode("UTF-8"))
+        pos += header_len
+        pos += -pos % 8
+        self._count_v4, self._count_v6 = _COUNTS.unpack_from(self._mm, pos)
+        pos += _COUNTS.size
+        self._rec_v4, self._rec_v6 = _record_structs(self.candidates)
+        self._base_v4 = pos
+        self._base_v6 = pos + self._count_v4 * self._rec_v4.size
+        self.mirrorurl_ids = self.header["mirrorurls"]
+
+    def __len__(self):
+        return self._count_v4 + self._count_v6
+
+    def _search(self, key, base, count, rec, unpack_key):
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if unpack_key(base + mid * rec.size) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if not lo:
+            return
+        return rec.unpack_from(self._mm, base + (lo - 1) * rec.size)
+
+    def lookup(self, ip):
+        """Return a list of (mirrorurl id, distance_km) candidates for an IP"""
+        ip = ipaddress.ip_address(ip)
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        key = int(ip)
+        if ip.version == 4:
+            record = self._search(
+                key,
+                self._base_v4,
+                self._count_v4,
+                self._rec_v4,
+                lambda pos: struct.unpack_from(">I", self._mm, pos)[0],
+            )
+            if not record or key > record[1]:
+                return
+            pairs = record[2:]
+        else:
+            record = self._search(
+                key,
+                self._base_v6,
+                self._count_v6,
+                self._rec_v6,
+                lambda pos: int.from_bytes(self._mm[pos : pos + 16], "big"),
+            )
+            if not record or key > ((record[2] << 64) | record[3]):
+                return
+            pairs = record[4:]
+
+        return [
+            (self.mirrorurl_ids[pairs[i]], pairs[i + 1])
+            for i in range(0, len(pairs), 2)
+            if pairs[i] != NO_CANDIDATE
+        ]
+
+    def close(self):
+        self._mm.close()
+
+
+class PrefixTableLoader:
+    """Process-wide holder of the current PrefixTable
+
+    The table file and the GeoIP database are re-checked at most every
+    check_interval seconds; the table is reopened when its file changes,
+    and is unused while it was built from a different GeoIP database.
+    """
+
+    def __init__(self, path, check_interval=10):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._table = None
+        self._stat_key = None
+        self._usable = False
+        self._next_check = 0
+        self._matched = (None, False)
+
+    def _clear(self):
+        self._table = None
+        self._stat_key = None
+        self._usable = False
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._clear()
+            return
+        stat_key = (st.st_ino, st.st_mtime_ns)
+        if stat_key != self._stat_key:
+            # Mappings held by in-flight lookups are released by GC
+            self._table = PrefixTable(self.path)
+            self._stat_key = stat_key
+            self._matched = (None, False)
+        geoip_path = getattr(settings, "GEOIP2_DB", None)
+        try:
+            self._usable = bool(geoip_path) and (
+                geoip_db_key(geoip_path) == self._table.header["geoip_db"]
+            )
+        except FileNotFoundError:
+            self._usable = False
+
+    def get(self, snapshot):
+        """Return the table if it is current for a RoutingSnapshot"""
+        with self._lock:
+            try:
+                self._refresh()
+            except (OSError, ValueError):
+                # Reopened on the next check
+                self._clear()
+            if not self._usable:
+                return
+            if self._matched[0] is not snapshot:
+                self._matched = (
+                    snapshot,
+                    snapshot.routing_key == self._table.header["routing_key"],
+                )
+            return self._table if self._matched[1] else None
+
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_table(snapshot):
+    """Return the process-wide PrefixTable if it is current, else None"""
+    global _loader
+
+    path = getattr(settings, "ROUTING_TABLE_FILE", None)
+    if not path:
+        return
+    with _loader_lock:
+        if _loader is None or _loader.path != path:
+            _loader = PrefixTableLoader(
+                path,
+                check_interval=getattr(settings, "ROUTING_TABLE_CHECK_INTERVAL", 10),
+            )
+    return _loader.get(snapshot)
@@ -0,0 +1,187 @@
+"""Per-MirrorURL redirect counting and soft capacity caps
+
+Redirects are counted in process memory; nothing on the request path
+touches the cache or the database.  A background thread periodically
+publishes the process' counts per time bucket to the ROUTING_SHARE_CACHE
+cache, shared by all workers, sums the sliding-window totals of
+capacity-limited URLs over all workers, and writes hourly totals to the
+database.
+
+Each worker only ever set()s its own keys, with an explicit timeout, so
+no count is lost to concurrent read-modify-write updates and no backend
+shortens a bucket's lifetime.  Workers find each other through a
+registry key; a worker missing from it after a lost concurrent update
+adds itself again on its next sync.
+"""
+
+import atexit
+import collections
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import MirrorURL, RedirectCount
+
+# Bucket number, worker: {mirrorurl id: count}
+BUCKET_KEY = "finnixmirrors:redirects:{}:{}"
+# {worker: time last registered}
+WORKERS_KEY = "finnixmirrors:redirects:workers"
+
+
+class RedirectCounter:
+    """Process-wide redirect counter
+
+    window_count() returns the number of redirects to a MirrorURL within
+    the last ROUTING_SHARE_WINDOW seconds across all workers, as of the
+    last sync plus this process' redirects since then.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._unsynced = collections.Counter()
+        self._unflushed = collections.Counter()
+        self._window = {}
+        self._limited = set()
+        self._worker = uuid.uuid4().hex
+        # Bucket number: this worker's counts in the bucket
+        self._buckets = {}
+        self._registered_at = 0
+        self._thread = None
+        self._last_flush = time.monotonic()
+
+    def record(self, entry):
+        with self._lock:
+            self._unsynced[entry.id] += 1
+            self._unflushed[(entry.id, self._period())] += 1
+            if self._thread is None:
+                self._start_thread()
+
+    def window_count(self, entry):
+        with self._lock:
+            self._limited.add(entry.id)
+            return self._window.get(entry.id, 0) + self._unsynced[entry.id]
+
+    def over_capacity(self, entry):
+        """Return whether a RoutingEntry has used up its capacity"""
+        return entry.capacity is not None and (
+            self.window_count(entry) >= entry.capacity
+        )
+
+    def _start_thread(self):
+        self._thread = threading.Thread(
+            target=self._run, name="redirect-counter", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self._shutdown)
+
+    def _period(self):
+        return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    def _run(self):
+        while True:
+            time.sleep(settings.ROUTING_SHARE_SYNC_INTERVAL)
+            try:
+                self.sync()
+                if (
+                    time.monotonic() - self._last_flush
+                    >= settings.ROUTING_SHARE_FLUSH_INTERVAL
+                ):
+                    self.flush()
+            except Exception:
+                logging.exception("Redirect counter update failed")
+            finally:
+                connections.close_all()
+
+    def _shutdown(self):
+        try:
+            self.sync()
+            self.flush()
+        except Exception:
+            logging.exception("Redirect counter update failed")
+
+    def sync(self):
+        """Publish local counts to the shared cache and read window totals"""
+        cache = caches[settings.ROUTING_SHARE_CACHE]
+        bucket_size = settings.ROUTING_SHARE_BUCKET
+        now = time.time()
+        bucket = int(now // bucket_size)
+        buckets = range(
+            bucket - settings.ROUTING_SHARE_WINDOW // bucket_size, bucket + 1
+        )
+        timeout = settings.ROUTING_SHARE_WINDOW + bucket_size
+
+        with self._lock:
+            unsynced, self._unsynced = self._unsynced, collections.Counter()
+            limited = list(self._limited)
+        self._buckets = {k: v for k, v in self._buckets.items() if k in buckets}
+        if unsynced:
+            counts = self._buckets.setdefault(bucket, collections.Counter())
+            counts.update(unsynced)
+            cache.set(
+                BUCKET_KEY.format(bucket, self._worker),
+                {str(k): v for k, v in counts.items()},
+                timeout=timeout,
+            )
+
+        workers = cache.get(WORKERS_KEY) or {}
+        if self._buckets and (
+            self._worker not in workers or now - self._registered_at >= bucket_size
+        ):
+            workers = {k: v for k, v in workers.items() if now - v < timeout}
+            workers[self._worker] = now
+            cache.set(WORKERS_KEY, workers, timeout=timeout)
+            self._registered_at = now
+
+        window = collections.Counter()
+        if limited:
+            keys = [BUCKET_KEY.format(x, worker) for worker in workers for x in buckets]
+            for counts in cache.get_many(keys).values():
+                for mirrorurl_id in limited:
+                    window[mirrorurl_id] += counts.get(str(mirrorurl_id), 0)
+        with self._lock:
+            self._window = dict(window)
+
+    def flush(self):
+        """Add the hourly redirect counts to the database"""
+        with self._lock:
+            unflushed, self._unflushed = self._unflushed, collections.Counter()
+            self._last_flush = time.monotonic()
+        if not unflushed:
+            return
+        existing = set(
+            MirrorURL.objects.filter(
+                id__in={mirrorurl_id for mirrorurl_id, _ in unflushed}
+            ).values_list("id", flat=True)
+        )
+        with transaction.atomic():
+            for (mirrorurl_id, period), count in unflushed.items():
+                if mirrorurl_id not in existing:
+                    continue
+                RedirectCount.objects.get_or_create(
+                    mirrorurl_id=mirrorurl_id, period=period
+                )
+                RedirectCount.objects.filter(
+                    mirrorurl_id=mirrorurl_id, period=period
+                ).update(count=F("count") + count)
+        logging.debug("Flushed {} redirect counts".format(len(unflushed)))
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_counter():
+    """Return the process-wide RedirectCounter"""
+    global _counter
+
+    with _counter_lock:
+        if _counter is None:
+            _counter = RedirectCounter()
+    return _counter
@@ -0,0 +1,35 @@
+"""Database routing
+
+Reads go to the READ_ONLY_ALIAS connection if one is configured, which
+for SQLite is a second, read-only connection to the same database, so
+the request path never takes (or waits for) the write lock.  Reads in a
+transaction on the default database stay on it to see its uncommitted
+writes.  All writes, e.g. from mirrorcheck and the admin, go to default.
+"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+READ_ONLY_ALIAS = "readonly"
+
+
+class ReadOnlyRouter:
+    def db_for_read(self, model, **hints):
+        if (
+            READ_ONLY_ALIAS not in settings.DATABASES
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return READ_ONLY_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = (DEFAULT_DB_ALIAS, READ_ONLY_ALIAS)
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == READ_ONLY_ALIAS:
+            return False
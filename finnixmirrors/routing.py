@@ -0,0 +1,319 @@
+import datetime
+import fcntl
+import logging
+import struct
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .inventory import Inventory
+from .models import MirrorURL
+from .prefixtable import routing_key
+from .ranking import MirrorRanker, effective_weight
+from .snapshotfile import SnapshotFile, write_snapshot_file
+from .state import get_generation
+
+
+class RoutingEntry:
+    """Immutable routing information for one eligible MirrorURL"""
+
+    __slots__ = (
+        "id",
+        "url",
+        "protocol",
+        "mirror_slug",
+        "country",
+        "latitude",
+        "longitude",
+        "weight",
+        "effective_weight",
+        "capacity",
+        "ewma_connect_time",
+        "ewma_ttfb",
+        "ewma_throughput",
+        "sponsor",
+        "sponsor_url",
+        "date_last_trace",
+        "inventory",
+    )
+
+    def __init__(self, mirrorurl, inventory=None):
+        mirror = mirrorurl.mirror
+        for k, v in (
+            ("id", mirrorurl.id),
+            ("url", mirrorurl.url),
+            ("protocol", mirrorurl.protocol),
+            ("mirror_slug", mirror.slug),
+            ("country", mirror.country),
+            ("latitude", mirror.latitude),
+            ("longitude", mirror.longitude),
+            ("weight", mirrorurl.weight),
+            ("effective_weight", effective_weight(mirrorurl)),
+            ("capacity", mirrorurl.capacity),
+            ("ewma_connect_time", mirrorurl.ewma_connect_time),
+            ("ewma_ttfb", mirrorurl.ewma_ttfb),
+            ("ewma_throughput", mirrorurl.ewma_throughput),
+            ("sponsor", mirror.sponsor),
+            ("sponsor_url", mirror.sponsor_url),
+            ("date_last_trace", mirrorurl.date_last_trace),
+            ("inventory", inventory),
+        ):
+            object.__setattr__(self, k, v)
+
+    @classmethod
+    def from_state(cls, state, inventory=None):
+        """Return a RoutingEntry from the state() of another"""
+        entry = cls.__new__(cls)
+        values = dict(state, id=uuid.UUID(state["id"]), inventory=inventory)
+        if state["date_last_trace"] is not None:
+            values["date_last_trace"] = datetime.datetime.fromtimestamp(
+                state["date_last_trace"], datetime.timezone.utc
+            )
+        for k in cls.__slots__:
+            object.__setattr__(entry, k, values[k])
+        return entry
+
+    def state(self):
+        """Return the fields other than the inventory, as JSON types"""
+        state = {k: getattr(self, k) for k in self.__slots__ if k != "inventory"}
+        state["id"] = str(self.id)
+        if self.date_last_trace is not None:
+            state["date_last_trace"] = self.date_last_trace.timestamp()
+        return state
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RoutingEntry is immutable")
+
+    def __str__(self):
+        return "{} {}".format(self.mirror_slug, self.protocol)
+
+    def has_path(self, path):
+        """Return whether the mirror carries a path, if known"""
+        return self.inventory is None or path in self.inventory
+
+    def __repr__(self):
+        return "<RoutingEntry {}>".format(self)
+
+
+class RoutingSnapshot:
+    """Point-in-time list of MirrorURLs eligible for redirects
+
+    Fresh URLs are preferred; if none are fresh, all successfully
+    checked URLs are eligible, as before.  The snapshot expires after
+    ROUTING_SNAPSHOT_TTL seconds, or when the first fresh URL would
+    become outdated, whichever comes first.  Each entry carries the
+    newest current file inventory of its mirror, from any of its URLs.
+    """
+
+    __slots__ = (
+        "generation",
+        "entries",
+        "by_id",
+        "ranker",
+        "routing_key",
+        "expires_at",
+    )
+
+    def __init__(self, generation, entries, expires_at):
+        self.generation = generation
+        self.entries = entries
+        self.by_id = {str(x.id): x for x in entries}
+        self.ranker = MirrorRanker(entries)
+        self.routing_key = routing_key(entries)
+        self.expires_at = expires_at
+
+    @classmethod
+    def build(cls, generation):
+        now = timezone.now()
+        outdated_delta = timezone.timedelta(hours=settings.OUTDATED_HOURS)
+        expires_at = time.time() + settings.ROUTING_SNAPSHOT_TTL
+
+        inventories = {}
+        for mirror_id, inventory, date_last_inventory in (
+            MirrorURL.objects.filter(
+                enabled=True,
+                mirror__enabled=True,
+                inventory__isnull=False,
+                date_last_inventory__gt=now
+                - timezone.timedelta(seconds=settings.ROUTING_INVENTORY_MAX_AGE),
+            )
+            .order_by("date_last_inventory")
+            .values_list("mirror_id", "inventory", "date_last_inventory")
+        ):
+            inventories[mirror_id] = (Inventory(inventory), date_last_inventory)
+
+        mirrorurls = (
+            MirrorURL.objects.filter(
+                enabled=True,
+                protocol="https",
+                check_success=True,
+                mirror__enabled=True,
+            )
+            .select_related("mirror")
+            .defer("inventory")
+        )
+        all_entries = []
+        fresh_entries = []
+        for mirrorurl in mirrorurls:
+            inventory, date_last_inventory = inventories.get(
+                mirrorurl.mirror_id, (None, None)
+            )
+            if inventory is not None:
+                expires_at = min(
+                    expires_at,
+                    date_last_inventory.timestamp()
+                    + settings.ROUTING_INVENTORY_MAX_AGE,
+                )
+            entry = RoutingEntry(mirrorurl, inventory)
+            all_entries.append(entry)
+            if not entry.date_last_trace:
+                fresh_entries.append(entry)
+                continue
+            outdated_at = entry.date_last_trace + outdated_delta
+            if outdated_at > now:
+                fresh_entries.append(entry)
+                expires_at = min(expires_at, outdated_at.timestamp())
+
+        return cls(generation, tuple(fresh_entries or all_entries), expires_at)
+
+    @classmethod
+    def load(cls, path):
+        """Return the RoutingSnapshot in a snapshot file
+
+        Inventories are searched in the memory-mapped file.
+        """
+        snapshot_file = SnapshotFile(path)
+        inventories = {}
+        entries = []
+        for state in snapshot_file.header["entries"]:
+            inventory = None
+            if state["inventory"] is not None:
+                location = tuple(state["inventory"])
+                if location not in inventories:
+                    inventories[location] = snapshot_file.inventory(location)
+                inventory = inventories[location]
+            entries.append(RoutingEntry.from_state(state, inventory))
+        return cls(
+            snapshot_file.header["generation"],
+            tuple(entries),
+            snapshot_file.header["expires_at"],
+        )
+
+    def write(self, path):
+        """Atomically write the snapshot to a snapshot file"""
+        inventories = []
+        indexes = {}
+        entries = []
+        for entry in self.entries:
+            state = entry.state()
+            state["inventory"] = None
+            if entry.inventory is not None:
+                if id(entry.inventory) not in indexes:
+                    indexes[id(entry.inventory)] = len(inventories)
+                    inventories.append(bytes(entry.inventory))
+                state["inventory"] = indexes[id(entry.inventory)]
+            entries.append(state)
+        write_snapshot_file(
+            path,
+            {
+                "generation": self.generation,
+                "expires_at": self.expires_at,
+                "entries": entries,
+            },
+            inventories,
+        )
+
+    def is_current(self, generation):
+        return generation == self.generation and time.time() < self.expires_at
+
+
+def _load_current(path, generation):
+    """Return the snapshot in a snapshot file if it is current, else None"""
+    try:
+        snapshot = RoutingSnapshot.load(path)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        logging.exception("Invalid routing snapshot file {}".format(path))
+        return
+    if snapshot.is_current(generation):
+        return snapshot
+
+
+def publish_snapshot(generation=None):
+    """Publish a RoutingSnapshot of the current mirror state, and return it
+
+    The snapshot is written to ROUTING_SNAPSHOT_FILE, for the web workers
+    on the node to load instead of querying the database.  Publishers
+    are serialized and the database is only queried if the file is not
+    already current, so workers which find it stale build it once.
+    """
+    if generation is None:
+        generation = get_generation()
+    path = getattr(settings, "ROUTING_SNAPSHOT_FILE", None)
+    if not path:
+        return RoutingSnapshot.build(generation)
+
+    snapshot = None
+    try:
+        with open("{}.lock".format(path), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshot = _load_current(path, generation)
+            if snapshot is None:
+                snapshot = RoutingSnapshot.build(generation)
+                snapshot.write(path)
+                snapshot = RoutingSnapshot.load(path)
+    except OSError as e:
+        logging.error("Cannot publish the routing snapshot: {}".format(e))
+    return snapshot or RoutingSnapshot.build(generation)
+
+
+def load_snapshot(generation):
+    """Return a current RoutingSnapshot for a generation
+
+    The published snapshot file is used if it is current, otherwise one
+    is published.
+    """
+    path = getattr(settings, "ROUTING_SNAPSHOT_FILE", None)
+    return (path and _load_current(path, generation)) or publish_snapshot(generation)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """Return the process-wide RoutingSnapshot, reloading it if needed"""
+    global _snapshot
+
+    generation = get_generation()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.is_current(generation):
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or not _snapshot.is_current(generation):
+            _snapshot = load_snapshot(generation)
+        return _snapshot
+
+
+async def aget_snapshot():
+    """Return the process-wide RoutingSnapshot from async code
+
+    A current snapshot is returned directly; only a reload, which may
+    query the database, is run in a thread.
+    """
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.is_current(get_generation()):
+        return snapshot
+    return await sync_to_async(get_snapshot)()
+
+
+def invalidate_snapshot():
+    global _snapshot
+
+    with _snapshot_lock:
+        _snapshot = None
@@ -15,6 +15,13 @@ import os
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Writable directory for the runtime state shared by the web and mirrorcheck
+# processes on the node: the mirror state generation counter, the routing
+# snapshot and table, and the redirect counts.  It must not be inside the
+# installed package, which is read-only to the service user.  Set by
+# FINNIXMIRRORS_STATE_DIR in the environment, if given.
+STATE_DIR = os.environ.get("FINNIXMIRRORS_STATE_DIR", "/var/lib/finnixmirrors")
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.0/howto/deployment/checklist/
@@ -50,7 +57,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "xff.middleware.XForwardedForMiddleware",
+    "finnixmirrors.middleware.XForwardedForMiddleware",
 ]
 XFF_TRUSTED_PROXY_DEPTH = 1
 
@@ -77,12 +84,34 @@ WSGI_APPLICATION = "finnixmirrors.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# Seconds an SQLite connection waits for a lock held by another one
+# (e.g. mirrorcheck writing a batch) before failing, set along with WAL
+# mode when connections are created
+SQLITE_BUSY_TIMEOUT = 20
+
+# Seconds to keep database connections open between requests.  This
+# helps long-lived threads: WSGI workers, mirrorcheck, and under ASGI the
+# one thread per process in which Django runs synchronous views and
+# database queries (sync_to_async() with thread_sensitive=True).
+CONN_MAX_AGE = 600
+
+# Reads outside of transactions go to the "readonly" connection to the
+# same database (see finnixmirrors.routers); SQLite databases use WAL
+# mode, so reads don't wait for writers.  Writes go to "default".
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
-    }
+        "CONN_MAX_AGE": CONN_MAX_AGE,
+    },
+    "readonly": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": "file:{}?mode=ro".format(os.path.join(BASE_DIR, "db.sqlite3")),
+        "CONN_MAX_AGE": CONN_MAX_AGE,
+        "TEST": {"MIRROR": "default"},
+    },
 }
+DATABASE_ROUTERS = ["finnixmirrors.routers.ReadOnlyRouter"]
 
 
 # Password validation
@@ -98,6 +127,18 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Shared by all worker processes on the node
+    "redirects": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(STATE_DIR, "redirects"),
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 
@@ -116,6 +157,27 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = "/static/"
+# Written by "manage.py collectstatic"; content-hashed names allow
+# far-future caching
+STATIC_ROOT = os.path.join(BASE_DIR, "static-root")
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "finnixmirrors.storage.StaticFilesStorage",
+    },
+}
+
+# Serve collected static files (with immutable cache headers for hashed
+# names and precompressed variants) from the application if WhiteNoise
+# is installed
+try:
+    import whitenoise  # noqa: F401
+except ImportError:
+    pass
+else:
+    MIDDLEWARE.insert(1, "finnixmirrors.middleware.WhiteNoiseMiddleware")
 
 PASSWORD_HASHERS = [
     "django.contrib.auth.hashers.Argon2PasswordHasher",
@@ -125,6 +187,71 @@ PASSWORD_HASHERS = [
     "django.contrib.auth.hashers.ScryptPasswordHasher",
 ]
 
+# GeoIP2 City database; GEOIP2_DB is not set by default, which disables
+# GeoIP-influenced redirects
+# GEOIP2_DB = "/var/lib/GeoIP/GeoLite2-City.mmdb"
+# Number of client networks (/24 or /48) to cache lookups for, per process
+GEOIP2_CACHE_SIZE = 4096
+# Seconds between checks for an updated GEOIP2_DB file
+GEOIP2_RELOAD_CHECK_INTERVAL = 10
+
+# Mirror state generation counter, shared by all processes on the node and
+# bumped whenever Mirror/MirrorURL rows change
+MIRROR_STATE_GENERATION_FILE = os.path.join(STATE_DIR, "mirror-state.generation")
+# Maximum age in seconds of a routing snapshot
+ROUTING_SNAPSHOT_TTL = 300
+# Routing snapshot published by mirrorcheck and admin saves, and
+# memory-mapped by every web worker on the node; if unset, each worker
+# builds its own from the database
+ROUTING_SNAPSHOT_FILE = os.path.join(STATE_DIR, "routing-snapshot.bin")
+
+# Compiled IP prefix to mirror table, written by the build_routing_table
+# command; redirects fall back to live GeoIP lookups while it is missing or
+# stale
+ROUTING_TABLE_FILE = os.path.join(STATE_DIR, "routing-table.bin")
+# Redirects choose among up to ROUTING_SPREAD_CANDIDATES nearest mirrors
+# whose weighted distance is within ROUTING_SPREAD_TOLERANCE_KM of the
+# nearest, in proportion to weight, consistently per client /24 or /48.
+# Set ROUTING_SPREAD_CANDIDATES to 1 to always use the nearest mirror.
+ROUTING_SPREAD_CANDIDATES = 3
+ROUTING_SPREAD_TOLERANCE_KM = 200
+# Number of nearest mirrors considered for each redirect, before those over
+# capacity are skipped; more than ROUTING_SPREAD_CANDIDATES, so clients of
+# capped mirrors spill over to the next nearest
+ROUTING_CAPACITY_CANDIDATES = ROUTING_SPREAD_CANDIDATES * 2
+# Redirects per MirrorURL are counted over a sliding ROUTING_SHARE_WINDOW
+# (in ROUTING_SHARE_BUCKET buckets) and shared between workers through the
+# ROUTING_SHARE_CACHE cache every ROUTING_SHARE_SYNC_INTERVAL seconds; a
+# URL over its capacity spills clients to the next best mirror.  Hourly
+# totals are written to the database every ROUTING_SHARE_FLUSH_INTERVAL.
+ROUTING_SHARE_CACHE = "redirects"
+ROUTING_SHARE_WINDOW = 3600
+ROUTING_SHARE_BUCKET = 300
+ROUTING_SHARE_SYNC_INTERVAL = 10
+ROUTING_SHARE_FLUSH_INTERVAL = 300
+# Redirects only go to mirrors whose file inventory has the requested
+# path; inventories older than this many seconds are ignored
+ROUTING_INVENTORY_MAX_AGE = 2 * 86400
+# Number of mirrors in Metalink (.meta4) and .mirrorlist responses, and
+# seconds those responses are cached for
+ROUTING_MIRRORLIST_MIRRORS = 10
+ROUTING_MIRRORLIST_CACHE_TTL = 300
+# Number of ranked mirrors stored per network
+ROUTING_TABLE_CANDIDATES = ROUTING_CAPACITY_CANDIDATES
+# Seconds between checks for an updated routing table or GeoIP database
+ROUTING_TABLE_CHECK_INTERVAL = 10
+# Function computing the weight a MirrorURL is routed by:
+# "finnixmirrors.ranking.static_weight" uses the admin weight as-is, while
+# "finnixmirrors.ranking.measured_weight" scales it by the throughput and
+# TTFB measured by mirrorcheck, relative to the reference values below
+ROUTING_EFFECTIVE_WEIGHT = "finnixmirrors.ranking.static_weight"
+ROUTING_REFERENCE_THROUGHPUT = 10 * 1024 * 1024
+ROUTING_THROUGHPUT_EXPONENT = 0.5
+ROUTING_REFERENCE_TTFB = 0.2
+ROUTING_TTFB_EXPONENT = 0.25
+# Limits of each measured weight factor
+ROUTING_MEASURED_FACTOR_RANGE = (0.25, 2.0)
+
 # Settings for the "checkmirrors" command
 
 CHECK_TRACE_FILE = "project/trace/feh.colobox.com"
@@ -154,10 +281,60 @@ CHECK_DATA_FILES = [
         ],
     },
 ]
+# Range hash manifest written by the generate_manifest command; if set, it
+# replaces CHECK_DATA_FILES, which are still used while it cannot be loaded
+CHECK_DATA_MANIFEST = None
+# Full-file sweeps ("mirrorcheck --sweep") verify at most this many bytes
+# per mirror per run, at most this many bytes per second
+CHECK_SWEEP_BYTES_PER_RUN = 64 * 1024 * 1024
+CHECK_SWEEP_RATE = 1024 * 1024
+# Bytes fetched per successful HTTPS check to measure throughput and TTFB
+# (0 to disable), and the weight of each new measurement in the moving
+# averages
+CHECK_MEASURE_BYTES = 1024 * 1024
+CHECK_MEASURE_EWMA_ALPHA = 0.3
+# File inventories ("mirrorcheck --inventory") descend at most this many
+# directory levels and list at most this many directories per mirror; a
+# listing cut off by the depth limit is not used for routing
+CHECK_INVENTORY_DEPTH = 3
+CHECK_INVENTORY_MAX_DIRECTORIES = 500
 # Number of files to test per mirror
 CHECK_DATA_FILE_COUNT = 2
 # Number of ranges to test per file
 CHECK_DATA_FILE_RANGE_COUNT = 2
 
+# Check scheduling for "mirrorcheck --daemon", in seconds.  Healthy URLs
+# start at CHECK_INTERVAL, growing by CHECK_INTERVAL_GROWTH per consecutive
+# success; failing URLs back off exponentially from CHECK_INTERVAL_FAILURE;
+# a URL that just recovered is re-checked after CHECK_INTERVAL_RECOVERING.
+CHECK_INTERVAL = 3600
+CHECK_INTERVAL_GROWTH = 1.5
+CHECK_INTERVAL_MAX = 6 * 3600
+CHECK_INTERVAL_FAILURE = 600
+CHECK_INTERVAL_RECOVERING = 300
+# Random spread applied to every interval, as a fraction
+CHECK_JITTER = 0.1
+# Maximum time the daemon sleeps between looking for due URLs
+CHECK_DAEMON_POLL = 60
+# Seconds clients and proxies may cache mirrors.json for; mirror state
+# changes at most once per check pass
+MIRRORS_JSON_MAX_AGE = CHECK_INTERVAL // 12
+# Seconds clients and proxies may cache the index and mirror pages for
+PAGE_MAX_AGE = 60
+# Seconds MirrorURL status changes are kept for mirrors.json?since=<seq>
+CHANGE_LOG_RETENTION = 7 * 86400
+# Maximum changes per mirrors.json?since=<seq> response
+CHANGE_LOG_PAGE_SIZE = 1000
+# Seconds between checks for new changes by each mirrors/events stream,
+# and between keepalive comments
+MIRROR_EVENTS_POLL_INTERVAL = 1
+MIRROR_EVENTS_KEEPALIVE = 15
+# Number of checked URLs written to the database per transaction
+CHECK_WRITE_BATCH_SIZE = 50
+
+# When a data file's ETag/Last-Modified are unchanged since its ranges were
+# last verified, range verification is skipped, except on every Nth run
+CHECK_DATA_FILE_REVERIFY_RUNS = 10
+
 # Number of hours before a mirror is considered outdated
 OUTDATED_HOURS = 28
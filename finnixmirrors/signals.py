@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .changes import MIRROR_STATUS_FIELDS, STATUS_FIELDS, record_changes
+from .models import Mirror, MirrorURL
+from .routers import READ_ONLY_ALIAS
+from .routing import invalidate_snapshot, publish_snapshot
+from .state import bump_generation
+
+
+def _status(instance):
+    fields = STATUS_FIELDS if isinstance(instance, MirrorURL) else MIRROR_STATUS_FIELDS
+    return {k: getattr(instance, k) for k in fields}
+
+
+@receiver(pre_save, sender=Mirror)
+@receiver(pre_save, sender=MirrorURL)
+def remember_status(sender, instance, **kwargs):
+    """Keep the stored status of an edited row, to compare after saving"""
+    instance._stored_status = None
+    if not instance._state.adding:
+        instance._stored_status = (
+            sender.objects.filter(pk=instance.pk)
+            .values(*_status(instance).keys())
+            .first()
+        )
+
+
+@receiver(post_save, sender=Mirror)
+@receiver(post_delete, sender=Mirror)
+@receiver(post_save, sender=MirrorURL)
+@receiver(post_delete, sender=MirrorURL)
+def mirror_state_changed(sender, instance, **kwargs):
+    # Edits of other fields (e.g. weight) change routing, but are not
+    # status changes for the change log
+    status_changed = kwargs["signal"] is post_delete or (
+        getattr(instance, "_stored_status", None) != _status(instance)
+    )
+    if sender is MirrorURL:
+        if kwargs["signal"] is post_delete:
+            event = "deleted"
+        elif kwargs["created"]:
+            event = "created"
+        else:
+            event = "changed"
+        if status_changed:
+            record_changes([instance], event)
+    elif kwargs["signal"] is post_save and not kwargs["created"] and status_changed:
+        # e.g. the mirror was disabled; deletions cascade to the URLs
+        record_changes(instance.mirrorurl_set.all())
+    # Other workers must not load the old state for the new generation
+    transaction.on_commit(state_committed)
+
+
+def state_committed():
+    invalidate_snapshot()
+    bump_generation()
+    publish_snapshot()
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "PRAGMA busy_timeout = {:d}".format(
+                int(settings.SQLITE_BUSY_TIMEOUT * 1000)
+            )
+        )
+        if connection.alias != READ_ONLY_ALIAS:
+            # Readers don't block the writer and vice versa; WAL mode
+            # persists in the database file
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
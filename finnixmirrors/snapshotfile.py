@@ -0,0 +1,87 @@
+"""Shared routing snapshot file
+
+mirrorcheck and admin saves publish the eligible MirrorURLs of each
+mirror state generation to this file, which every web worker on the
+node memory-maps instead of querying the database itself.  The file is
+replaced atomically; a worker loads a new one when the generation
+counter changes.
+
+File layout (all integers big-endian):
+
+    magic "FMRS", u16 format version, u16 reserved,
+    u32 header length, JSON header, zero padding to 8 bytes,
+    inventories: sorted u64 path hashes, as in MirrorURL.inventory
+
+The header has the snapshot's generation, its expiry time and its
+entries, each with the [offset, count] of its mirror's inventory
+relative to the start of the inventories, if any.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+from .inventory import MappedInventory
+
+MAGIC = b"FMRS"
+VERSION = 1
+_PREAMBLE = struct.Struct(">4sHHI")
+
+
+def write_snapshot_file(path, header, inventories):
+    """Atomically write a snapshot file
+
+    inventories is a list of packed inventories; entries in the header
+    refer to them by index as "inventory", which is replaced by their
+    [offset, count] in the file.
+    """
+    locations = []
+    offset = 0
+    for packed in inventories:
+        locations.append([offset, len(packed) // 8])
+        offset += len(packed)
+    header = dict(
+        header,
+        entries=[
+            dict(
+                x,
+                inventory=(
+                    None if x["inventory"] is None else locations[x["inventory"]]
+                ),
+            )
+            for x in header["entries"]
+        ],
+    )
+    header_bytes = json.dumps(header, sort_keys=True).encode("UTF-8")
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, 0, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (-f.tell() % 8))
+        for packed in inventories:
+            f.write(packed)
+    os.replace(tmp, path)
+
+
+class SnapshotFile:
+    """Memory-mapped snapshot file"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, header_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(
+                "{}: not a version {} routing snapshot".format(path, VERSION)
+            )
+        pos = _PREAMBLE.size
+        self.header = json.loads(self._mm[pos : pos + header_len].decode("UTF-8"))
+        pos += header_len
+        self._base = pos + (-pos % 8)
+
+    def inventory(self, location):
+        """Return a MappedInventory for an [offset, count] header location"""
+        offset, count = location
+        return MappedInventory(self._mm, self._base + offset, count)
@@ -0,0 +1,92 @@
+import contextlib
+import fcntl
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_cached = (None, 0)
+_batch_depth = 0
+_batch_pending = False
+
+
+def _read_generation(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def get_generation():
+    """Return the current mirror state generation
+
+    The generation is a counter shared by all processes on the node,
+    incremented whenever Mirror or MirrorURL state changes.  Reading it
+    costs a stat() unless the file has been replaced since the last call.
+    """
+    global _cached
+
+    path = settings.MIRROR_STATE_GENERATION_FILE
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    stat_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        if _cached[0] == stat_key:
+            return _cached[1]
+    generation = _read_generation(path)
+    with _lock:
+        _cached = (stat_key, generation)
+    return generation
+
+
+def bump_generation():
+    """Increment the mirror state generation
+
+    Inside a batch_bumps() block the increment is deferred until the
+    outermost block exits.  A failure to write the counter is logged
+    rather than raised, so it does not fail the change being saved.
+    """
+    global _batch_pending
+
+    with _lock:
+        if _batch_depth:
+            _batch_pending = True
+            return
+
+    path = settings.MIRROR_STATE_GENERATION_FILE
+    try:
+        with open("{}.lock".format(path), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            generation = _read_generation(path) + 1
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "w") as f:
+                f.write("{}\n".format(generation))
+            os.replace(tmp, path)
+    except OSError as e:
+        logging.error("Cannot bump the mirror state generation: {}".format(e))
+        return
+    return generation
+
+
+@contextlib.contextmanager
+def batch_bumps():
+    """Coalesce generation bumps made within the block into one"""
+    global _batch_depth, _batch_pending
+
+    with _lock:
+        _batch_depth += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _batch_depth -= 1
+            bump = not _batch_depth and _batch_pending
+            if bump:
+                _batch_pending = False
+        if bump:
+            bump_generation()
@@ -1,29 +1,30 @@
+// Marker icons are inlined to save a request each
 var icon_green = new OpenLayers.Icon(
-  fmStaticPath + '/mm_20_green.png',
+  'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAwAAAAUCAYAAAC58NwRAAAABGdBTUEAAK/INwWK6QAAABl0RVh0U29mdHdhcmUAQWRvYmUgSW1hZ2VSZWFkeXHJZTwAAAHcSURBVHjajJI/aBNhGMaf3OVSm+RKIINwrX+ILrHLIXQwg9JV6dShrTp0UMHirIuTgy6FiqB06KQ4dGvp5OJQoRCk0JamKUJUVARJ2oh3lHr1vs/3Oa7+ianNA7/j3vd7n4/3e78vgb9VEkaF03H8VpgVXrXUISE8ErSVtbRzztFOydEpO6WZE6YFc7+QeixMFK8U4d50YR+3o6T/ycfq9CoqTysMZ4TrdJ0XnhQvFzH4cBDJI0mE30OoHwpduS4UhgrYqe+gvlI/K3VLhnxGkt1JuLdcBH6AMAh/9cn/wAvgTriQ9pgapuFk/kwedp8Ntadazxblsk4W+f48w2M0hGxBK42DxDXW0E/DeqPSwNbGFthaq3im5psmGmsNhps0PJPB7ZYflKFCBcM0fs/aTEBrjfL9aG2PtZwSrV+9D95F76OHwqVCZKSstIXFO4uoLdQY3hbmzHiz14KxXd2+YGUs9JZ6YVgGqs+rWJ5a5vqkcK/d+V7ypseWxvT4+rhOH01zEnRY+wVmi2FTBepaKpOC/9lHbT5q5Qbz+I9eyNx17lSOu6/98XwO1NX4wZG76EAnhCA2DHRi4EW8E74JPf9cZBsDL+GLsBubDjVQzdiITg3vhUy7hZ8CDACEjqcjUTSjTQAAAABJRU5ErkJggg==',
   new OpenLayers.Size(12,20),
   new OpenLayers.Pixel(-(12/2), -20)
 );
 
 var icon_red = new OpenLayers.Icon(
-  fmStaticPath + '/mm_20_red.png',
+  'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAwAAAAUCAYAAAC58NwRAAAABGdBTUEAAK/INwWK6QAAABl0RVh0U29mdHdhcmUAQWRvYmUgSW1hZ2VSZWFkeXHJZTwAAAHESURBVHjajJI/LENRFMZP+96j2qIkNFENwkAMQiIREhIMGBg6MBhFgsFGBxazSVKRGAxisFktFolIhPgXOqBSJIikVKWt6ru+8/peQhU9ye/l3XO+795z/5joe7SCIVCjj6/AOthO05EJLABRIMuis6hEdAOHrAjOgSUgfTX4uDDuqhL3rT1CdHk0Htt6xWR5tWFaJt3VDhYnyqrIV99MdgkpVYVEkE3JoZ5SN4XfY7QbDjVBt2PGZ9AGkbeylij5kRIbwf8fCZpGrVBWOONhQ2WD3UHledbvYiOESs7cPGrMd/DIzYZkTE1qLfwegjQNpmTD6eHrMx1FwtiR9FNrlugctf1wiEd+NqyikZj34gSLYBWT6cthp/69lyeUECLBWp7yCTxfRN/6gtE3GnC6tb61kGQa8x/Q2sMtj6bAhtHDHi9+GHnpcKCtlmInZjfTyl2AZgNnXJ8Hc5l2t8U3fYsLi7T3C1euhU9iHyiGIH2X/riqjtglhYLxKFq54dwo5/84QtqssFhFnTWfZz/W39mfMay/HWaGsogK8K4bmrMx8N0EAG6SCtKLcgYDX8IDiOmmfw0cId1I2RqugS1T4VOAAQDkdp2PrH9XuAAAAABJRU5ErkJggg==',
   new OpenLayers.Size(12,20),
   new OpenLayers.Pixel(-(12/2), -20)
 );
 
 var icon_gray = new OpenLayers.Icon(
-  fmStaticPath + '/mm_20_gray.png',
+  'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAwAAAAUCAYAAAC58NwRAAAABGdBTUEAAK/INwWK6QAAABl0RVh0U29mdHdhcmUAQWRvYmUgSW1hZ2VSZWFkeXHJZTwAAAHJSURBVHjajJK9a1phFMYfteJ3JkEcihkq7mqXDi3olkXhDu1QcSn9EzoFhCwunQK3FIpTpg5qHKuSJaBDyBKCXERsF4VIsaWg6PXj5JybK0kvNvWB3+We95znvO8997Xhb71g3jDPzLjPfGXOLXWwMccMeb1eisfjlEgkyO/3k6wxnxnHQ4MqiWw2S+VymVqtFrXbbapWq6Qoysb0BabrJfMpk8mgUCjA7XZD13Usl0sEAgGk02mMx2N0Op0417Xs/HgtRfl8HtPp1CjeaLFYYDKZIJfLwefzyZIihv1oNIpwOGwUWCU7hUIhxGIxCZ+KYSVd1+s1/iXJzedz41UM191uF71ezzi/VS6XC/1+H5qmSaiJ4YSIZqqqYrVaweG4n57dbr8b4V1Oznsi2Z/M78FgcDAcDpFKpQyjSHYsFotoNpsSfmBON+0upCEf6xX/OCSTSTidTtRqNZRKJcl/ZI62fd8Zj48qlQrV63UKBoPywy4Z56bAYTFoPNp3Ho8Ho9EIjUZD1t7LOh7RN547RSIR6X5l3rNH9da8O8IhdlCE0U3D810MMvzvzB9mz5p8su0mMDfMzDT91yD6ZRqxq+EH49uWuBVgAPdRr/P0nqBWAAAAAElFTkSuQmCC',
   new OpenLayers.Size(12,20),
   new OpenLayers.Pixel(-(12/2), -20)
 );
 
 var icon_blue = new OpenLayers.Icon(
-  fmStaticPath + '/mm_20_blue.png',
+  'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAwAAAAUCAYAAAC58NwRAAAABGdBTUEAAK/INwWK6QAAABl0RVh0U29mdHdhcmUAQWRvYmUgSW1hZ2VSZWFkeXHJZTwAAAHASURBVHjajJIxSAJhFMefnt+BnVzWckLFNeQQCFEQREFBNERLSIMNjRVkezlUQ9DWUmA0BA3S0Nba0hJEEUVJmGKUREuUnsiJlpxf79kValY++B3fe9/7f/fe+z4LVFo/Mol0mP49so8cV+WBBdlEOGMyV5Rh7nKNcFF0cooh24jwlUgWRPxutx88nhVwOJRSUNdfIBJZg1hsg9wdZIZUg8iW2z0PAwNBEAQHGAZAsQggihKo6ijkchlIJk97MO/Eih+fzSbhyQEoFD4Tv4zWFPN4FoGxRgpNkKC9qakLy2itSC4XNTQo0NzcTW4bCQzDyAPn8KdRDulJcJNKXYGmXYPN9jNRwC7T6Vvs4YLcKAlCKMxfXgbw9xwslrJZm2va45y6gRBN6RVJ6/rdWDb7iFMZ/+6F/nh2NgeJxB65C8iBYB52jlg17WqIMSe4XH2lUuLxXQiHl2l/HVmt1dsR3bTX+8R9Pp3b7S00CiqeffdUJYgWi2/TjDmAyjNLmaX4XxM8lCSVy3InnR4uez6/2pT54IglqMNU5N0U9NYjoLt5QDKIXL1Z426BbuEZyZuifwVkmimEegUJRKq18SHAAJM0l0WNxRYoAAAAAElFTkSuQmCC',
   new OpenLayers.Size(12,20),
   new OpenLayers.Pixel(-(12/2), -20)
 );
 
 var icon_orange = new OpenLayers.Icon(
-  fmStaticPath + '/mm_20_orange.png',
+  'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAwAAAAUCAYAAAC58NwRAAAABGdBTUEAAK/INwWK6QAAABl0RVh0U29mdHdhcmUAQWRvYmUgSW1hZ2VSZWFkeXHJZTwAAAGwSURBVHjajJI9LARREMfn7boPt7unkSBxOYWgkggaBRqNSohQKIiPRBQSDRKNlu5EconyqmuprqFAIw7xEeTiI1FJJBJEbu92d8ysXc7d4Sb5vcx7M//35s17An5aBzFM1DvzWyJO7OblgSAiBGqKwK5WGbvbZKxQBfIaESXkXME6Byb7PZjaVDB7qKJB3GwpOD3odUUbbnKnm4xnGuoHKr7sfcI+nms4M+RxRT0SDUMBv4CFMS/o7wh65vtY9tNvCPOjXggqXDUMsKCuuUGCcI0EmSwUWNYAqK2SoKWJUyHEo6lnEEwL7ZsXM4tiaf3TZcH5ybUFZykLyv2FyeU+gIsbC5KXJk+vWBBD2mAhooNhCpBzmidLfFMBi2scAy445sZmuAsjvR67na/7BHXJTGo43vfVobn805c5sDLrQzzWEI80jC753eTVX64H25oC9oM97ahYU2m/dJLwfJWZJ7ii1k6oAQEPjwjxhMFrU7wOf1giVC2wsU7i3U+df/anjTh1M0tQgoWJjCNoL0XAb3NHvBDB/GBZsZ9APBJpR/SvgO3ZEUKpgntCKRb4EGAAw9qvqkFvafEAAAAASUVORK5CYII=',
   new OpenLayers.Size(12,20),
   new OpenLayers.Pixel(-(12/2), -20)
 );
@@ -151,3 +152,43 @@ function setMarker(map, lon, lat, icon_base, layer, content_html, hover){
 
   layer.addMarker(marker);
 }
+
+// Load all mirror markers from a markers.json endpoint.  Markers are added
+// to their layers before the layers are added to the map, so they are
+// drawn in one pass.
+function loadMarkers(map, url) {
+  var layers = {
+    good: new OpenLayers.Layer.Markers("Good mirrors"),
+    outdated: new OpenLayers.Layer.Markers("Outdated mirrors"),
+    error: new OpenLayers.Layer.Markers("Down mirrors"),
+  };
+  var icons = {good: icon_green, outdated: icon_orange, error: icon_red};
+
+  var request = new XMLHttpRequest();
+  request.open("GET", url);
+  request.onload = function() {
+    if (request.status != 200) {
+      return;
+    }
+    var data = JSON.parse(request.responseText);
+    var fields = {};
+    for (var i = 0; i < data.fields.length; i++) {
+      fields[data.fields[i]] = i;
+    }
+    for (var i = 0; i < data.markers.length; i++) {
+      var marker = data.markers[i];
+      var status = marker[fields.status];
+      setMarker(
+        map,
+        marker[fields.longitude],
+        marker[fields.latitude],
+        icons[status],
+        layers[status],
+        marker[fields.slug],
+        0
+      );
+    }
+    map.addLayers([layers.good, layers.outdated, layers.error]);
+  };
+  request.send();
+}
@@ -0,0 +1,39 @@
+// Relative times are computed in the browser, so cached pages don't go stale
+function fmNaturalTime(seconds) {
+  var units = [
+    ["year", 365 * 86400],
+    ["month", 30 * 86400],
+    ["week", 7 * 86400],
+    ["day", 86400],
+    ["hour", 3600],
+    ["minute", 60],
+    ["second", 1],
+  ];
+  var abs = Math.abs(seconds);
+  if (abs < 1) {
+    return "now";
+  }
+  for (var i = 0; i < units.length; i++) {
+    var count = Math.floor(abs / units[i][1]);
+    if (count >= 1) {
+      var text = count + " " + units[i][0] + (count == 1 ? "" : "s");
+      return seconds >= 0 ? text + " ago" : "in " + text;
+    }
+  }
+}
+
+function fmRelativeTimes() {
+  var now = Date.now();
+  var elements = document.querySelectorAll("time.fm-relative");
+  for (var i = 0; i < elements.length; i++) {
+    var when = Date.parse(elements[i].getAttribute("datetime"));
+    if (!isNaN(when)) {
+      elements[i].textContent = fmNaturalTime((now - when) / 1000);
+    }
+  }
+}
+
+document.addEventListener("DOMContentLoaded", function() {
+  fmRelativeTimes();
+  setInterval(fmRelativeTimes, 60000);
+});
@@ -0,0 +1,25 @@
+try:
+    from whitenoise.storage import (
+        CompressedManifestStaticFilesStorage as BaseStaticFilesStorage,
+    )
+except ImportError:
+    from django.contrib.staticfiles.storage import (
+        ManifestStaticFilesStorage as BaseStaticFilesStorage,
+    )
+
+
+class StaticFilesStorage(BaseStaticFilesStorage):
+    """Content-hashed static files, with gzip/brotli variants if available
+
+    With WhiteNoise installed, collectstatic also writes precompressed
+    variants of each file.  Before collectstatic has been run (e.g. in
+    development and tests), unhashed names are used.
+    """
+
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
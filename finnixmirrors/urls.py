@@ -7,6 +7,8 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("mirror/<slug>/", views.MirrorView.as_view(), name="mirror"),
     path("mirrors.json", views.mirrors_json, name="mirrors_json"),
+    path("mirrors/events", views.mirror_events, name="mirror_events"),
+    path("mirrors/markers.json", views.mirror_markers, name="mirror_markers"),
     path("releases/", views.releases, name="releases"),
     path("releases/<path:path>", views.releases, name="releases"),
     path("", views.index, name="index"),
@@ -1,62 +1,110 @@
+import asyncio
+import gzip
+import hashlib
 import ipaddress
+import json
 import random
+import time
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import (
+    Case,
+    Exists,
+    Max,
+    OuterRef,
+    Prefetch,
+    Q,
+    Value,
+    When,
+)
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.template import loader
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils import timezone
+from django.utils.http import content_disposition_header, http_date
 from django.views.generic.detail import DetailView
 
 try:
-    import geoip2.database as geoip_db
+    import brotli
 except ImportError as e:
-    geoip_db = e
-
-try:
-    from geopy.distance import distance
-except ImportError as e:
-    distance = e
+    brotli = e
 
+from .changes import change_info, changes_since, latest_seq, url_state
+from .geoip import client_network, get_reader
+from .manifest import get_data_file
+from .metalink import build_metalink, build_mirrorlist
 from .models import Mirror, MirrorURL
+from .prefixtable import get_table
+from .ranking import near_candidates, rendezvous_choice
+from .redirects import get_counter
+from .routing import aget_snapshot, get_snapshot
+from .state import get_generation
 
 
 class MirrorView(DetailView):
     template_name = "finnixmirrors/mirror.html"
-    model = Mirror
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        _mirror_populate(context["mirror"])
-        return context
-
-
-def _mirror_populate(mirror):
-    status = "good"
-    mirrorurls = mirror.mirrorurl_set.filter(enabled=True)
-    for mirrorurl in mirrorurls:
-        if mirrorurl.outdated:
-            status = "outdated"
-    for mirrorurl in mirrorurls:
-        if not mirrorurl.check_success:
-            status = "error"
-            break
-    setattr(
-        mirror,
-        "urls_last_trace",
-        max([x.date_last_trace for x in mirrorurls if x.date_last_trace]),
+
+    def get_queryset(self):
+        return _mirror_queryset()
+
+    def get(self, request, *args, **kwargs):
+        def render():
+            response = super(MirrorView, self).get(request, *args, **kwargs)
+            response.render()
+            return response.content, _outdated_at([self.object])
+
+        return _cached_page(request, "mirror:{}".format(kwargs["slug"]), render)
+
+
+def _mirror_queryset():
+    """Return Mirrors annotated with their status and enabled URLs
+
+    status is "error" if any enabled URL is failing, "outdated" if any
+    is outdated, else "good"; urls_last_trace is the newest trace of the
+    enabled URLs.  The URLs themselves are prefetched into mirrorurls,
+    so any number of mirrors takes two queries.
+    """
+    enabled_urls = MirrorURL.objects.filter(mirror=OuterRef("pk"), enabled=True)
+    outdated_before = timezone.now() - timezone.timedelta(hours=settings.OUTDATED_HOURS)
+    return Mirror.objects.annotate(
+        status=Case(
+            When(Exists(enabled_urls.filter(check_success=False)), then=Value("error")),
+            When(
+                Exists(enabled_urls.filter(date_last_trace__lte=outdated_before)),
+                then=Value("outdated"),
+            ),
+            default=Value("good"),
+        ),
+        urls_last_trace=Max(
+            "mirrorurl__date_last_trace", filter=Q(mirrorurl__enabled=True)
+        ),
+    ).prefetch_related(
+        Prefetch(
+            "mirrorurl_set",
+            queryset=MirrorURL.objects.filter(enabled=True).defer("inventory"),
+            to_attr="mirrorurls",
+        )
     )
-    setattr(mirror, "mirrorurls", mirrorurls)
-    setattr(mirror, "status", status)
 
 
 def _mirror_info():
-    mirrors = []
-    for mirror in Mirror.objects.filter(enabled=True).order_by("country", "slug"):
-        _mirror_populate(mirror)
-        mirrors.append(mirror)
-    return mirrors
+    return list(_mirror_queryset().filter(enabled=True).order_by("country", "slug"))
 
 
-def mirrors_json(request):
+def _mirrors_json_data():
     out = {}
     for mirror in _mirror_info():
         m = {
@@ -69,102 +117,446 @@ def mirrors_json(request):
             "urls": [],
         }
         for mirrorurl in mirror.mirrorurls:
-            m["urls"].append(
-                {
-                    "url": mirrorurl.url,
-                    "protocol": mirrorurl.protocol,
-                    "ipv4": mirrorurl.ipv4,
-                    "ipv6": mirrorurl.ipv6,
-                    "check_success": mirrorurl.check_success,
-                    "date_last_check": mirrorurl.date_last_check,
-                    "date_last_success": mirrorurl.date_last_success,
-                    "date_last_trace": mirrorurl.date_last_trace,
-                    "head_allowed": mirrorurl.head_allowed,
-                    "range_allowed": mirrorurl.range_allowed,
-                }
-            )
+            m["urls"].append(url_state(mirrorurl))
         out[mirror.slug] = m
 
-    return JsonResponse({"mirrors": out})
+    return {"seq": latest_seq(), "mirrors": out}
 
 
-def index(request):
-    context = {"mirrors": _mirror_info()}
-    template = loader.get_template("finnixmirrors/index.html")
-    return HttpResponse(template.render(context, request))
+def _mirrors_json_document(generation):
+    """Return the cached mirrors.json variants for a mirror state generation
 
+    The serialized JSON is stored along with gzip and (if available)
+    brotli compressed variants, their ETags and the time it was built.
+    """
+    cache_key = "finnixmirrors:mirrors_json:{}".format(generation)
+    document = cache.get(cache_key)
+    if document is not None:
+        return document
 
-def get_geoip_mirrors(mirrorurls, ip):
-    if not hasattr(settings, "GEOIP2_DB") or not settings.GEOIP2_DB:
-        return
-    if isinstance(geoip_db, ImportError):
+    body = json.dumps(_mirrors_json_data(), cls=DjangoJSONEncoder).encode("UTF-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    bodies = {"identity": body, "gzip": gzip.compress(body, mtime=0)}
+    if not isinstance(brotli, ImportError):
+        bodies["br"] = brotli.compress(body)
+    document = {
+        "bodies": bodies,
+        # Strong ETags must differ between encodings
+        "etags": {
+            encoding: '"{}{}"'.format(
+                digest, "" if encoding == "identity" else "-" + encoding
+            )
+            for encoding in bodies
+        },
+        "last_modified": int(time.time()),
+    }
+    cache.set(cache_key, document, None)
+    return document
+
+
+def _accepted_encodings(header):
+    encodings = set()
+    for item in header.split(","):
+        encoding, _, params = item.partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def _parse_seq(value):
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
         return
-    if isinstance(distance, ImportError):
+    return seq if seq >= 0 else None
+
+
+def _mirrors_json_changes(request):
+    since = _parse_seq(request.GET["since"])
+    if since is None:
+        return HttpResponseBadRequest("Invalid since")
+    changes = changes_since(since, settings.CHANGE_LOG_PAGE_SIZE)
+    if changes is None:
+        # Fetch the full mirrors.json again
+        return JsonResponse(
+            {"error": "Changes since {} are no longer available".format(since)},
+            status=410,
+        )
+    response = JsonResponse(
+        {
+            "seq": changes[-1].seq if changes else max(since, latest_seq()),
+            "more": len(changes) >= settings.CHANGE_LOG_PAGE_SIZE,
+            "changes": [change_info(x) for x in changes],
+        }
+    )
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+_mirrors_json_local = (None, None)
+
+
+async def _amirrors_json_document(generation):
+    """Return the mirrors.json document from async code
+
+    The document for the current generation is also kept in process
+    memory, so serving it needs no thread, cache or database access.
+    """
+    global _mirrors_json_local
+
+    local_generation, document = _mirrors_json_local
+    if local_generation == generation:
+        return document
+    document = await sync_to_async(_mirrors_json_document)(generation)
+    _mirrors_json_local = (generation, document)
+    return document
+
+
+async def mirrors_json(request):
+    if "since" in request.GET:
+        return await sync_to_async(_mirrors_json_changes)(request)
+    document = await _amirrors_json_document(get_generation())
+    accepted = _accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    for encoding in ("br", "gzip", "identity"):
+        if encoding == "identity" or (
+            encoding in accepted and encoding in document["bodies"]
+        ):
+            break
+    etag = document["etags"][encoding]
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=document["last_modified"]
+    )
+    if response is None:
+        response = HttpResponse(
+            document["bodies"][encoding], content_type="application/json"
+        )
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(document["last_modified"])
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=settings.MIRRORS_JSON_MAX_AGE,
+        stale_while_revalidate=settings.MIRRORS_JSON_MAX_AGE,
+    )
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def _event(event, data, seq=None):
+    lines = []
+    if seq is not None:
+        lines.append("id: {}".format(seq))
+    lines.append("event: {}".format(event))
+    lines.append("data: {}".format(json.dumps(data, cls=DjangoJSONEncoder)))
+    return "\n".join(lines) + "\n\n"
+
+
+async def mirror_events(request):
+    """Server-sent events stream of MirrorURL changes
+
+    Resumes after the Last-Event-ID header or ?since=<seq>, otherwise
+    starts at the end of the change log.  Each stream stats the mirror
+    state generation file every MIRROR_EVENTS_POLL_INTERVAL seconds and
+    only queries the change log when it moves.  Long-lived streams are
+    meant to be served by the ASGI application.
+    """
+    since = _parse_seq(request.headers.get("Last-Event-ID", request.GET.get("since")))
+    if since is None:
+        since = await sync_to_async(latest_seq)()
+
+    async def stream():
+        nonlocal since
+        generation = None
+        last_sent = time.monotonic()
+        yield "retry: 5000\n\n"
+        while True:
+            if get_generation() != generation:
+                generation = get_generation()
+                changes = await sync_to_async(changes_since)(
+                    since, settings.CHANGE_LOG_PAGE_SIZE
+                )
+                if changes is None:
+                    since = await sync_to_async(latest_seq)()
+                    yield _event("reset", {"seq": since}, since)
+                    changes = []
+                for change in changes:
+                    yield _event("change", change_info(change), change.seq)
+                    since = change.seq
+                if changes:
+                    last_sent = time.monotonic()
+                if len(changes) >= settings.CHANGE_LOG_PAGE_SIZE:
+                    # Not caught up yet
+                    generation = None
+                    continue
+            if time.monotonic() - last_sent >= settings.MIRROR_EVENTS_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(settings.MIRROR_EVENTS_POLL_INTERVAL)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    patch_cache_control(response, no_cache=True)
+    # Disable proxy buffering (nginx)
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _outdated_at(mirrors):
+    """Return when the first of the mirrors' URLs becomes outdated, or None"""
+    now = timezone.now()
+    outdated_delta = timezone.timedelta(hours=settings.OUTDATED_HOURS)
+    outdated_at = [
+        x.date_last_trace + outdated_delta
+        for mirror in mirrors
+        for x in mirror.mirrorurls
+        if x.date_last_trace and x.date_last_trace + outdated_delta > now
+    ]
+    return min(outdated_at).timestamp() if outdated_at else None
+
+
+def _cached_page(request, name, render, content_type=None):
+    """Serve a rendered page from the cache, with conditional GET support
+
+    Pages are cached per mirror state generation.  render() returns the
+    body and the time (or None) at which it goes stale regardless of the
+    generation, e.g. because a mirror becomes outdated.
+    """
+    cache_key = "finnixmirrors:page:{}:{}".format(get_generation(), name)
+    document = cache.get(cache_key)
+    if document is None:
+        body, expires_at = render()
+        document = {
+            "body": body,
+            "etag": '"{}"'.format(hashlib.sha256(body).hexdigest()[:32]),
+            "last_modified": int(time.time()),
+        }
+        cache.set(
+            cache_key,
+            document,
+            None if expires_at is None else max(expires_at - time.time(), 1),
+        )
+
+    response = get_conditional_response(
+        request, etag=document["etag"], last_modified=document["last_modified"]
+    )
+    if response is None:
+        response = HttpResponse(document["body"], content_type=content_type)
+    response["ETag"] = document["etag"]
+    response["Last-Modified"] = http_date(document["last_modified"])
+    patch_cache_control(response, public=True, max_age=settings.PAGE_MAX_AGE)
+    return response
+
+
+def index(request):
+    def render():
+        mirrors = _mirror_info()
+        template = loader.get_template("finnixmirrors/index.html")
+        return (
+            template.render({"mirrors": mirrors}, request).encode("UTF-8"),
+            _outdated_at(mirrors),
+        )
+
+    return _cached_page(request, "index", render)
+
+
+def mirror_markers(request):
+    """Map markers for the enabled mirrors, as compact JSON"""
+
+    def render():
+        mirrors = _mirror_info()
+        data = {
+            "fields": ["slug", "latitude", "longitude", "status"],
+            "markers": [
+                [x.slug, x.latitude, x.longitude, x.status]
+                for x in mirrors
+                if x.latitude is not None and x.longitude is not None
+            ],
+        }
+        return (
+            json.dumps(data, separators=(",", ":")).encode("UTF-8"),
+            _outdated_at(mirrors),
+        )
+
+    return _cached_page(request, "markers", render, content_type="application/json")
+
+
+def get_geoip_mirrors(ranker, ip, limit=None, exact=False):
+    reader = get_reader()
+    if not reader:
         return
 
     try:
-        with geoip_db.Reader(settings.GEOIP2_DB) as reader:
-            geoip_response = reader.city(ip)
-        ip_location = (
+        geoip_response = reader.city(ip)
+        distances = ranker.rank(
             geoip_response.location.latitude,
             geoip_response.location.longitude,
+            limit=limit,
+            exact=exact,
         )
     except Exception:
         return
 
-    distances = []
-    for mirrorurl in mirrorurls:
-        if (not mirrorurl.mirror.latitude) or (not mirrorurl.mirror.longitude):
-            continue
-        mirror_location = (mirrorurl.mirror.latitude, mirrorurl.mirror.longitude)
-        mirror_distance = distance(ip_location, mirror_location).kilometers
-        weighted_distance = mirror_distance / mirrorurl.weight
-        distances.append((mirrorurl, mirror_distance, weighted_distance))
-
     return (distances, geoip_response)
 
 
-def get_geoip_mirror(mirrorurls, ip):
-    ret = get_geoip_mirrors(mirrorurls, ip)
-    if not ret:
+def get_geoip_candidates(ranker, ip, path="", limit=None):
+    if limit is None:
+        limit = settings.ROUTING_CAPACITY_CANDIDATES
+    # Rank all mirrors only if none of the nearest carry the path
+    for rank_limit in (limit, None):
+        ret = get_geoip_mirrors(ranker, ip, limit=rank_limit)
+        if not ret:
+            return
+        distances, geoip_response = ret
+        candidates = [x for x in distances if x[0].has_path(path)]
+        if candidates:
+            return candidates[:limit]
+
+
+def get_table_candidates(snapshot, ip, path=""):
+    table = get_table(snapshot)
+    if not table:
         return
-    distances, geoip_response = ret
-    return sorted(distances, key=lambda x: x[2])[0]
+    candidates = []
+    for mirrorurl_id, mirror_distance in table.lookup(ip) or []:
+        mirrorurl = snapshot.by_id[mirrorurl_id]
+        if not mirrorurl.has_path(path):
+            continue
+        candidates.append(
+            (mirrorurl, mirror_distance, mirror_distance / mirrorurl.effective_weight)
+        )
+    return candidates
 
 
-def get_mirrorurls():
-    mirrorurls = MirrorURL.objects.filter(
-        enabled=True,
-        protocol="https",
-        check_success=True,
-        mirror__enabled=True,
+def choose_mirror(candidates, key, counter):
+    """Choose among the near-equivalent best candidates for a client key
+
+    Candidates which are over capacity are dropped before the
+    near-equivalent ones are picked, spilling their clients to the next
+    best, unless all of them are.  Callers pass more candidates
+    (ROUTING_CAPACITY_CANDIDATES) than are spread over for this.
+    """
+    candidates = [x for x in candidates if not counter.over_capacity(x[0])] or (
+        candidates
+    )
+    candidates = near_candidates(
+        candidates,
+        settings.ROUTING_SPREAD_CANDIDATES,
+        settings.ROUTING_SPREAD_TOLERANCE_KM,
     )
+    mirrorurl = rendezvous_choice([x[0] for x in candidates], key)
+    for candidate in candidates:
+        if candidate[0] is mirrorurl:
+            return candidate
+    return candidates[0]
+
 
-    fresh_mirrorurls = [x for x in mirrorurls if not x.outdated]
-    return fresh_mirrorurls if fresh_mirrorurls else mirrorurls
+def mirror_list(request, ip, path, list_format):
+    """Return a Metalink or plain list of the best mirrors for a path
 
+    Mirrors are ranked as for redirects, without load spreading, and
+    the body is cached per client network, path and mirror state
+    generation.
+    """
+    snapshot = get_snapshot()
+    cache_key = "finnixmirrors:mirrorlist:{}:{}:{}:{}".format(
+        list_format,
+        snapshot.generation,
+        client_network(ip),
+        hashlib.sha256(path.encode("UTF-8")).hexdigest(),
+    )
+    body = cache.get(cache_key)
+    if body is None:
+        count = settings.ROUTING_MIRRORLIST_MIRRORS
+        ranked = [
+            x[0] for x in get_geoip_candidates(snapshot.ranker, ip, path, count) or []
+        ]
+        # Followed by mirrors without a distance, heaviest first
+        others = sorted(
+            (x for x in snapshot.entries if x not in ranked and x.has_path(path)),
+            key=lambda x: x.effective_weight,
+            reverse=True,
+        )
+        entries = (ranked + others)[:count] or sorted(
+            snapshot.entries, key=lambda x: x.effective_weight, reverse=True
+        )[:count]
+        if list_format == "meta4":
+            body = build_metalink(path, entries, get_data_file(path))
+        else:
+            body = build_mirrorlist(path, entries)
+        cache.set(cache_key, body, settings.ROUTING_MIRRORLIST_CACHE_TTL)
 
-def releases(request, path=""):
+    if list_format == "meta4":
+        response = HttpResponse(body, content_type="application/metalink4+xml")
+        response["Content-Disposition"] = content_disposition_header(
+            True, "{}.meta4".format(path.rsplit("/", 1)[-1])
+        )
+    else:
+        response = HttpResponse(body, content_type="text/plain; charset=utf-8")
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+async def releases(request, path=""):
     ip = ipaddress.ip_address(request.META["REMOTE_ADDR"])
+    for suffix in (".meta4", ".mirrorlist"):
+        if path.endswith(suffix):
+            return await sync_to_async(mirror_list)(
+                request, ip, path[: -len(suffix)], suffix[1:]
+            )
+    if "application/metalink4+xml" in request.headers.get("Accept", ""):
+        return await sync_to_async(mirror_list)(request, ip, path, "meta4")
+
+    return redirect_response(await aget_snapshot(), ip, path)
 
-    mirrorurls = get_mirrorurls()
-    geoip_mirror = get_geoip_mirror(mirrorurls, ip)
+
+def redirect_response(snapshot, ip, path):
+    """Return a redirect to the best mirror for a client and path
+
+    This only uses in-memory state and is safe to call from async code.
+    """
+    # Requests from the same client network (e.g. the range requests of a
+    # resumed download) are routed to the same mirror
+    key = str(client_network(ip))
+
+    counter = get_counter()
+    geoip_mirror = None
+    candidates = get_table_candidates(snapshot, ip, path) or get_geoip_candidates(
+        snapshot.ranker, ip, path
+    )
+    if candidates:
+        geoip_mirror = choose_mirror(candidates, key, counter)
 
     if geoip_mirror:
         mirrorurl = geoip_mirror[0]
     else:
-        mirrorurl = random.choice(mirrorurls)
+        # Mirrors known to carry the path, or all if there are none
+        entries = [x for x in snapshot.entries if x.has_path(path)] or (
+            snapshot.entries
+        )
+        entries = [x for x in entries if not counter.over_capacity(x)] or entries
+        mirrorurl = rendezvous_choice(entries, key) or random.choice(entries)
+    counter.record(mirrorurl)
     url = "{}/{}".format(mirrorurl.url, path)
 
     response = HttpResponseRedirect(url)
     response["X-GeoIP-Ip"] = str(ip)
-    if mirrorurl.mirror.sponsor:
-        response["X-Mirror-Sponsor"] = mirrorurl.mirror.sponsor
-    if mirrorurl.mirror.sponsor_url:
-        response["X-Mirror-Sponsor-Url"] = mirrorurl.mirror.sponsor_url
+    if mirrorurl.sponsor:
+        response["X-Mirror-Sponsor"] = mirrorurl.sponsor
+    if mirrorurl.sponsor_url:
+        response["X-Mirror-Sponsor-Url"] = mirrorurl.sponsor_url
     if geoip_mirror:
         response["X-GeoIP-Influenced"] = "yes"
         response["X-Mirror-Distance-Km"] = str(int(geoip_mirror[1]))
     else:
         response["X-GeoIP-Influenced"] = "no"
+    patch_vary_headers(response, ["Accept"])
     return response
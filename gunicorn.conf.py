@@ -0,0 +1,24 @@
+# Production gunicorn configuration, read from the working directory:
+#
+#   gunicorn finnixmirrors.asgi:application
+#
+# The application is served over ASGI by uvicorn workers (from the
+# uvicorn-worker package), so the async /releases/, mirrors.json and
+# mirrors/events views run on each worker's event loop and redirect
+# throughput scales with concurrent connections rather than threads.
+# Views which query the database still run in a thread.
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = "uvicorn_worker.UvicornWorker"
+# One worker per CPU; each handles many connections
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+# Keep-alive connections from the reverse proxy
+keepalive = 75
+# Restart workers occasionally to bound memory growth
+max_requests = 100000
+max_requests_jitter = 10000
+graceful_timeout = 30
+errorlog = "-"
+capture_output = True
@@ -0,0 +1,88 @@
+import hashlib
+import unittest
+
+from finnixmirrors.byteranges import (
+    boundary_from_content_type,
+    hash_byteranges,
+    parse_content_range,
+)
+
+DATA = bytes(range(256)) * 16
+
+
+def multipart(ranges, boundary="THIS_STRING_SEPARATES", preamble=b""):
+    body = preamble
+    for begin, end in ranges:
+        body += (
+            "--{}\r\nContent-Type: application/octet-stream\r\n"
+            "Content-Range: bytes {}-{}/{}\r\n\r\n".format(
+                boundary, begin, end, len(DATA)
+            ).encode("ascii")
+            + DATA[begin : end + 1]
+            + b"\r\n"
+        )
+    return body + "--{}--".format(boundary).encode("ascii")
+
+
+def chunked(body, size=7):
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+class TestByteranges(unittest.TestCase):
+    ranges = [(0, 99), (1000, 1499), (4000, 4095)]
+
+    def hash_types(self, ranges=None):
+        return {x: "sha256" for x in (ranges or self.ranges)}
+
+    def test_boundary(self):
+        self.assertEqual(
+            boundary_from_content_type('multipart/byteranges; boundary="a b"'), "a b"
+        )
+        self.assertEqual(
+            boundary_from_content_type("Multipart/Byteranges;charset=x;boundary=ab"),
+            "ab",
+        )
+        self.assertIsNone(boundary_from_content_type("application/octet-stream"))
+        self.assertIsNone(boundary_from_content_type("multipart/byteranges"))
+
+    def test_content_range(self):
+        self.assertEqual(parse_content_range("bytes 0-99/4096"), (0, 99, 4096))
+        self.assertEqual(parse_content_range("bytes 0-99/*"), (0, 99, None))
+        for value in (None, "", "bytes 0-99", "items 0-99/4096"):
+            with self.assertRaises(ValueError):
+                parse_content_range(value)
+
+    def test_hash(self):
+        for size in (1, 7, 4096, 100000):
+            out = hash_byteranges(
+                chunked(multipart(self.ranges, preamble=b"\r\n"), size),
+                "THIS_STRING_SEPARATES",
+                self.hash_types(),
+            )
+            self.assertEqual(
+                out,
+                {
+                    (begin, end): (
+                        hashlib.sha256(DATA[begin : end + 1]).hexdigest(),
+                        len(DATA),
+                    )
+                    for begin, end in self.ranges
+                },
+            )
+
+    def test_invalid(self):
+        boundary = "THIS_STRING_SEPARATES"
+        for body, hash_types in (
+            # Merged ranges
+            (multipart([(0, 1499)]), self.hash_types([(0, 99), (1000, 1499)])),
+            # Missing part
+            (multipart(self.ranges[:2]), self.hash_types()),
+            # Repeated part
+            (multipart(self.ranges + self.ranges[:1]), self.hash_types()),
+            # Truncated
+            (multipart(self.ranges)[:-100], self.hash_types()),
+            (b"not multipart\r\n", self.hash_types()),
+            (multipart(self.ranges, boundary="OTHER"), self.hash_types()),
+        ):
+            with self.assertRaises(ValueError):
+                hash_byteranges(chunked(body), boundary, hash_types)
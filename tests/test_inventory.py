@@ -0,0 +1,123 @@
+import os
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.test import SimpleTestCase, override_settings  # noqa: E402
+
+from finnixmirrors.inventory import (  # noqa: E402
+    Inventory,
+    MappedInventory,
+    normalize_path,
+    pack_inventory,
+    parse_index_links,
+    parse_rsync_list,
+)
+from finnixmirrors.management.commands.mirrorcheck import Command  # noqa: E402
+from finnixmirrors.models import Mirror, MirrorURL  # noqa: E402
+
+RSYNC_LIST = """\
+drwxr-xr-x          4,096 2023/06/05 10:00:00 .
+drwxr-xr-x          4,096 2023/06/05 10:00:00 125
+-rw-r--r--    507,510,784 2023/06/05 10:00:00 125/finnix-125.iso
+lrwxrwxrwx              3 2023/06/05 10:00:00 current -> 125
+-rw-r--r--             12 2023/06/05 10:00:00 name with spaces.txt
+receiving incremental file list
+"""
+
+INDEX_HTML = """\
+<html><body>
+<a href="?C=N;O=D">Name</a>
+<a href="../">Parent Directory</a>
+<a href="/finnix/">Absolute</a>
+<a href="https://example.com/">Elsewhere</a>
+<a href="125/">125/</a>
+<a href="finnix%20notes.txt">finnix notes.txt</a>
+<a href="125/">125/ again</a>
+<a href="125/nested.iso">Not a child</a>
+</body></html>
+"""
+
+
+class TestInventory(unittest.TestCase):
+    paths = ["finnix-125.iso", "125", "125/finnix-125.iso", "./a//b/"]
+
+    def test_normalize_path(self):
+        self.assertEqual(normalize_path("/125//./finnix.iso"), "125/finnix.iso")
+        self.assertEqual(normalize_path("/"), "")
+
+    def test_membership(self):
+        packed = pack_inventory(self.paths)
+        self.assertEqual(len(packed), 8 * 4)
+        for inventory in (
+            Inventory(packed),
+            MappedInventory(b"\0" * 8 + packed, 8, len(packed) // 8),
+        ):
+            self.assertEqual(len(inventory), 4)
+            for path in ("finnix-125.iso", "/125/", "125/finnix-125.iso", "a/b", ""):
+                self.assertIn(path, inventory)
+            for path in ("finnix-124.iso", "125/finnix-124.iso", "a", "b"):
+                self.assertNotIn(path, inventory)
+            self.assertEqual(bytes(inventory), packed)
+
+    def test_parse_rsync_list(self):
+        self.assertEqual(
+            list(parse_rsync_list(RSYNC_LIST)),
+            [
+                ("125", True),
+                ("125/finnix-125.iso", False),
+                ("current", False),
+                ("name with spaces.txt", False),
+            ],
+        )
+
+    def test_parse_index_links(self):
+        self.assertEqual(
+            list(parse_index_links(INDEX_HTML)),
+            [("125", True), ("finnix notes.txt", False)],
+        )
+
+
+@override_settings(CHECK_INVENTORY_DEPTH=1, CHECK_INVENTORY_MAX_DIRECTORIES=10)
+class TestMirrorInventory(SimpleTestCase):
+    # Directory listings of a mirror, by path relative to the mirror URL
+    tree = {
+        "": '<a href="125/">125/</a><a href="finnix.iso">finnix.iso</a>',
+        "125/": '<a href="finnix-125.iso">finnix-125.iso</a>',
+        "125/deep/": '<a href="deeper.iso">deeper.iso</a>',
+    }
+
+    def setUp(self):
+        self.command = Command()
+        self.mirrorurl = MirrorURL(
+            mirror=Mirror(slug="mirror"),
+            url="https://mirror.example.com/finnix",
+            protocol="https",
+        )
+        self.command.save_mirrorurl = mock.Mock()
+
+    def request_url(self, url):
+        return mock.Mock(text=self.tree[url[len(self.mirrorurl.url) + 1 :]])
+
+    def test_complete(self):
+        with mock.patch.object(self.command, "request_url", self.request_url):
+            paths, complete = self.command.inventory_http(self.mirrorurl)
+            self.command.inventory_mirrorurl(self.mirrorurl)
+        self.assertTrue(complete)
+        self.assertEqual(sorted(paths), ["125", "125/finnix-125.iso", "finnix.iso"])
+        self.assertIn("125/finnix-125.iso", Inventory(self.mirrorurl.inventory))
+        self.assertIsNotNone(self.mirrorurl.date_last_inventory)
+
+    def test_depth_limit_is_incomplete(self):
+        self.tree = dict(self.tree, **{"125/": '<a href="deep/">deep/</a>'})
+        self.mirrorurl.inventory = pack_inventory(["old"])
+        with mock.patch.object(self.command, "request_url", self.request_url):
+            paths, complete = self.command.inventory_http(self.mirrorurl)
+            self.command.inventory_mirrorurl(self.mirrorurl)
+        self.assertFalse(complete)
+        self.assertIn("125/deep", paths)
+        self.assertIsNone(self.mirrorurl.inventory)
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import SimpleTestCase  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from finnixmirrors.manifest import (  # noqa: E402
+    get_data_file,
+    get_data_files,
+    load_manifest,
+)
+
+
+class TestManifest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmpdir.name) / "root"
+        self.path = os.path.join(self.tmpdir.name, "manifest.json")
+        (self.root / "125").mkdir(parents=True)
+        self.data = bytes(range(256)) * 40
+        (self.root / "125" / "finnix-125.iso").write_bytes(self.data)
+        root_logger = logging.getLogger("")
+        self.addCleanup(root_logger.setLevel, root_logger.level)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def generate(self):
+        call_command(
+            "generate_manifest",
+            str(self.root),
+            output=self.path,
+            ranges=4,
+            chunk_size=512,
+            sweep_chunk_size=4096,
+            jobs=1,
+        )
+
+    def test_generate(self):
+        self.generate()
+        data_file = load_manifest(self.path)["files"][0]
+        self.assertEqual(data_file["path"], "125/finnix-125.iso")
+        self.assertEqual(data_file["length"], len(self.data))
+        self.assertEqual(
+            data_file["hashes"], {"sha256": hashlib.sha256(self.data).hexdigest()}
+        )
+        self.assertEqual(len(data_file["chunks"]["hashes"]), 3)
+        self.assertEqual(len(data_file["ranges"]), 4)
+        for i, r in enumerate(data_file["ranges"]):
+            # One range from each quarter of the file
+            self.assertEqual(r["end"] - r["begin"], 511)
+            self.assertEqual(r["begin"] * 4 // len(self.data), i)
+            self.assertEqual(
+                r["hash"],
+                hashlib.sha256(self.data[r["begin"] : r["end"] + 1]).hexdigest(),
+            )
+
+    def test_data_files(self):
+        self.generate()
+        with override_settings(CHECK_DATA_MANIFEST=self.path):
+            self.assertEqual(get_data_files(), load_manifest(self.path)["files"])
+            self.assertIn("hashes", get_data_file("125/finnix-125.iso"))
+            self.assertIsNone(get_data_file("124/finnix-124.iso"))
+        with override_settings(CHECK_DATA_MANIFEST=None):
+            self.assertIs(get_data_files(), settings.CHECK_DATA_FILES)
+
+    def test_reload(self):
+        self.generate()
+        self.assertIs(load_manifest(self.path), load_manifest(self.path))
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"version": 1, "files": []}, f)
+        os.replace(self.path + ".tmp", self.path)
+        self.assertEqual(load_manifest(self.path)["files"], [])
+
+    def test_invalid_manifest(self):
+        with override_settings(CHECK_DATA_MANIFEST=self.path):
+            with self.assertLogs(level="ERROR"):
+                self.assertIs(get_data_files(), settings.CHECK_DATA_FILES)
+            with open(self.path, "w") as f:
+                f.write("{")
+            with self.assertLogs(level="ERROR"):
+                self.assertIs(get_data_files(), settings.CHECK_DATA_FILES)
+            # Without manifest hashes, a metalink has none
+            self.assertNotIn(
+                "hashes", get_data_file(settings.CHECK_DATA_FILES[0]["path"])
+            )
@@ -0,0 +1,795 @@
+import concurrent.futures
+import datetime
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import django
+import requests
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.core.management import CommandError, call_command  # noqa: E402
+from django.db import OperationalError  # noqa: E402
+from django.db.models import QuerySet  # noqa: E402
+from django.test import SimpleTestCase  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from django.utils import timezone  # noqa: E402
+
+from finnixmirrors.management.commands.mirrorcheck import (  # noqa: E402
+    CheckError,
+    Command,
+)
+from finnixmirrors.models import Mirror, MirrorURL, MirrorURLChange  # noqa: E402
+
+TRACE = "Mon Jun  5 10:00:00 UTC 2023"
+DATA = bytes(range(256)) * 64
+
+_state = {}
+
+
+def setUpModule():
+    _state["tmpdir"] = tempfile.TemporaryDirectory()
+    _state["settings"] = override_settings(
+        MIRROR_STATE_GENERATION_FILE=os.path.join(
+            _state["tmpdir"].name, "mirror-state.generation"
+        ),
+        ROUTING_SNAPSHOT_FILE=os.path.join(
+            _state["tmpdir"].name, "routing-snapshot.bin"
+        ),
+        CHECK_TRACE_FILE="trace",
+        CHECK_DATA_FILES=[],
+        CHECK_DATA_MANIFEST=None,
+        CHECK_MEASURE_BYTES=0,
+    )
+    _state["settings"].enable()
+    setup_test_environment()
+    _state["databases"] = setup_databases(verbosity=0, interactive=False)
+
+
+def tearDownModule():
+    teardown_databases(_state["databases"], verbosity=0)
+    teardown_test_environment()
+    _state["settings"].disable()
+    _state["tmpdir"].cleanup()
+
+
+class Response:
+    def __init__(self, text="", status_code=200, headers=None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@override_settings(
+    CHECK_INTERVAL=3600,
+    CHECK_INTERVAL_GROWTH=1.5,
+    CHECK_INTERVAL_MAX=6 * 3600,
+    CHECK_INTERVAL_FAILURE=600,
+    CHECK_INTERVAL_RECOVERING=300,
+    CHECK_JITTER=0,
+    OUTDATED_HOURS=28,
+)
+class TestSchedule(SimpleTestCase):
+    def setUp(self):
+        self.command = Command()
+        self.now = timezone.now()
+        self.mirrorurl = MirrorURL(
+            url="https://mirror.example.com/finnix",
+            date_last_trace=self.now - timezone.timedelta(hours=1),
+        )
+        self.command.track_mirrorurls([self.mirrorurl])
+
+    def schedule(self, check_success=True):
+        self.mirrorurl.check_success = check_success
+        with mock.patch("django.utils.timezone.now", return_value=self.now):
+            self.command.schedule_mirrorurl(self.mirrorurl)
+        return (self.mirrorurl.next_check_at - self.now).total_seconds()
+
+    def test_growth(self):
+        self.assertEqual(
+            [self.schedule() for _ in range(7)],
+            [3600, 5400, 8100, 12150, 18225, 21600, 21600],
+        )
+        self.assertEqual(self.mirrorurl.check_successes, 7)
+
+    def test_backoff_and_recovery(self):
+        self.assertEqual(
+            [self.schedule(False) for _ in range(4)], [600, 1200, 2400, 4800]
+        )
+        self.assertEqual(self.mirrorurl.check_failures, 4)
+        self.assertEqual(self.schedule(), 300)
+        self.assertEqual(
+            (self.mirrorurl.check_failures, self.mirrorurl.check_successes), (0, 1)
+        )
+        # A URL stored as failing is also confirmed quickly
+        self.command._original[self.mirrorurl.pk]["check_success"] = False
+        self.assertEqual(self.schedule(), 300)
+
+    def test_outdated_cap(self):
+        self.mirrorurl.check_successes = 5
+        self.mirrorurl.date_last_trace = self.now - timezone.timedelta(hours=27)
+        self.assertEqual(self.schedule(), 3600)
+        # Never sooner than a recovering URL
+        self.mirrorurl.date_last_trace = self.now - timezone.timedelta(hours=27.99)
+        self.assertEqual(self.schedule(), 300)
+
+    def test_already_outdated(self):
+        self.mirrorurl.check_successes = 5
+        self.mirrorurl.date_last_trace = self.now - timezone.timedelta(hours=30)
+        self.assertEqual([self.schedule() for _ in range(3)], [3600] * 3)
+        self.assertEqual(self.mirrorurl.check_successes, 1)
+
+    def test_trace_backwards(self):
+        self.mirrorurl.check_successes = 5
+        self.mirrorurl.date_last_trace -= timezone.timedelta(minutes=1)
+        self.assertEqual(self.schedule(), 3600)
+
+    @override_settings(CHECK_JITTER=0.1)
+    def test_jitter(self):
+        intervals = []
+        for _ in range(200):
+            self.mirrorurl.check_successes = 0
+            intervals.append(self.schedule())
+        self.assertTrue(3240 <= min(intervals) < max(intervals) <= 3960, intervals)
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.command = Command()
+        self.mirrorurl = MirrorURL(url="https://mirror.example.com/finnix")
+        self.requests = []
+        self.response = Response(
+            TRACE, headers={"etag": '"abc"', "last-modified": "Mon, 05 Jun 2023"}
+        )
+
+    def request_url(self, url, method="GET", headers=None):
+        self.requests.append((url, headers))
+        return self.response
+
+    def check_trace(self):
+        with mock.patch.object(self.command, "request_url", self.request_url):
+            self.command.check_trace_http(self.mirrorurl)
+        return self.requests[-1][1]
+
+    def test_validators(self):
+        # Validators alone, without a stored trace, are not sent
+        self.mirrorurl.trace_etag = '"old"'
+        self.assertEqual(self.check_trace(), {})
+        self.assertEqual(self.requests[0][0], "https://mirror.example.com/finnix/trace")
+        self.assertEqual(self.mirrorurl.date_last_trace.year, 2023)
+        self.assertEqual(self.mirrorurl.trace_etag, '"abc"')
+        self.assertEqual(
+            self.check_trace(),
+            {"If-None-Match": '"abc"', "If-Modified-Since": "Mon, 05 Jun 2023"},
+        )
+
+    def test_not_modified(self):
+        self.check_trace()
+        date_last_trace = self.mirrorurl.date_last_trace
+        self.response = Response(status_code=304)
+        self.check_trace()
+        self.assertEqual(self.mirrorurl.date_last_trace, date_last_trace)
+        self.assertEqual(self.mirrorurl.trace_etag, '"abc"')
+        self.assertEqual(self.mirrorurl.trace_last_modified, "Mon, 05 Jun 2023")
+
+
+class TestRunChecks(unittest.TestCase):
+    def setUp(self):
+        self.command = Command()
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.checked = []
+
+    def make_mirrorurls(self, hosts, per_host):
+        return [
+            MirrorURL(url="https://{}.example.com/{}".format(host, i))
+            for host in hosts
+            for i in range(per_host)
+        ]
+
+    def check(self, mirrorurl, duration=0.02):
+        host = self.command.hostname(mirrorurl)
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.max_running[host] = max(
+                self.max_running.get(host, 0), self.running[host]
+            )
+        time.sleep(duration)
+        with self.lock:
+            self.running[host] -= 1
+            self.checked.append(mirrorurl)
+
+    def test_serial_and_concurrent(self):
+        mirrorurls = self.make_mirrorurls(["a", "b", "c"], 3)
+        self.assertEqual(
+            self.command.run_checks(mirrorurls, jobs=1, check=self.check), []
+        )
+        self.assertEqual(self.checked, mirrorurls)
+        self.checked = []
+        self.assertEqual(
+            self.command.run_checks(mirrorurls, jobs=4, check=self.check), []
+        )
+        self.assertCountEqual(self.checked, mirrorurls)
+
+    def test_per_host(self):
+        mirrorurls = self.make_mirrorurls(["a", "b"], 4)
+        self.command.run_checks(mirrorurls, jobs=4, per_host=1, check=self.check)
+        self.assertEqual(self.max_running, {"a.example.com": 1, "b.example.com": 1})
+        self.max_running = {}
+        self.command.run_checks(mirrorurls, jobs=8, per_host=2, check=self.check)
+        self.assertLessEqual(max(self.max_running.values()), 2)
+
+    def test_interleave_hosts(self):
+        mirrorurls = self.make_mirrorurls(["a"], 3) + self.make_mirrorurls(["b"], 1)
+        submit = concurrent.futures.ThreadPoolExecutor.submit
+        with mock.patch.object(
+            concurrent.futures.ThreadPoolExecutor,
+            "submit",
+            autospec=True,
+            side_effect=submit,
+        ) as executor_submit:
+            self.command.run_checks(mirrorurls, jobs=2, check=self.check)
+        self.assertEqual(
+            [x.args[2] for x in executor_submit.call_args_list],
+            [mirrorurls[0], mirrorurls[3], mirrorurls[1], mirrorurls[2]],
+        )
+
+    def test_deadline(self):
+        mirrorurls = self.make_mirrorurls(["a"], 3)
+        for jobs in (1, 3):
+            self.checked = []
+            skipped = self.command.run_checks(
+                mirrorurls,
+                jobs=jobs,
+                deadline=time.monotonic() + 0.05,
+                check=lambda x: self.check(x, duration=0.1),
+            )
+            self.assertEqual(self.checked, mirrorurls[:1])
+            self.assertCountEqual(skipped, mirrorurls[1:])
+        skipped = self.command.run_checks(
+            mirrorurls, deadline=time.monotonic(), check=self.check
+        )
+        self.assertEqual(skipped, mirrorurls)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, body=b""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = body
+        self.text = body.decode("latin-1")
+        self.elapsed = datetime.timedelta(seconds=0.01)
+        self.body_read = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+    def iter_content(self, chunk_size=1):
+        self.body_read = True
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeServer:
+    """requests.Session stand-in serving DATA, with or without multi-range"""
+
+    boundary = "SEPARATOR"
+
+    def __init__(self, multirange=True, etag='"v1"', length=None):
+        self.multirange = multirange
+        self.etag = etag
+        self.length = length or len(DATA)
+        self.requests = []
+        self.responses = []
+
+    def request(self, method, url, headers=None, timeout=None):
+        return self.respond(method, headers or {})
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        return self.respond("GET", headers or {})
+
+    def respond(self, method, headers):
+        self.requests.append((method, headers))
+        response = self.make_response(method, headers)
+        self.responses.append(response)
+        return response
+
+    def make_response(self, method, headers):
+        base = {"etag": self.etag}
+        if self.etag and headers.get("If-None-Match") == self.etag:
+            return FakeResponse(304, base)
+        if method == "HEAD":
+            return FakeResponse(200, dict(base, **{"content-length": str(len(DATA))}))
+        if "Range" not in headers:
+            return FakeResponse(200, base, DATA)
+        spans = [
+            tuple(int(x) for x in span.split("-"))
+            for span in headers["Range"][len("bytes=") :].split(",")
+        ]
+        if len(spans) == 1:
+            begin, end = spans[0]
+            return FakeResponse(
+                206,
+                dict(
+                    base,
+                    **{
+                        "content-range": "bytes {}-{}/{}".format(
+                            begin, end, self.length
+                        )
+                    },
+                ),
+                DATA[begin : end + 1],
+            )
+        if not self.multirange:
+            return FakeResponse(200, base, DATA)
+        body = b""
+        for begin, end in spans:
+            body += (
+                "--{}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n".format(
+                    self.boundary, begin, end, self.length
+                ).encode("ascii")
+                + DATA[begin : end + 1]
+                + b"\r\n"
+            )
+        body += "--{}--".format(self.boundary).encode("ascii")
+        return FakeResponse(
+            206,
+            dict(
+                base,
+                **{
+                    "content-type": "multipart/byteranges; boundary={}".format(
+                        self.boundary
+                    )
+                },
+            ),
+            body,
+        )
+
+
+def data_file(ranges=((0, 99), (1000, 1099), (8000, 8191))):
+    return {
+        "path": "125/finnix-125.iso",
+        "length": len(DATA),
+        "ranges": [
+            {
+                "begin": begin,
+                "end": end,
+                "hash": hashlib.sha256(DATA[begin : end + 1]).hexdigest(),
+                "hash_type": "sha256",
+            }
+            for begin, end in ranges
+        ],
+    }
+
+
+@override_settings(CHECK_DATA_FILE_RANGE_COUNT=3, CHECK_DATA_FILE_REVERIFY_RUNS=3)
+class TestDataFile(SimpleTestCase):
+    def setUp(self):
+        self.command = Command()
+        self.mirrorurl = MirrorURL(
+            mirror=Mirror(slug="mirror"),
+            url="https://mirror.example.com/finnix",
+            head_allowed=True,
+            range_allowed=True,
+        )
+        self.data_file = data_file()
+
+    def check(self, server, stored=None):
+        self.command._local.rs = server
+        server.requests = []
+        return self.command.check_data_file_http(
+            self.mirrorurl, self.data_file, stored or {}
+        )
+
+    def methods(self, server):
+        return [
+            (method, "Range" in headers and headers["Range"].count(",") + 1)
+            for method, headers in server.requests
+        ]
+
+    def test_multirange(self):
+        server = FakeServer()
+        # Capability unknown: HEAD, then one multi-range request
+        validators = self.check(server)
+        self.assertEqual(validators, {"etag": '"v1"', "last_modified": None, "runs": 0})
+        self.assertEqual(self.methods(server), [("HEAD", False), ("GET", 3)])
+        self.assertTrue(self.mirrorurl.multirange_allowed)
+        # Known: a single conditional request, which is not modified
+        validators = self.check(server, validators)
+        self.assertEqual(self.methods(server), [("GET", 3)])
+        self.assertEqual(server.requests[0][1]["If-None-Match"], '"v1"')
+        self.assertEqual(validators["runs"], 1)
+        # Changed file: verified again
+        server.etag = '"v2"'
+        validators = self.check(server, validators)
+        self.assertEqual(validators, {"etag": '"v2"', "last_modified": None, "runs": 0})
+
+    def test_ranges_ignored(self):
+        server = FakeServer(multirange=False)
+        validators = self.check(server)
+        self.assertEqual(
+            self.methods(server),
+            [("HEAD", False), ("GET", 3), ("GET", 1), ("GET", 1), ("GET", 1)],
+        )
+        # The whole file was not downloaded
+        self.assertFalse(server.responses[1].body_read)
+        self.assertIs(self.mirrorurl.multirange_allowed, False)
+        self.assertEqual(validators["etag"], '"v1"')
+        # Not tried again
+        server.etag = '"v2"'
+        self.check(server, validators)
+        self.assertEqual(
+            self.methods(server), [("HEAD", False), ("GET", 1), ("GET", 1), ("GET", 1)]
+        )
+
+    def test_length(self):
+        self.mirrorurl.multirange_allowed = True
+        with self.assertRaisesRegex(CheckError, "length: Expected 16384, got 16385"):
+            self.check(FakeServer(length=len(DATA) + 1))
+
+    def test_bad_range(self):
+        self.data_file["ranges"][1]["hash"] = "0" * 64
+        for multirange_allowed in (True, False):
+            self.mirrorurl.multirange_allowed = multirange_allowed
+            with self.assertRaisesRegex(CheckError, "range 1000-1099"):
+                self.check(FakeServer())
+
+    def test_stored_validators(self):
+        self.mirrorurl.multirange_allowed = False
+        server = FakeServer()
+        validators = self.check(server)
+        # HEAD shows the file unchanged; ranges are not fetched
+        validators = self.check(server, validators)
+        self.assertEqual(self.methods(server), [("HEAD", False)])
+        self.assertEqual(validators["runs"], 1)
+        validators = self.check(server, validators)
+        self.assertEqual(validators["runs"], 2)
+        # Every CHECK_DATA_FILE_REVERIFY_RUNS, the ranges are verified anyway
+        validators = self.check(server, validators)
+        self.assertEqual(len(server.requests), 4)
+        self.assertEqual(validators["runs"], 0)
+
+    def test_reverify_multirange(self):
+        self.mirrorurl.multirange_allowed = True
+        server = FakeServer()
+        validators = self.check(server, {"etag": '"v1"', "runs": 2})
+        self.assertNotIn("If-None-Match", server.requests[0][1])
+        self.assertEqual(validators["runs"], 0)
+
+
+class InterruptedServer(FakeServer):
+    """FakeServer whose responses break after a number of bytes"""
+
+    def __init__(self, interrupt_after, **kwargs):
+        super().__init__(**kwargs)
+        self.interrupt_after = interrupt_after
+
+    def make_response(self, method, headers):
+        response = super().make_response(method, headers)
+        iter_content = response.iter_content
+
+        def interrupted(chunk_size=1):
+            received = 0
+            for data in iter_content(chunk_size=256):
+                received += len(data)
+                if received > self.interrupt_after:
+                    raise requests.ConnectionError("Connection reset")
+                yield data
+
+        response.iter_content = interrupted
+        return response
+
+
+def sweep_data_file(path="125/finnix-125.iso", chunk_size=1024):
+    return dict(
+        data_file(),
+        path=path,
+        hashes={"sha256": hashlib.sha256(DATA).hexdigest()},
+        chunks={
+            "size": chunk_size,
+            "hash_type": "sha256",
+            "hashes": [
+                hashlib.sha256(DATA[i : i + chunk_size]).hexdigest()
+                for i in range(0, len(DATA), chunk_size)
+            ],
+        },
+    )
+
+
+@override_settings(CHECK_SWEEP_BYTES_PER_RUN=4096, CHECK_SWEEP_RATE=0)
+class TestSweep(SimpleTestCase):
+    def setUp(self):
+        self.command = Command()
+        self.command.save_mirrorurl = mock.Mock()
+        self.mirrorurl = MirrorURL(
+            mirror=Mirror(slug="mirror"), url="https://mirror.example.com/finnix"
+        )
+        self.data_files = [sweep_data_file(), sweep_data_file("124/finnix-124.iso")]
+
+    def sweep(self, server=None):
+        self.command._local.rs = server or FakeServer()
+        with override_settings(CHECK_DATA_FILES=self.data_files):
+            self.command.sweep_mirrorurl(self.mirrorurl)
+        return self.command._local.rs
+
+    def test_resume(self):
+        for offset in (4096, 8192, 12288):
+            server = self.sweep()
+            self.assertEqual(
+                server.requests[0][1]["Range"],
+                "bytes={}-{}".format(offset - 4096, offset - 1),
+            )
+            self.assertEqual(self.mirrorurl.sweep_state["offset"], offset)
+            self.assertEqual(self.mirrorurl.sweep_state["path"], "125/finnix-125.iso")
+            self.assertIsNone(self.mirrorurl.date_last_sweep)
+        self.sweep()
+        self.assertEqual(
+            self.mirrorurl.sweep_state, {"last_path": "125/finnix-125.iso"}
+        )
+        self.assertIsNotNone(self.mirrorurl.date_last_sweep)
+        # The next file in the manifest follows
+        self.sweep()
+        self.assertEqual(self.mirrorurl.sweep_state["path"], "124/finnix-124.iso")
+        self.assertEqual(self.command.save_mirrorurl.call_count, 5)
+
+    def test_interrupted(self):
+        # Resumes from the last verified chunk
+        self.sweep(InterruptedServer(2500))
+        self.assertEqual(self.mirrorurl.sweep_state["offset"], 2048)
+        server = self.sweep()
+        self.assertEqual(server.requests[0][1]["Range"], "bytes=2048-6143")
+
+    def test_manifest_changed(self):
+        self.sweep()
+        self.data_files[0] = dict(self.data_files[0], hashes={"sha256": "changed"})
+        self.sweep()
+        self.assertEqual(self.mirrorurl.sweep_state["offset"], 4096)
+
+    def test_mismatch(self):
+        self.sweep()
+        self.data_files[0]["chunks"]["hashes"][5] = "0" * 64
+        self.sweep()
+        self.assertFalse(self.mirrorurl.check_success)
+        self.assertIn("sweep bytes 5120-6143", self.mirrorurl.check_detail)
+        self.assertEqual(self.mirrorurl.sweep_state["offset"], 0)
+
+    def test_bytes_per_run(self):
+        # Rounded down to whole chunks, but at least one
+        for limit, offset in ((3000, 2048), (100, 1024)):
+            self.mirrorurl.sweep_state = {}
+            with override_settings(CHECK_SWEEP_BYTES_PER_RUN=limit):
+                self.sweep()
+            self.assertEqual(self.mirrorurl.sweep_state["offset"], offset)
+
+    @override_settings(CHECK_SWEEP_RATE=8192)
+    def test_rate(self):
+        with mock.patch("time.sleep") as sleep:
+            self.sweep()
+        self.assertAlmostEqual(sum(x.args[0] for x in sleep.call_args_list), 0.5, 1)
+
+
+@override_settings(CHECK_MEASURE_BYTES=4096, CHECK_MEASURE_EWMA_ALPHA=0.25)
+class TestMeasure(SimpleTestCase):
+    def setUp(self):
+        self.command = Command()
+        self.command.save_mirrorurl = mock.Mock()
+        self.mirrorurl = MirrorURL(
+            mirror=Mirror(slug="mirror"),
+            url="https://mirror.example.com:8443/finnix",
+            protocol="https",
+            range_allowed=True,
+        )
+
+    def measure(self, server=None):
+        self.command._local.rs = server or FakeServer()
+        with override_settings(CHECK_DATA_FILES=[data_file()]), mock.patch(
+            "socket.create_connection"
+        ) as create_connection:
+            self.command.measure_mirrorurl_http(self.mirrorurl)
+        return create_connection
+
+    def test_ewma(self):
+        self.assertEqual(self.command.ewma(None, 8.0), 8.0)
+        self.assertEqual(self.command.ewma(8.0, 4.0), 7.0)
+
+    def test_measure(self):
+        create_connection = self.measure()
+        self.assertEqual(
+            create_connection.call_args.args[0], ("mirror.example.com", 8443)
+        )
+        self.assertEqual(self.mirrorurl.ewma_ttfb, 0.01)
+        self.assertIsNotNone(self.mirrorurl.ewma_connect_time)
+        throughput = self.mirrorurl.ewma_throughput
+        self.assertGreater(throughput, 0)
+        # Later measurements are folded into the averages
+        self.mirrorurl.ewma_ttfb = 0.05
+        self.measure()
+        self.assertAlmostEqual(self.mirrorurl.ewma_ttfb, 0.04)
+        range_header = self.command._local.rs.requests[0][1]["Range"]
+        begin, end = (int(x) for x in range_header[len("bytes=") :].split("-"))
+        self.assertEqual(end - begin + 1, 4096)
+
+    def test_failed(self):
+        server = FakeServer()
+        server.make_response = lambda method, headers: FakeResponse(200, body=DATA)
+        with self.assertLogs(level="WARNING"):
+            self.measure(server)
+        self.assertIsNone(self.mirrorurl.ewma_ttfb)
+        self.assertFalse(server.responses[0].body_read)
+
+    def test_https_only(self):
+        with override_settings(CHECK_DATA_FILES=[]), mock.patch.object(
+            self.command, "measure_mirrorurl_http"
+        ) as measure, mock.patch.object(
+            self.command, "request_url", return_value=Response(TRACE)
+        ):
+            self.command.check_mirrorurl_http(self.mirrorurl)
+            self.assertEqual(measure.call_count, 1)
+            self.mirrorurl.protocol = "http"
+            self.command.check_mirrorurl_http(self.mirrorurl)
+            self.assertEqual(measure.call_count, 1)
+
+
+class TestCheckPass(unittest.TestCase):
+    options = {"jobs": 1, "per_host": 1, "deadline": None}
+
+    def setUp(self):
+        Mirror.objects.all().delete()
+        MirrorURLChange.objects.all().delete()
+        self.command = Command()
+        for i in range(3):
+            mirror = Mirror.objects.create(slug="mirror{}".format(i))
+            MirrorURL.objects.create(
+                mirror=mirror,
+                url="https://mirror{}.example.com/finnix".format(i),
+                protocol="https",
+            )
+
+    def request_url(self, url, method="GET", headers=None):
+        return Response(TRACE)
+
+    def check_pass(self, **options):
+        with mock.patch.object(self.command, "request_url", self.request_url):
+            self.command.check_pass(
+                list(MirrorURL.objects.select_related("mirror").order_by("url")),
+                dict(self.options, **options),
+            )
+
+    def assertChecked(self):
+        for mirrorurl in MirrorURL.objects.all():
+            self.assertTrue(mirrorurl.check_success, mirrorurl)
+            self.assertEqual(mirrorurl.check_detail, "Check OK")
+            self.assertIsNotNone(mirrorurl.date_last_check)
+            self.assertIsNotNone(mirrorurl.next_check_at)
+            self.assertEqual(mirrorurl.date_last_trace.year, 2023)
+
+    @override_settings(CHECK_WRITE_BATCH_SIZE=2)
+    def test_batches(self):
+        with mock.patch.object(
+            QuerySet, "bulk_update", autospec=True, side_effect=QuerySet.bulk_update
+        ) as bulk_update:
+            self.check_pass()
+        self.assertEqual(bulk_update.call_count, 2)
+        self.assertEqual(self.command.rows_written, 3)
+        self.assertChecked()
+
+    def test_concurrent(self):
+        self.check_pass(jobs=3)
+        self.assertEqual(self.command.rows_written, 3)
+        self.assertChecked()
+
+    def test_summary(self):
+        with self.assertLogs(level="INFO") as logs:
+            self.check_pass()
+        self.assertIn("3 rows written (0 only rescheduled)", logs.output[-1])
+        with self.assertLogs(level="INFO") as logs:
+            self.check_pass()
+        # Only the check dates and next check time changed; the trace is
+        # outdated, so check_successes stays at 1
+        self.assertIn(
+            "3 rows written (3 only rescheduled), 9 columns, 0 rows unchanged",
+            logs.output[-1],
+        )
+        self.assertFalse(MirrorURLChange.objects.filter(event="changed"))
+
+        mirrorurls = list(MirrorURL.objects.all())
+        self.command.track_mirrorurls(mirrorurls)
+        self.command.write_batch(mirrorurls)
+        self.assertEqual(self.command.rows_skipped, 3)
+
+    @override_settings(CHECK_WRITE_BATCH_SIZE=2)
+    def test_write_failure(self):
+        calls = []
+
+        def bulk_update(queryset, objs, fields, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return original(queryset, objs, fields, **kwargs)
+
+        original = QuerySet.bulk_update
+        with mock.patch.object(QuerySet, "bulk_update", bulk_update):
+            with self.assertLogs(level="ERROR") as logs:
+                self.check_pass()
+        self.assertIn("database is locked", logs.output[0])
+        # The failed batch is written with the final one
+        self.assertEqual(calls, [2, 3])
+        self.assertEqual(self.command.rows_written, 3)
+        self.assertEqual(self.command._pending, [])
+        self.assertChecked()
+
+    def test_write_failure_retried_next_pass(self):
+        with mock.patch.object(
+            QuerySet, "bulk_update", side_effect=OperationalError("database is locked")
+        ):
+            with self.assertLogs(level="ERROR"):
+                self.check_pass()
+        self.assertEqual(self.command.rows_written, 0)
+        self.assertEqual(len(self.command._pending), 3)
+        self.assertFalse(MirrorURL.objects.filter(date_last_check__isnull=False))
+        with mock.patch.object(self.command, "request_url", self.request_url):
+            self.command.check_pass([], self.options)
+        self.assertEqual(self.command.rows_written, 3)
+        self.assertChecked()
+
+
+class Stop(Exception):
+    pass
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        Mirror.objects.all().delete()
+        mirror = Mirror.objects.create(slug="mirror")
+        MirrorURL.objects.create(
+            mirror=mirror, url="https://mirror.example.com/finnix", protocol="https"
+        )
+        root_logger = logging.getLogger("")
+        self.addCleanup(root_logger.setLevel, root_logger.level)
+
+    def test_modes(self):
+        for option in ("sweep", "inventory"):
+            with self.assertRaises(CommandError):
+                call_command("mirrorcheck", daemon=True, **{option: True})
+
+    @override_settings(CHECK_DAEMON_POLL=60)
+    def test_failed_pass(self):
+        passes = []
+
+        def check_pass(command, mirrorurls, options, check=None):
+            passes.append(mirrorurls)
+            if len(passes) == 1:
+                raise OperationalError("database is locked")
+
+        with mock.patch.object(Command, "check_pass", check_pass), mock.patch(
+            "time.sleep", side_effect=[None, Stop]
+        ) as sleep, self.assertLogs(level="ERROR") as logs:
+            with self.assertRaises(Stop):
+                call_command("mirrorcheck", daemon=True)
+        self.assertIn("database is locked", "\n".join(logs.output))
+        # The pass is retried after CHECK_DAEMON_POLL seconds
+        self.assertEqual(len(passes), 2)
+        self.assertEqual(len(passes[1]), 1)
+        self.assertEqual(sleep.call_args_list[0].args, (60,))
@@ -0,0 +1,91 @@
+import ipaddress
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.test.utils import override_settings  # noqa: E402
+
+from finnixmirrors.prefixtable import (  # noqa: E402
+    PrefixTable,
+    PrefixTableLoader,
+    geoip_db_key,
+    write_table,
+)
+
+
+def addr(ip):
+    return int(ipaddress.ip_address(ip))
+
+
+class Snapshot:
+    def __init__(self, routing_key):
+        self.routing_key = routing_key
+
+
+class TestPrefixTable(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "routing-table.bin")
+        self.geoip_path = os.path.join(self.tmpdir.name, "GeoLite2-City.mmdb")
+        with open(self.geoip_path, "wb"):
+            pass
+        self.write()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, routing_key="key"):
+        write_table(
+            self.path,
+            {
+                "mirrorurls": ["a", "b", "c"],
+                "geoip_db": geoip_db_key(self.geoip_path),
+                "routing_key": routing_key,
+            },
+            [
+                (addr("10.0.0.0"), addr("10.0.0.255"), [(0, 10), (1, 20)]),
+                (addr("10.0.2.0"), addr("10.0.3.255"), [(2, 70000)]),
+            ],
+            [(addr("2001:db8::"), addr("2001:db8::ffff"), [(1, 5), (0, 15)])],
+            2,
+        )
+
+    def test_lookup(self):
+        table = PrefixTable(self.path)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.lookup("10.0.0.0"), [("a", 10), ("b", 20)])
+        self.assertEqual(table.lookup("10.0.0.255"), [("a", 10), ("b", 20)])
+        self.assertEqual(table.lookup("::ffff:10.0.0.7"), [("a", 10), ("b", 20)])
+        # Distances are capped, unused candidate slots skipped
+        self.assertEqual(table.lookup("10.0.3.1"), [("c", 0xFFFE)])
+        self.assertEqual(table.lookup("2001:db8::1"), [("b", 5), ("a", 15)])
+        for ip in ("9.255.255.255", "10.0.1.0", "10.0.4.0", "2001:db8::1:0", "::1"):
+            self.assertIsNone(table.lookup(ip), ip)
+        table.close()
+
+    def test_loader(self):
+        loader = PrefixTableLoader(self.path, check_interval=0)
+        with override_settings(GEOIP2_DB=self.geoip_path):
+            self.assertIsNotNone(loader.get(Snapshot("key")))
+            self.assertIsNone(loader.get(Snapshot("other")))
+            self.write(routing_key="other")
+            self.assertIsNotNone(loader.get(Snapshot("other")))
+            os.unlink(self.geoip_path)
+            self.assertIsNone(loader.get(Snapshot("other")))
+
+    def test_loader_error(self):
+        loader = PrefixTableLoader(self.path, check_interval=0)
+        with override_settings(GEOIP2_DB=self.geoip_path):
+            self.assertIsNotNone(loader.get(Snapshot("key")))
+            with mock.patch(
+                "finnixmirrors.prefixtable.geoip_db_key", side_effect=PermissionError
+            ):
+                self.assertIsNone(loader.get(Snapshot("key")))
+            # The table is reopened once the error clears
+            self.assertIsNotNone(loader.get(Snapshot("key")))
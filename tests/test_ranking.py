@@ -0,0 +1,143 @@
+import os
+import unittest
+import uuid
+from unittest import mock
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.test.utils import override_settings  # noqa: E402
+
+from finnixmirrors import ranking  # noqa: E402
+from finnixmirrors.ranking import (  # noqa: E402
+    MirrorRanker,
+    measured_weight,
+    near_candidates,
+    rendezvous_choice,
+)
+
+
+class Entry:
+    def __init__(self, name, latitude, longitude, weight=1.0):
+        self.id = uuid.uuid5(uuid.NAMESPACE_DNS, name)
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.effective_weight = weight
+
+    def __repr__(self):
+        return self.name
+
+
+class TestRanking(unittest.TestCase):
+    def setUp(self):
+        self.entries = [
+            Entry("london", 51.5074, -0.1278),
+            Entry("paris", 48.8566, 2.3522, weight=2.0),
+            Entry("berlin", 52.52, 13.405),
+            Entry("portland", 45.5152, -122.6784),
+            Entry("unlocated", None, None),
+            Entry("unweighted", 40.0, -74.0, weight=0),
+        ]
+
+    def rank(self, *args, **kwargs):
+        return [
+            (x[0].name, round(x[1]), round(x[2]))
+            for x in MirrorRanker(self.entries).rank(*args, **kwargs)
+        ]
+
+    def test_distances(self):
+        ranker = MirrorRanker(self.entries)
+        self.assertEqual(len(ranker), 4)
+        # London to Paris: 343.5 km great-circle, 343.9 km geodesic
+        self.assertAlmostEqual(ranker.distances(51.5074, -0.1278)[1], 343.5, 0)
+        self.assertAlmostEqual(ranker.distances(51.5074, -0.1278)[0], 0, 6)
+
+    def test_rank(self):
+        # From London, Paris wins on weighted distance
+        ranked = self.rank(51.5074, -0.1278)
+        self.assertEqual(
+            [x[0] for x in ranked], ["london", "paris", "berlin", "portland"]
+        )
+        ranked = self.rank(50.0, 0.0)
+        self.assertEqual([x[0] for x in ranked[:2]], ["paris", "london"])
+        self.assertEqual(ranked[0][2] * 2, ranked[0][1])
+        self.assertEqual(self.rank(50.0, 0.0, limit=2), ranked[:2])
+        self.assertEqual(self.rank(50.0, 0.0, limit=10), ranked)
+        self.assertEqual(MirrorRanker([]).rank(50.0, 0.0), [])
+
+    def test_rank_without_numpy(self):
+        ranked = self.rank(50.0, 0.0)
+        with mock.patch.object(ranking, "numpy", ImportError()):
+            self.assertEqual(self.rank(50.0, 0.0), ranked)
+            self.assertEqual(self.rank(50.0, 0.0, limit=2), ranked[:2])
+
+    @override_settings(
+        ROUTING_REFERENCE_THROUGHPUT=100,
+        ROUTING_THROUGHPUT_EXPONENT=1,
+        ROUTING_REFERENCE_TTFB=1,
+        ROUTING_TTFB_EXPONENT=1,
+        ROUTING_MEASURED_FACTOR_RANGE=(0.25, 2.0),
+    )
+    def test_measured_weight(self):
+        def weight(throughput, ttfb, weight=10):
+            return measured_weight(
+                mock.Mock(weight=weight, ewma_throughput=throughput, ewma_ttfb=ttfb)
+            )
+
+        self.assertEqual(weight(None, None), 10)
+        self.assertEqual(weight(150, None), 15)
+        self.assertEqual(weight(150, 2), 7.5)
+        # Factors are clamped
+        self.assertEqual(weight(1000, 0.01), 40)
+        self.assertEqual(weight(1, 100), 0.62)
+        # Two significant figures
+        self.assertEqual(weight(123, None), 12)
+        self.assertEqual(weight(None, None, weight=0), 0)
+
+
+class TestSpread(unittest.TestCase):
+    def setUp(self):
+        self.entries = [
+            Entry("a", 0, 0, weight=1.0),
+            Entry("b", 0, 0, weight=2.0),
+            Entry("c", 0, 0, weight=1.0),
+        ]
+        self.keys = ["10.0.{}.0/24".format(i) for i in range(3000)]
+
+    def test_near_candidates(self):
+        ranked = [("a", 100, 100), ("b", 150, 150), ("c", 200, 350), ("d", 1, 400)]
+        self.assertEqual(near_candidates(ranked, 3, 200), ranked[:2])
+        self.assertEqual(near_candidates(ranked, 1, 1000), ranked[:1])
+        self.assertEqual(near_candidates(ranked, 4, 300), ranked)
+        self.assertEqual(near_candidates([], 3, 200), [])
+
+    def test_rendezvous_consistent(self):
+        for key in self.keys[:10]:
+            self.assertIs(
+                rendezvous_choice(self.entries, key),
+                rendezvous_choice(list(reversed(self.entries)), key),
+            )
+
+    def test_rendezvous_weights(self):
+        counts = {}
+        for key in self.keys:
+            name = rendezvous_choice(self.entries, key).name
+            counts[name] = counts.get(name, 0) + 1
+        # Expected 750, 1500, 750
+        self.assertTrue(650 < counts["a"] < 850, counts)
+        self.assertTrue(1350 < counts["b"] < 1650, counts)
+        self.assertTrue(650 < counts["c"] < 850, counts)
+
+    def test_rendezvous_removal(self):
+        before = {key: rendezvous_choice(self.entries, key) for key in self.keys}
+        remaining = self.entries[:2]
+        for key in self.keys:
+            if before[key] in remaining:
+                self.assertIs(rendezvous_choice(remaining, key), before[key])
+
+    def test_rendezvous_unweighted(self):
+        self.assertIsNone(rendezvous_choice([Entry("z", 0, 0, weight=0)], "key"))
+        self.assertIsNone(rendezvous_choice([], "key"))
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.test.utils import override_settings  # noqa: E402
+
+from finnixmirrors.redirects import RedirectCounter  # noqa: E402
+
+
+class Entry:
+    def __init__(self, capacity=None):
+        self.id = uuid.uuid4()
+        self.capacity = capacity
+
+
+@mock.patch.object(RedirectCounter, "_start_thread")
+class TestRedirectCounter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "redirects": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": self.tmpdir.name,
+                },
+            },
+            ROUTING_SHARE_CACHE="redirects",
+            ROUTING_SHARE_WINDOW=3600,
+            ROUTING_SHARE_BUCKET=300,
+        )
+        self.settings.enable()
+        self.now = 1000000 * 300.0
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmpdir.cleanup()
+
+    def sync(self, counter, offset=0):
+        with mock.patch("time.time", return_value=self.now + offset):
+            counter.sync()
+
+    def record(self, counter, entry, count):
+        for _ in range(count):
+            counter.record(entry)
+
+    def test_window_across_workers(self, start_thread):
+        entry = Entry(capacity=10)
+        workers = [RedirectCounter() for _ in range(3)]
+        for i, worker in enumerate(workers):
+            self.record(worker, entry, i + 1)
+            worker.window_count(entry)
+            self.sync(worker)
+        # Everything synced is visible, plus local unsynced redirects
+        self.sync(workers[0])
+        self.assertEqual(workers[0].window_count(entry), 6)
+        self.record(workers[0], entry, 4)
+        self.assertEqual(workers[0].window_count(entry), 10)
+        self.assertTrue(workers[0].over_capacity(entry))
+        self.assertFalse(workers[0].over_capacity(Entry()))
+
+    def test_bucket_lasts_for_window(self, start_thread):
+        entry = Entry(capacity=10)
+        writer = RedirectCounter()
+        self.record(writer, entry, 3)
+        self.sync(writer)
+        # Later syncs of the writer must not shorten the bucket's lifetime
+        self.sync(writer, 60)
+
+        reader = RedirectCounter()
+        reader.window_count(entry)
+        self.sync(reader, 3600 - 1)
+        self.assertEqual(reader.window_count(entry), 3)
+        self.sync(reader, 3600 + 300)
+        self.assertEqual(reader.window_count(entry), 0)
+
+    def test_counts_accumulate_per_bucket(self, start_thread):
+        entry = Entry(capacity=10)
+        counter = RedirectCounter()
+        counter.window_count(entry)
+        for offset in (0, 10, 20):
+            self.record(counter, entry, 2)
+            self.sync(counter, offset)
+        self.assertEqual(counter.window_count(entry), 6)
+        self.sync(counter, 3600 + 300)
+        self.assertEqual(counter.window_count(entry), 0)
@@ -0,0 +1,169 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.test import SimpleTestCase  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from finnixmirrors.inventory import Inventory, pack_inventory  # noqa: E402
+from finnixmirrors.models import Mirror, MirrorURL  # noqa: E402
+from finnixmirrors.routing import RoutingEntry, RoutingSnapshot  # noqa: E402
+from finnixmirrors.views import redirect_response  # noqa: E402
+
+
+class TestSnapshotFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "routing-snapshot.bin")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_entries(self):
+        mirror = Mirror(
+            slug="mirror",
+            country="US",
+            latitude=45.5,
+            longitude=-122.5,
+            sponsor="Sponsor",
+            sponsor_url="https://sponsor.example.com/",
+        )
+        other = Mirror(slug="other", country="DE")
+        inventory = Inventory(pack_inventory(["finnix-125.iso", "125", "125/a"]))
+        return (
+            RoutingEntry(
+                MirrorURL(
+                    mirror=mirror,
+                    url="https://mirror.example.com/finnix",
+                    protocol="https",
+                    capacity=100,
+                    ewma_throughput=1234567.5,
+                    date_last_trace=timezone.now(),
+                ),
+                inventory,
+            ),
+            RoutingEntry(
+                MirrorURL(mirror=mirror, url="http://mirror.example.com/finnix"),
+                inventory,
+            ),
+            RoutingEntry(MirrorURL(mirror=other, url="https://other.example.com/")),
+        )
+
+    def test_round_trip(self):
+        entries = self.make_entries()
+        expires_at = time.time() + 60
+        RoutingSnapshot(5, entries, expires_at).write(self.path)
+        snapshot = RoutingSnapshot.load(self.path)
+
+        self.assertEqual(snapshot.generation, 5)
+        self.assertEqual(snapshot.expires_at, expires_at)
+        self.assertTrue(snapshot.is_current(5))
+        self.assertFalse(snapshot.is_current(6))
+        self.assertEqual(
+            [x.state() for x in snapshot.entries], [x.state() for x in entries]
+        )
+        self.assertEqual(snapshot.entries[0].id, entries[0].id)
+        self.assertEqual(
+            snapshot.entries[0].date_last_trace, entries[0].date_last_trace
+        )
+        self.assertIs(snapshot.entries[0].inventory, snapshot.entries[1].inventory)
+        self.assertIsNone(snapshot.entries[2].inventory)
+        self.assertEqual(
+            snapshot.routing_key, RoutingSnapshot(5, entries, 0).routing_key
+        )
+
+    def test_mapped_inventory(self):
+        RoutingSnapshot(1, self.make_entries(), 0).write(self.path)
+        entry = RoutingSnapshot.load(self.path).entries[0]
+        self.assertEqual(len(entry.inventory), 3)
+        for path in ("finnix-125.iso", "/125/", "125/a", ""):
+            self.assertTrue(entry.has_path(path), path)
+        for path in ("finnix-124.iso", "125/b", "a"):
+            self.assertFalse(entry.has_path(path), path)
+        self.assertEqual(
+            bytes(entry.inventory),
+            pack_inventory(["finnix-125.iso", "125", "125/a"]),
+        )
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"FMRT\0\1\0\0\0\0\0\0")
+        with self.assertRaises(ValueError):
+            RoutingSnapshot.load(self.path)
+
+
+class Counter:
+    """RedirectCounter stand-in with a fixed set of capped URLs"""
+
+    def __init__(self, capped=()):
+        self.capped = set(capped)
+        self.recorded = []
+
+    def over_capacity(self, entry):
+        return entry.id in self.capped
+
+    def record(self, entry):
+        self.recorded.append(entry)
+
+
+class Reader:
+    """GeoIP reader stand-in locating every client at 0, 0"""
+
+    def city(self, ip):
+        return mock.Mock(location=mock.Mock(latitude=0.0, longitude=0.0))
+
+
+@override_settings(
+    ROUTING_TABLE_FILE=None,
+    ROUTING_SPREAD_CANDIDATES=3,
+    ROUTING_SPREAD_TOLERANCE_KM=0,
+    ROUTING_CAPACITY_CANDIDATES=6,
+)
+class TestCapacity(SimpleTestCase):
+    def setUp(self):
+        # Mirrors about 111 km apart, nearest first
+        self.entries = tuple(
+            RoutingEntry(
+                MirrorURL(
+                    mirror=Mirror(
+                        slug="mirror{}".format(i), latitude=0.001, longitude=i + 0.1
+                    ),
+                    url="https://mirror{}.example.com".format(i),
+                    protocol="https",
+                    capacity=100,
+                )
+            )
+            for i in range(8)
+        )
+        self.snapshot = RoutingSnapshot(1, self.entries, time.time() + 60)
+
+    def redirect(self, capped):
+        counter = Counter(x.id for x in self.entries[:capped])
+        with mock.patch("finnixmirrors.views.get_reader", return_value=Reader()):
+            with mock.patch("finnixmirrors.views.get_counter", return_value=counter):
+                response = redirect_response(self.snapshot, "192.0.2.1", "a.iso")
+        self.assertEqual(response["X-GeoIP-Influenced"], "yes")
+        self.assertEqual(
+            counter.recorded, [x for x in self.entries if x.url in response["Location"]]
+        )
+        return response["Location"]
+
+    def test_nearest(self):
+        self.assertEqual(self.redirect(0), "https://mirror0.example.com/a.iso")
+
+    def test_spill_past_spread_candidates(self):
+        # All of the ROUTING_SPREAD_CANDIDATES nearest are capped
+        self.assertEqual(self.redirect(3), "https://mirror3.example.com/a.iso")
+        self.assertEqual(self.redirect(5), "https://mirror5.example.com/a.iso")
+
+    def test_all_capped(self):
+        # Beyond ROUTING_CAPACITY_CANDIDATES, the nearest is used anyway
+        self.assertEqual(self.redirect(6), "https://mirror0.example.com/a.iso")
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.test.utils import override_settings  # noqa: E402
+
+from finnixmirrors.state import (  # noqa: E402
+    batch_bumps,
+    bump_generation,
+    get_generation,
+)
+
+
+class TestGeneration(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            MIRROR_STATE_GENERATION_FILE=os.path.join(
+                self.tmpdir.name, "mirror-state.generation"
+            )
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmpdir.cleanup()
+
+    def test_bump(self):
+        self.assertEqual(get_generation(), 0)
+        self.assertEqual(bump_generation(), 1)
+        self.assertEqual(get_generation(), 1)
+        with batch_bumps():
+            with batch_bumps():
+                bump_generation()
+            bump_generation()
+            self.assertEqual(get_generation(), 1)
+        self.assertEqual(get_generation(), 2)
+
+    def test_unwritable(self):
+        with override_settings(
+            MIRROR_STATE_GENERATION_FILE=os.path.join(
+                self.tmpdir.name, "missing", "mirror-state.generation"
+            )
+        ):
+            with self.assertLogs(level="ERROR"):
+                self.assertIsNone(bump_generation())
+            self.assertEqual(get_generation(), 0)
@@ -0,0 +1,294 @@
+import atexit
+import contextlib
+import json
+import os
+import tempfile
+import unittest
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "finnixmirrors.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    CaptureQueriesContext,
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.utils import timezone  # noqa: E402
+
+from finnixmirrors.changes import latest_seq, prune_changes  # noqa: E402
+from finnixmirrors.models import (  # noqa: E402
+    ChangeLogState,
+    Mirror,
+    MirrorURL,
+    MirrorURLChange,
+)
+from finnixmirrors.redirects import get_counter  # noqa: E402
+from finnixmirrors.views import _mirror_info  # noqa: E402
+
+_state = {}
+
+
+@contextlib.contextmanager
+def capture_queries():
+    """Capture the queries made on all database connections"""
+    with contextlib.ExitStack() as stack:
+        contexts = [
+            stack.enter_context(CaptureQueriesContext(connections[alias]))
+            for alias in connections
+        ]
+        queries = []
+        yield queries
+    for context in contexts:
+        queries.extend(context.captured_queries)
+
+
+def setUpModule():
+    # Not set in the shipped settings; override_settings() can't restore it
+    settings.SECRET_KEY = "test"
+    _state["tmpdir"] = tempfile.TemporaryDirectory()
+    _state["settings"] = override_settings(
+        MIRROR_STATE_GENERATION_FILE=os.path.join(
+            _state["tmpdir"].name, "mirror-state.generation"
+        ),
+        ROUTING_SNAPSHOT_FILE=os.path.join(
+            _state["tmpdir"].name, "routing-snapshot.bin"
+        ),
+        ALLOWED_HOSTS=["testserver"],
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "redirects": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "redirects",
+            },
+        },
+    )
+    _state["settings"].enable()
+    setup_test_environment()
+    _state["databases"] = setup_databases(verbosity=0, interactive=False)
+
+
+def tearDownModule():
+    # Rather than at exit, after the settings are restored
+    atexit.unregister(get_counter()._shutdown)
+    get_counter()._shutdown()
+    teardown_databases(_state["databases"], verbosity=0)
+    teardown_test_environment()
+    _state["settings"].disable()
+    _state["tmpdir"].cleanup()
+
+
+class TestMirrorQueries(unittest.TestCase):
+    def setUp(self):
+        Mirror.objects.all().delete()
+        self.client = Client()
+        self.now = timezone.now()
+
+    def add_mirror(self, slug, check_success=True, trace_hours=1):
+        mirror = Mirror.objects.create(
+            slug=slug, country="US", latitude=45.0, longitude=-122.0
+        )
+        for protocol in ("http", "https", "rsync"):
+            MirrorURL.objects.create(
+                mirror=mirror,
+                url="{}://{}.example.com/finnix".format(protocol, slug),
+                protocol=protocol,
+                check_success=check_success or protocol != "https",
+                date_last_trace=self.now - timezone.timedelta(hours=trace_hours),
+            )
+        return mirror
+
+    def add_mirrors(self, count):
+        for i in range(Mirror.objects.count(), count):
+            self.add_mirror("mirror{}".format(i))
+
+    def count_queries(self, path):
+        # mirrors.json is otherwise served from the cache
+        cache.clear()
+        with capture_queries() as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, path):
+        self.add_mirrors(2)
+        few = self.count_queries(path)
+        self.add_mirrors(10)
+        self.assertEqual(self.count_queries(path), few)
+
+    def test_index_queries(self):
+        self.assertConstantQueries("/")
+
+    def test_mirrors_json_queries(self):
+        self.assertConstantQueries("/mirrors.json")
+
+    def test_mirror_detail_queries(self):
+        self.add_mirrors(2)
+        self.assertEqual(self.count_queries("/mirror/mirror0/"), 2)
+
+    def test_mirror_status(self):
+        self.add_mirror("good")
+        self.add_mirror("error", check_success=False)
+        self.add_mirror("outdated", trace_hours=1000)
+        bare = Mirror.objects.create(slug="bare", country="US")
+        MirrorURL.objects.create(mirror=bare, url="https://bare/", protocol="https")
+        disabled = self.add_mirror("disabled-url", check_success=False)
+        disabled.mirrorurl_set.filter(check_success=False).update(enabled=False)
+
+        mirrors = {x.slug: x for x in _mirror_info()}
+        self.assertEqual(mirrors["good"].status, "good")
+        self.assertEqual(mirrors["error"].status, "error")
+        self.assertEqual(mirrors["outdated"].status, "outdated")
+        self.assertEqual(mirrors["bare"].status, "good")
+        self.assertIsNone(mirrors["bare"].urls_last_trace)
+        self.assertEqual(mirrors["disabled-url"].status, "good")
+        self.assertEqual(len(mirrors["disabled-url"].mirrorurls), 2)
+        self.assertEqual(
+            mirrors["good"].urls_last_trace,
+            self.now - timezone.timedelta(hours=1),
+        )
+
+
+class TestAsyncViews(unittest.TestCase):
+    def setUp(self):
+        Mirror.objects.all().delete()
+        cache.clear()
+        self.client = Client()
+        mirror = Mirror.objects.create(
+            slug="mirror", country="US", latitude=45.0, longitude=-122.0
+        )
+        MirrorURL.objects.create(
+            mirror=mirror,
+            url="https://mirror.example.com/finnix",
+            protocol="https",
+            check_success=True,
+            date_last_trace=timezone.now(),
+        )
+
+    def test_releases_redirect(self):
+        response = self.client.get("/releases/finnix.iso")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response["Location"], "https://mirror.example.com/finnix/finnix.iso"
+        )
+        self.assertEqual(response["X-GeoIP-Influenced"], "no")
+
+    def test_releases_mirrorlist(self):
+        response = self.client.get("/releases/finnix.iso.mirrorlist")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.content, b"https://mirror.example.com/finnix/finnix.iso\n"
+        )
+
+    def test_releases_metalink(self):
+        response = self.client.get('/releases/finnix "125".iso.meta4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="finnix \\"125\\".iso.meta4"',
+        )
+
+    def test_mirrors_json_not_modified(self):
+        response = self.client.get("/mirrors.json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("mirror", json.loads(response.content)["mirrors"])
+        with capture_queries() as queries:
+            response = self.client.get(
+                "/mirrors.json", HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+
+class TestChangeLog(unittest.TestCase):
+    def setUp(self):
+        self.settings = override_settings(CHANGE_LOG_PAGE_SIZE=2)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        Mirror.objects.all().delete()
+        MirrorURLChange.objects.all().delete()
+        ChangeLogState.objects.all().delete()
+        self.client = Client()
+        self.since = latest_seq()
+        mirror = Mirror.objects.create(slug="mirror", country="US")
+        for protocol in ("http", "https", "rsync"):
+            MirrorURL.objects.create(
+                mirror=mirror,
+                url="{}://mirror.example.com/finnix".format(protocol),
+                protocol=protocol,
+            )
+        self.seqs = list(
+            MirrorURLChange.objects.order_by("seq").values_list("seq", flat=True)
+        )
+
+    def get_changes(self, since, status_code=200):
+        response = self.client.get("/mirrors.json", {"since": since})
+        self.assertEqual(response.status_code, status_code)
+        return json.loads(response.content)
+
+    def age(self, seqs):
+        MirrorURLChange.objects.filter(seq__in=seqs).update(
+            date=timezone.now()
+            - timezone.timedelta(seconds=settings.CHANGE_LOG_RETENTION + 1)
+        )
+        prune_changes()
+
+    def test_pages(self):
+        self.assertEqual(len(self.seqs), 3)
+        data = self.get_changes(self.since)
+        self.assertEqual([x["seq"] for x in data["changes"]], self.seqs[:2])
+        self.assertEqual(data["changes"][0]["event"], "created")
+        self.assertTrue(data["more"])
+        data = self.get_changes(data["seq"])
+        self.assertEqual([x["seq"] for x in data["changes"]], self.seqs[2:])
+        self.assertFalse(data["more"])
+        data = self.get_changes(data["seq"])
+        self.assertEqual(data, {"seq": self.seqs[-1], "more": False, "changes": []})
+        response = self.client.get("/mirrors.json", {"since": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_pruned(self):
+        self.age(self.seqs[:1])
+        self.get_changes(self.since, status_code=410)
+        data = self.get_changes(self.seqs[0])
+        self.assertEqual([x["seq"] for x in data["changes"]], self.seqs[1:])
+
+    def test_status_changes_only(self):
+        mirrorurl = MirrorURL.objects.order_by("url").first()
+        mirrorurl.weight = 2.0
+        mirrorurl.save()
+        mirror = mirrorurl.mirror
+        mirror.sponsor = "Sponsor"
+        mirror.save()
+        self.assertEqual(MirrorURLChange.objects.count(), 3)
+        mirrorurl.enabled = False
+        mirrorurl.save()
+        mirror.enabled = False
+        mirror.save()
+        changes = MirrorURLChange.objects.filter(seq__gt=self.seqs[-1])
+        # The URL, then each URL of the mirror
+        self.assertEqual(changes.count(), 4)
+        self.assertEqual(changes.first().url_id, mirrorurl.id)
+        self.assertFalse(changes.filter(enabled=True))
+        MirrorURL.objects.get(pk=mirrorurl.pk).delete()
+        self.assertEqual(MirrorURLChange.objects.last().event, "deleted")
+
+    def test_all_pruned(self):
+        self.age(self.seqs)
+        self.assertFalse(MirrorURLChange.objects.exists())
+        self.assertEqual(latest_seq(), self.seqs[-1])
+        self.get_changes(self.since, status_code=410)
+        self.get_changes(self.seqs[-2], status_code=410)
+        data = self.get_changes(self.seqs[-1])
+        self.assertEqual(data, {"seq": self.seqs[-1], "more": False, "changes": []})
+        self.assertEqual(
+            json.loads(self.client.get("/mirrors.json").content)["seq"], self.seqs[-1]
+        )